@@ -0,0 +1,262 @@
+import numpy as np
+import threading
+import queue
+import time
+import os
+from StreamingWriter import H5StreamingWriter
+from ResourcePool import LockedResource
+
+
+class DeviceJob(object):
+    """
+    One device wired to one SMU channel. sequence lists the measurements
+    run on it, each one of 'JV Measurement', 'Current Tracking' or
+    'Voltage Tracking'. params overrides the scheduler's defaults.
+    """
+
+    def __init__(self, device, smu, ch=None, sequence=('JV Measurement',), params=None):
+        self.device = device
+        self.smu = smu
+        self.ch = ch
+        self.sequence = tuple(sequence)
+        self.params = params or {}
+
+
+def parse_device_list(text, sequence=('JV Measurement',)):
+    """Jobs from 'device@SMU name[/channel]' entries separated by commas,
+    e.g. 'cell1@Keithley 2450, cell2@Keithley 2600/smub'
+    """
+    jobs = []
+    for entry in text.split(','):
+        if not entry.strip():
+            continue
+        device, smu = entry.split('@')
+        smu, _, ch = smu.partition('/')
+        jobs.append(DeviceJob(device.strip(), smu.strip(), ch.strip() or None, sequence))
+    return jobs
+
+
+class AcquisitionScheduler(object):
+    """
+    Measures a batch of devices on several SMUs at once, with one worker
+    thread per instrument working through that instrument's queue of jobs.
+
+    Every instrument's I/O goes through a LockedResource sharing one lock
+    per bus (the part of the VISA address before '::'), see
+    KeithleyTSPBase.use_bus_lock, so instruments on
+    one GPIB board never talk over each other while instruments on
+    different buses run fully in parallel. Sweeps and tracking run on the
+    instruments' trigger models, a worker only holds the bus to start them
+    and to read the new readings.
+
+    Each measurement of a device is written to a new run group of
+    save_dir/<device>.h5, so all results of a device end up in one file.
+    """
+
+    poll_period = 0.05 #seconds between buffer polls
+    flush_interval = 1.0
+
+    default_params = {
+        'start_voltage': 0.0,
+        'end_voltage': 1.0,
+        'npoints': 101,
+        'jv_delay': 0.0,
+        'constant_v': 0.0,
+        'constant_i': 0.0,
+        'track_time': 60.0,
+        'track_period': 0.1,
+    }
+
+    def __init__(self, instruments, save_dir, params=None, log=None):
+        self.instruments = instruments #name: hardware component
+        self.save_dir = save_dir
+        self.params = dict(self.default_params)
+        self.params.update(params or {})
+        self.log = log
+
+        self.queues = dict((name, queue.Queue()) for name in instruments)
+        self.bus_locks = {}
+        self.device_locks = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.wait_times = {} #name: seconds spent waiting for the bus, once joined
+        self.done = [] #(device, file name) of completed devices
+        self.errors = [] #(device, exception)
+        self.t_start = None
+        self.t_end = None
+
+    def add_job(self, job):
+        if job.smu not in self.queues:
+            raise KeyError('No SMU named ' + job.smu)
+        self.queues[job.smu].put(job)
+
+    def bus(self, hw):
+        return hw.settings['VISA_address'].split('::')[0]
+
+    def start(self):
+        """Start one worker per instrument, returns immediately"""
+        self.stop_event.clear()
+        self.t_start = time.perf_counter()
+        self.t_end = None
+        for name, hw in self.instruments.items():
+            hw.use_bus_lock(self.bus_locks.setdefault(self.bus(hw), threading.Lock()))
+        self.wait_times = {}
+
+        self.workers = [threading.Thread(target=self.worker, args=(name,), name='AcquisitionScheduler ' + name, daemon=True)
+                        for name in self.instruments]
+        for w in self.workers:
+            w.start()
+
+    def running(self):
+        return any(w.is_alive() for w in self.workers)
+
+    def stop(self):
+        #workers abort their present measurement and skip the rest of the queue
+        self.stop_event.set()
+
+    def join(self):
+        for w in self.workers:
+            w.join()
+        for name, hw in self.instruments.items():
+            self.wait_times[name] = self.wait_time(hw)
+            hw.use_bus_lock(None)
+        if self.t_end is None:
+            self.t_end = time.perf_counter()
+
+    def run(self):
+        """Measure every queued job, blocks until all are done"""
+        self.start()
+        self.join()
+        return self.done
+
+    def elapsed(self):
+        if self.t_start is None:
+            return 0
+        return (self.t_end or time.perf_counter()) - self.t_start
+
+    def devices_per_hour(self):
+        elapsed = self.elapsed()
+        return len(self.done)/elapsed*3600 if elapsed > 0 else 0
+
+    def wait_time(self, hw):
+        #the resource is only wrapped while the workers run
+        resource = getattr(hw, 'keithley', None)
+        return resource.wait_time if isinstance(resource, LockedResource) else 0
+
+    def report(self):
+        lines = ['{:d} devices in {:.1f} s, {:.1f} devices/hour'.format(len(self.done), self.elapsed(), self.devices_per_hour())]
+        for name, hw in self.instruments.items():
+            wait_time = self.wait_times[name] if name in self.wait_times else self.wait_time(hw)
+            lines.append('{}: {:.2f} s waiting for bus {}'.format(name, wait_time, self.bus(hw)))
+        for device, e in self.errors:
+            lines.append('{} failed: {}'.format(device, e))
+        return '\n'.join(lines)
+
+    def worker(self, name):
+        hw = self.instruments[name]
+        jobs = self.queues[name]
+        while not self.stop_event.is_set():
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fname = self.measure_device(hw, job)
+            except Exception as e:
+                #a failed device must not stop the rest of the batch
+                with self.lock:
+                    self.errors.append((job.device, e))
+                if self.log is not None:
+                    self.log.error('{} on {} failed: {}'.format(job.device, name, e))
+                continue
+            with self.lock:
+                self.done.append((job.device, fname))
+
+    def measure_device(self, hw, job):
+        params = dict(self.params)
+        params.update(job.params)
+        fname = os.path.join(self.save_dir, job.device + '.h5')
+
+        #one writer at a time per device file, in case a device is on two SMUs
+        with self.lock:
+            device_lock = self.device_locks.setdefault(job.device, threading.Lock())
+
+        with device_lock:
+            for kind in job.sequence:
+                if self.stop_event.is_set():
+                    break
+                writer = H5StreamingWriter(fname, self.flush_interval)
+                run_group = writer.run_group
+                run_group.attrs['Measurement'] = kind
+                run_group.attrs['SMU'] = hw.name
+                run_group.attrs['Channel'] = job.ch or ''
+                for key, value in params.items():
+                    run_group.attrs[key] = value
+                try:
+                    if kind == 'JV Measurement':
+                        self.run_sweep(hw, job.ch, params, writer)
+                    else:
+                        self.run_tracking(hw, job.ch, kind, params, writer)
+                finally:
+                    writer.close()
+        return fname
+
+    def run_sweep(self, hw, ch, params, writer):
+        args = (ch,) if ch else ()
+        vlist = np.linspace(params['start_voltage'], params['end_voltage'], int(params['npoints']))
+        hw.start_sweep(vlist, params['jv_delay'], *args)
+        t0 = None
+        n_read = 0
+        running = True
+        while running:
+            if self.stop_event.is_set():
+                hw.abort_sweep(*args)
+                break
+
+            running = hw.sweep_running(*args)
+            n = hw.read_buffer_count(*args)
+            if n > n_read:
+                v, i, t = hw.read_sweep(n_read+1, n, *args)
+                if t0 is None:
+                    t0 = t[0]
+                writer.push(t - t0, v, i)
+                n_read = n
+
+            if running:
+                time.sleep(self.poll_period)
+        hw.set_output('Off', *args)
+
+    def run_tracking(self, hw, ch, kind, params, writer):
+        args = (ch,) if ch else ()
+        if kind == 'Current Tracking':
+            source, measure, level = 'Voltage', 'Current', params['constant_v']
+        else:
+            source, measure, level = 'Current', 'Voltage', params['constant_i']
+        hw.set_source(source, *args)
+        hw.set_measureFunc(measure, *args)
+        hw.set_output('On', *args)
+        hw.set_level(level, *args)
+
+        period = params['track_period']
+        hw.start_tracking(period, max(1, int(round(params['track_time']/period))), *args)
+        t0 = None
+        n_read = 0
+        running = True
+        while running:
+            if self.stop_event.is_set():
+                break
+
+            running = hw.tracking_running(*args)
+            n = hw.read_buffer_count(*args)
+            if n > n_read:
+                y, t = hw.read_tracking(n_read+1, n, *args)
+                if t0 is None:
+                    t0 = t[0]
+                writer.push(t - t0, level, y)
+                n_read = n
+
+            if running:
+                time.sleep(self.poll_period)
+        hw.abort_tracking(*args)
+        hw.set_output('Off', *args)
@@ -0,0 +1,89 @@
+import numpy as np
+from JVParameters import JVParameters
+
+
+def interval_errors(v, i):
+    """Estimated error of linear interpolation on each interval of the
+    points v, i (sorted by v), h^2/8 times the curvature |I''| at the ends
+    of the interval
+    """
+    h = np.diff(v)
+    slope = np.diff(i)/h
+    curvature = np.abs(np.diff(slope))/((h[:-1] + h[1:])/2)
+    ends = np.zeros(h.size)
+    ends[:-1] = curvature
+    ends[1:] = np.maximum(ends[1:], curvature)
+    return ends*h**2/8
+
+
+def refine_voltages(v, i, n, min_step=1e-4):
+    """Up to n new voltages at the midpoints of the intervals of v, i (sorted
+    by v) with the largest interpolation error. The intervals around Voc and
+    the maximum power point are always split, they set the parameters
+    """
+    h = np.diff(v)
+    errors = interval_errors(v, i)
+    errors[h < 2*min_step] = 0
+
+    voc = np.flatnonzero((i[:-1]*i[1:] <= 0) & (i[:-1] != i[1:]))[:1]
+    mpp = int(np.argmax(-v*i))
+    forced = list(voc) + [mpp-1, mpp]
+
+    order = [k for k in forced if 0 <= k < h.size and errors[k] > 0]
+    order += [k for k in np.argsort(errors)[::-1] if errors[k] > 0 and k not in order]
+    chosen = np.array(order[:n], dtype=int)
+    new = v[chosen] + h[chosen]/2
+
+    #Voc is interpolated across its interval, which is cut in four to close in on it faster
+    if voc.size and voc[0] in chosen and n >= 3:
+        new = np.concatenate((new[:n-2], v[voc] + h[voc]*np.array([0.25, 0.75])))
+    return np.sort(new)
+
+
+def adaptive_sweep(measure, start, stop, coarse_points, max_points, tolerance):
+    """
+    JV sweep on a coarse uniform grid, refined where the curve bends until
+    Voc, FF and Pmax change by less than tolerance (relative) from one pass
+    to the next, or max_points are measured.
+
+    measure(vlist) sweeps the given voltages and returns the measured
+    voltages and currents, and any further columns such as timestamps, or
+    None to stop. Every pass sweeps in the direction from start to stop.
+    Returns the columns of all points sorted in that direction and the
+    number of passes.
+    """
+    direction = 1 if stop >= start else -1
+    columns = None
+    vlist = np.linspace(start, stop, min(coarse_points, max_points))
+    previous = None
+    passes = 0
+
+    while vlist.size:
+        result = measure(vlist)
+        if result is None:
+            break
+        passes += 1
+        if columns is None:
+            columns = [np.asarray(c, dtype=float) for c in result]
+        else:
+            columns = [np.concatenate((c, new)) for c, new in zip(columns, result)]
+        order = np.argsort(columns[0], kind='stable')
+        columns = [c[order] for c in columns]
+        v_all, i_all = columns[:2]
+
+        params = JVParameters()
+        params.update(v_all, i_all)
+        values = np.array([params.Voc, params.FF, params.Pmax])
+        if previous is not None and np.allclose(values, previous, rtol=tolerance, atol=0, equal_nan=True):
+            break
+        previous = values
+
+        #each pass adds up to half as many points as there are, within the budget
+        n = min(max_points - v_all.size, max(4, v_all.size//2))
+        if n <= 0:
+            break
+        vlist = refine_voltages(v_all, i_all, n)[::direction]
+
+    if columns is None:
+        return [], passes
+    return [c[::direction] for c in columns], passes
@@ -0,0 +1,78 @@
+from ScopeFoundry import Measurement
+from AcquisitionScheduler import AcquisitionScheduler, parse_device_list
+import time
+
+
+class BatchMeasure(Measurement):
+    """Measures a batch of devices on every SMU at once, see AcquisitionScheduler"""
+
+    name = "Batch Measurement"
+
+    sequences = {
+        'JV Measurement': ('JV Measurement',),
+        'Current Tracking': ('Current Tracking',),
+        'Voltage Tracking': ('Voltage Tracking',),
+        'JV + Current Tracking': ('JV Measurement', 'Current Tracking'),
+    }
+
+    def setup(self):
+        #device@SMU name[/channel], comma separated
+        self.settings.New('devices', dtype=str, initial='cell1@Keithley 2450, cell2@Keithley 2600')
+        self.settings.New('sequence', dtype=str, initial='JV Measurement', choices=tuple(self.sequences))
+        self.settings.New('start_voltage',dtype=float,initial=0, unit='V', si= True)
+        self.settings.New('end_voltage',dtype=float,initial=1, unit='V', si= True)
+        self.settings.New('npoints',dtype=int,initial=101, vmin=1)
+        self.settings.New('jv_delay',dtype=float,initial=0, unit='s', si= True)
+        self.settings.New('constant_v',dtype=float,initial=0, unit='V', si= True)
+        self.settings.New('constant_i',dtype=float,initial=0, unit='A', si= True)
+        self.settings.New('track_time',dtype=float,initial=60, unit='s', si= True)
+        self.settings.New('track_period',dtype=float,initial=0.1, unit='s', si= True)
+        self.settings.New('devices_done', dtype=int, initial=0, ro=True)
+        self.settings.New('devices_per_hour', dtype=float, initial=0, ro=True)
+
+        self.display_update_period = 0.5 #seconds
+
+    def setup_figure(self):
+        self.ui = self.settings.New_UI()
+
+    def run(self):
+        S = self.settings
+
+        jobs = parse_device_list(S['devices'], self.sequences[S['sequence']])
+        smus = sorted(set(job.smu for job in jobs))
+        #every SMU is claimed before any is touched, a batch doesn't start on an SMU in use
+        claimed = []
+        try:
+            for name in smus:
+                self.app.hardware[name].claim(self)
+                claimed.append(name)
+            self.run_batch(jobs, smus)
+        finally:
+            for name in claimed:
+                self.app.hardware[name].release(self)
+
+    def run_batch(self, jobs, smus):
+        S = self.settings
+        for name in smus:
+            if not self.app.hardware[name].settings['connected']:
+                self.app.hardware[name].settings['connected'] = True
+
+        params = dict((key, S[key]) for key in AcquisitionScheduler.default_params)
+        self.scheduler = AcquisitionScheduler(dict((name, self.app.hardware[name]) for name in smus),
+                                              self.app.settings['save_dir'], params, self.log)
+        for job in jobs:
+            self.scheduler.add_job(job)
+
+        self.scheduler.start()
+        while self.scheduler.running():
+            if self.interrupt_measurement_called:
+                self.scheduler.stop()
+            S['devices_done'] = len(self.scheduler.done)
+            S['devices_per_hour'] = self.scheduler.devices_per_hour()
+            self.set_progress(100*len(self.scheduler.done)/max(len(jobs), 1))
+            time.sleep(0.1)
+        self.scheduler.join()
+
+        S['devices_done'] = len(self.scheduler.done)
+        S['devices_per_hour'] = self.scheduler.devices_per_hour()
+        self.log.info(self.scheduler.report())
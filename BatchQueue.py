@@ -0,0 +1,136 @@
+import numpy as np
+import time
+
+
+class SPSCQueue(object):
+    """
+    Bounded single producer, single consumer queue.
+
+    The producer only advances tail and the consumer only advances head,
+    each stored with one assignment, so no lock is needed between the two
+    threads. put() never blocks: when the queue is full the item is dropped
+    and counted in dropped.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = [None]*capacity
+        self.head = 0 #next item to get, written by the consumer only
+        self.tail = 0 #next slot to put, written by the producer only
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def put(self, item):
+        depth = self.tail - self.head
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+        self.slots[self.tail % self.capacity] = item
+        self.tail += 1
+        if depth + 1 > self.high_water:
+            self.high_water = depth + 1
+        return True
+
+    def get(self):
+        if self.head == self.tail:
+            return None
+        k = self.head % self.capacity
+        item, self.slots[k] = self.slots[k], None
+        self.head += 1
+        return item
+
+
+class BatchPublisher(object):
+    """
+    Collects points per key (the channel) into batches of batch_size and
+    puts them on queue as (key, generation, (time, source, value)). A batch
+    is put when it is full or once it is max_age seconds old, checked by
+    add() and by flush_stale(), which the producer calls while it waits, so
+    slow acquisitions still reach the display promptly.
+
+    Every method runs on the producer thread, which keeps the queue single
+    producer without a lock. clear() does not go through the queue, where
+    it could be dropped. It counts up the generation of the key, see
+    BatchConsumer.
+    """
+
+    def __init__(self, queue, batch_size=256, max_age=0.05):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.pending = {} #key: (columns, points filled)
+        self.generations = {} #key: number of clears, written by the producer only
+        self.last_put = time.perf_counter()
+
+    def add(self, key, t, source, value):
+        n = np.size(value)
+        columns = [np.broadcast_to(c, (n,)) for c in (t, source, value)]
+        done = 0
+        while done < n:
+            batch, filled = self.pending.get(key) or ([np.empty(self.batch_size) for c in columns], 0)
+            take = min(self.batch_size - filled, n - done)
+            for b, c in zip(batch, columns):
+                b[filled:filled+take] = c[done:done+take]
+            done += take
+            self.pending[key] = (batch, filled + take)
+            if filled + take == self.batch_size:
+                self._put(key)
+        self.flush_stale()
+
+    def _put(self, key):
+        batch, filled = self.pending.pop(key)
+        self.queue.put((key, self.generations.get(key, 0), [b[:filled] for b in batch]))
+        self.last_put = time.perf_counter()
+
+    def flush(self):
+        for key in list(self.pending):
+            self._put(key)
+        self.last_put = time.perf_counter()
+
+    def flush_stale(self):
+        #points left waiting when the acquisition goes quiet
+        if self.pending and time.perf_counter() - self.last_put >= self.max_age:
+            self.flush()
+
+    def clear(self, key):
+        self.pending.pop(key, None)
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+
+class BatchConsumer(object):
+    """
+    Consumer side of a BatchPublisher, moves its batches into stores,
+    {key: buffer with extend(time, source, value) and clear()}. A store is
+    cleared when the publisher's generation of its key has moved on, and
+    batches put before that clear are discarded.
+    """
+
+    def __init__(self, publisher, stores):
+        self.publisher = publisher
+        self.stores = stores
+        self.generations = dict.fromkeys(stores, 0)
+
+    def _catch_up(self, key, generation):
+        #True if batches of generation belong in the store
+        if generation > self.generations[key]:
+            self.stores[key].clear()
+            self.generations[key] = generation
+        return generation == self.generations[key]
+
+    def consume(self):
+        """Move everything queued into the stores, returns the number of batches"""
+        for key in self.stores:
+            self._catch_up(key, self.publisher.generations.get(key, 0))
+        n = 0
+        while True:
+            item = self.publisher.queue.get()
+            if item is None:
+                break
+            key, generation, columns = item
+            if self._catch_up(key, generation):
+                self.stores[key].extend(*columns)
+            n += 1
+        return n
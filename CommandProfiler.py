@@ -0,0 +1,166 @@
+import numpy as np
+import threading
+import math
+import time
+import re
+from contextlib import contextmanager
+
+
+class CommandProfiler(object):
+    """
+    Call counts, total time and latency histograms keyed by (kind, label).
+
+    The hardware components record every instrument command through
+    ProfiledResource, kinds 'write', 'query', 'read' and so on, with the
+    numbers in the command replaced by # so repeated commands add up.
+    Measurements record the phases of their runs with kind 'phase'.
+    Recording a command takes a few microseconds, labelling included.
+    """
+
+    #histogram bins are bins_per_decade per decade from min_time, the last one open ended
+    min_time = 1e-6
+    bins_per_decade = 4
+    nbins = 33
+
+    #numbers that are not part of a name like defbuffer1 or REAL64
+    _numbers = re.compile(r"(?<![\w.])[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+    _lists = re.compile(r"#(\s*,\s*#)+")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {} #(kind, label): [calls, total, min, max, histogram]
+
+    @classmethod
+    def edges(cls):
+        """Upper edges of the histogram bins in seconds, the last one is inf"""
+        edges = cls.min_time*10**(np.arange(1, cls.nbins + 1)/cls.bins_per_decade)
+        edges[-1] = np.inf
+        return edges
+
+    @classmethod
+    def command_label(cls, cmd, max_length=80):
+        #numbers vary from call to call, the command they are sent with does not
+        label = cls._lists.sub('#,...', cls._numbers.sub('#', cmd.strip()))
+        if len(label) > max_length:
+            label = label[:max_length-3] + '...'
+        return label
+
+    def record(self, kind, label, seconds):
+        k = int(self.bins_per_decade*math.log10(max(seconds, self.min_time)/self.min_time))
+        k = min(k, self.nbins - 1)
+        with self.lock:
+            entry = self.entries.get((kind, label))
+            if entry is None:
+                entry = self.entries[(kind, label)] = [0, 0.0, seconds, seconds, [0]*self.nbins]
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds < entry[2]:
+                entry[2] = seconds
+            if seconds > entry[3]:
+                entry[3] = seconds
+            entry[4][k] += 1
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record('phase', name, time.perf_counter() - t0)
+
+    def rows(self):
+        """
+        One dict per (kind, label), slowest in total first, with calls,
+        total, mean, min and max in seconds, p50 and p95 (geometric centre of
+        the histogram bin the quantile falls in) and the histogram counts.
+        """
+        with self.lock:
+            entries = [(key, list(entry[:4]) + [list(entry[4])]) for key, entry in self.entries.items()]
+        centres = self.edges()/10**(0.5/self.bins_per_decade)
+        rows = []
+        for (kind, label), (calls, total, tmin, tmax, hist) in entries:
+            cumulative = np.cumsum(hist)
+            p50, p95 = (min(max(centres[np.searchsorted(cumulative, q*calls)], tmin), tmax) for q in (0.5, 0.95))
+            rows.append({'kind': kind, 'label': label, 'calls': calls, 'total': total, 'mean': total/calls,
+                         'min': tmin, 'max': tmax, 'p50': p50, 'p95': p95, 'histogram': hist})
+        rows.sort(key=lambda row: -row['total'])
+        return rows
+
+
+def export_profiles(fname, profilers):
+    """Write the rows of the named profilers, {source: CommandProfiler}, to
+    one CSV table with a column per histogram bin
+    """
+    import csv
+    columns = ('calls', 'total', 'mean', 'min', 'max', 'p50', 'p95')
+    edges = CommandProfiler.edges()
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('source', 'kind', 'label') + tuple(c if c == 'calls' else c + '_s' for c in columns)
+                        + tuple('le_{:.3g}s'.format(edge) for edge in edges))
+        for source, profiler in profilers.items():
+            for row in profiler.rows():
+                writer.writerow([source, row['kind'], row['label']] + [row[c] for c in columns] + row['histogram'])
+
+
+def save_profiles_h5(group, profilers, name='profile'):
+    """Store the rows of the named profilers in the HDF5 group as a compound
+    dataset with the columns of export_profiles, the histogram counts in one
+    array column and the bin edges as an attribute
+    """
+    import h5py
+    columns = ('calls', 'total', 'mean', 'min', 'max', 'p50', 'p95')
+    edges = CommandProfiler.edges()
+    text = h5py.string_dtype()
+    dtype = ([('source', text), ('kind', text), ('label', text), ('calls', 'i8')]
+             + [(c + '_s', 'f8') for c in columns[1:]] + [('histogram', 'i8', (len(edges),))])
+    rows = [(source, row['kind'], row['label']) + tuple(row[c] for c in columns) + (row['histogram'],)
+            for source, profiler in profilers.items() for row in profiler.rows()]
+    ds = group.create_dataset(name, data=np.array(rows, dtype=dtype))
+    ds.attrs['histogram_edges_s'] = edges
+
+
+class ProfiledResource(object):
+    """pyvisa resource wrapper that records the latency of every command in
+    profiler. Everything else, such as timeout, goes straight to the resource
+    """
+
+    def __init__(self, resource, profiler):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'profiler', profiler)
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resource, name, value)
+
+    def _timed(self, kind, cmd, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            #failed commands are recorded too, timeouts are what a post-mortem looks for
+            self.profiler.record(kind, CommandProfiler.command_label(cmd), time.perf_counter() - t0)
+
+    def write(self, cmd, *args, **kwargs):
+        return self._timed('write', cmd, self.resource.write, cmd, *args, **kwargs)
+
+    def query(self, cmd, *args, **kwargs):
+        return self._timed('query', cmd, self.resource.query, cmd, *args, **kwargs)
+
+    def query_binary_values(self, cmd, *args, **kwargs):
+        return self._timed('query', cmd, self.resource.query_binary_values, cmd, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._timed('read', '', self.resource.read, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        return self._timed('read', 'raw', self.resource.read_raw, *args, **kwargs)
+
+    def clear(self):
+        return self._timed('clear', '', self.resource.clear)
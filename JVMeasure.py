@@ -1,14 +1,21 @@
-from ScopeFoundry import Measurement, h5_io
-from ScopeFoundry.helper_funcs import sibling_path, load_qt_ui_file
-from qtpy import QtWidgets,QtCore
-from PyQt5 import QtGui
-import pyqtgraph as pg
+from ScopeFoundry import Measurement
+from ScopeFoundry.helper_funcs import sibling_path
+from qtpy import QtCore
+from UiCache import load_qt_ui_file_cached
 import numpy as np
 import time
 from datetime import datetime
+from MeasurementBuffer import MeasurementBuffer
+from BatchQueue import SPSCQueue, BatchPublisher, BatchConsumer
+from JVParameters import JVParameters, hysteresis_index
+from AdaptiveSweep import adaptive_sweep
+from SweepStatistics import sweep_statistics
+from StreamingWriter import StreamingWriter, H5StreamingWriter, companion_suffixes
+from CommandProfiler import CommandProfiler, export_profiles, save_profiles_h5
 import os
 import re
-# from .XAutoPanTool import XAutoPanTool
+from XAutoPanTool import XAutoPanTool
+from PeakDecimator import PeakDecimator
 
 
 class JVMeasure(Measurement):
@@ -16,23 +23,67 @@ class JVMeasure(Measurement):
 
     name = "JV Measurement"
 
-    hardware_requirements = ['Keithley 2450']
-
     measurement_sucessfully_completed = QtCore.Signal(())    
 
     def setup(self):
-        self.ui = load_qt_ui_file(sibling_path(__file__, 'JVMeasurement_ui.ui'))
-        self.settings.New('Measurement', dtype= str, initial='JV Measurement', choices = ('JV Measurement','Current Tracking', 'Voltage Tracking'))
+        self.ui = load_qt_ui_file_cached(sibling_path(__file__, 'JVMeasurement_ui.ui'))
+        self.settings.New('Measurement', dtype= str, initial='JV Measurement', choices = ('JV Measurement','Current Tracking', 'Voltage Tracking', 'MPP Tracking'))
         self.settings.New('start_voltage',dtype=float,initial=0, unit='V', si= True)
         self.settings.New('end_voltage',dtype=float,initial=1, unit='V', si= True)
         self.settings.New('npoints',dtype=int,initial=101, vmin=1)
+        self.settings.New('sweep_mode', dtype=str, initial='Buffered', choices=('Buffered','Point by Point','Adaptive'))
+        #adaptive sweeps refine a coarse grid until Voc, FF and Pmax settle to adaptive_tolerance, with at most npoints
+        self.settings.New('adaptive_coarse_points', dtype=int, initial=21, vmin=3)
+        self.settings.New('adaptive_tolerance', dtype=float, initial=1e-3, vmin=0)
+        self.settings.New('track_mode', dtype=str, initial='Point by Point', choices=('Point by Point','Buffered'))
         self.settings.New('constant_v',dtype=float,initial=0, unit='V', si= True)
         self.settings.New('itrack_delay',dtype=float,initial=0.1, unit='s', si= True)
         self.settings.New('constant_i',dtype=float,initial=0, unit='A', si= True)
         self.settings.New('vtrack_delay',dtype=float,initial=0.1, unit='s', si= True)
-
-        self.counter = 0
+        self.settings.New('jv_delay',dtype=float,initial=0, unit='s', si= True)
+        #readings the SMU averages into every point with its repeat filter, see Filter_Count
+        self.settings.New('point_average', dtype=int, initial=1, vmin=1, vmax=100)
+        #back to back buffered sweeps of a JV run, saved one by one and as mean, std and outlier masks
+        self.settings.New('sweep_repeats', dtype=int, initial=1, vmin=1)
+        self.settings.New('outlier_sigma', dtype=float, initial=5, vmin=0) #robust sigmas from the median, 0 keeps every reading
+        self.settings.New('achieved_rate', dtype=float, initial=0, unit='Hz', si=True, ro=True)
+        self.settings.New('missed_deadlines', dtype=int, initial=0, ro=True)
+        self.settings.New('save_mode', dtype=str, initial='Streaming', choices=('Streaming','HDF5','End of Run'))
+        self.settings.New('flush_interval', dtype=float, initial=1.0, vmin=0.01, unit='s', si=True)
+        #command and phase profile of each run, in the run group of HDF5 files and next to CSV files as <name>_profile.csv.
+        #off by default so data folders hold only data, the Command Profile measurement shows it live
+        self.settings.New('save_profile', dtype=bool, initial=False)
+        self.settings.New('track_window', dtype=int, initial=0, vmin=0) #points kept while tracking, 0 keeps everything
+        self.settings.New('dual_channel', dtype=bool, initial=False) #run smua and smub together on a 2600
+        self.settings.New('show_parameters', dtype=bool, initial=True)
+        #MPP tracking starts at mpp_start_v and stays within the JV start and end voltages
+        self.settings.New('mpp_start_v', dtype=float, initial=0.5, unit='V', si=True)
+        self.settings.New('mpp_step', dtype=float, initial=5e-3, vmin=0, unit='V', si=True)
+        self.settings.New('mpp_report_period', dtype=float, initial=0.1, vmin=0.01, unit='s', si=True)
+        self.settings.New('mpp_loop_rate', dtype=float, initial=0, unit='Hz', si=True, ro=True)
+        #points reach the display in batches through a queue, the display rate follows the repaint cost
+        self.settings.New('display_rate', dtype=float, initial=0, unit='Hz', si=True, ro=True)
+        self.settings.New('queue_depth', dtype=int, initial=0, ro=True)
+        self.settings.New('queue_dropped', dtype=int, initial=0, ro=True)
+        self.settings.New('cell_area', dtype=float, initial=1.0, vmin=0, unit='cm^2') #for Jsc and PCE
+        self.settings.New('light_intensity', dtype=float, initial=100, vmin=0, unit='mW/cm^2')
+
+        #use whichever Keithley the app has loaded, the first one by default
+        smu_names = [name for name, hw in self.app.hardware.items() if hasattr(hw, 'start_sweep')]
+        self.settings.New('SMU', dtype=str, initial=smu_names[0], choices=tuple(smu_names))
+
+        self.file_counters = {}
+        self.parameters = {}
+        self.previous_sweeps = {} #(SMU, channel, direction): JVParameters of the last sweep, for the hysteresis index
         self.display_update_period = 0.1 #seconds
+        self.display_period_range = (0.05, 1.0) #seconds, the display rate adapts within this range
+        self.display_load = 0.25 #fraction of the GUI thread's time spent repainting
+        self.batch_size = 256 #points per display batch
+        self.queue_capacity = 256 #batches
+        self.display_buckets = 2000 #tracking lines show at most twice this many points
+        self.buffer_poll_period = 0.05 #seconds
+        self.track_buffer_size = 100000 #readings per buffered tracking block
+        self.profiler = CommandProfiler() #phases of each run, the SMU profiles its commands
 
         initial_save_dir = 'C:\\Users\\solaradmin\\Desktop\\Solar Data\\Miscellaneous'
         self.app.settings.save_dir.default_dir = initial_save_dir
@@ -40,7 +91,8 @@ class JVMeasure(Measurement):
 
         # self.threadpool = QtCore.QThreadPool()
 
-        self.keithley = self.app.hardware['Keithley 2450']
+        self.keithley = self.app.hardware[self.settings['SMU']]
+        self.settings.SMU.add_listener(self.smu_change)
 
         self.ui.start_pushButton.clicked.connect(self.start)
         self.ui.interrupt_pushButton.clicked.connect(self.interrupt)
@@ -52,13 +104,42 @@ class JVMeasure(Measurement):
         self.settings.start_voltage.connect_to_widget(self.ui.startV_doubleSpinBox)
         self.settings.end_voltage.connect_to_widget(self.ui.endV_doubleSpinBox)
         self.settings.npoints.connect_to_widget(self.ui.npoints_spinBox)
-        self.keithley.settings.Measure_Delay.connect_to_widget(self.ui.JVdelaytime_doubleSpinBox)
+        self.settings.jv_delay.connect_to_widget(self.ui.JVdelaytime_doubleSpinBox)
         self.settings.constant_v.connect_to_widget(self.ui.voltage_doubleSpinBox)
         self.settings.constant_i.connect_to_widget(self.ui.current_doubleSpinBox)
         self.settings.itrack_delay.connect_to_widget(self.ui.delay_itrack_doubleSpinBox)
         self.settings.vtrack_delay.connect_to_widget(self.ui.delay_vtrack_doubleSpinBox)
+        self.settings.show_parameters.connect_to_widget(self.ui.fittedparams_checkBox)
+        self.settings.show_parameters.add_listener(self.update_parameters_label)
         self.set_progress(0)
 
+        self.add_operation('Recover Partial Files', self.recover_partial_files)
+
+    def recover_partial_files(self):
+        #turn .part files left by a crashed run into normal data files, runs still being written are skipped
+        for fname in StreamingWriter.recover_dir(self.app.settings['save_dir']):
+            self.log.info('recovered ' + fname)
+
+    def smu_change(self):
+        self.keithley = self.app.hardware[self.settings['SMU']]
+
+    def active_channels(self):
+        #channels used by this run, None is the SMU's selected channel
+        if self.settings['dual_channel'] and self.settings['Measurement'] == 'MPP Tracking':
+            self.log.warning('MPP tracking runs on one channel, using ' + self.keithley.name + "'s selected channel")
+        elif self.settings['dual_channel']:
+            if hasattr(self.keithley, 'start_dual_sweep'):
+                return list(self.keithley.channels)
+            self.log.warning(self.keithley.name + ' has a single channel, running on it alone')
+        return [None]
+
+    def channel_args(self):
+        #extra arguments that point the SMU commands at each channel of the run
+        return [(ch,) if ch else () for ch in self.channels]
+
+    def channel_suffix(self, ch):
+        return '_' + ch if ch else ''
+
     def measurement_change(self):
         if self.settings['Measurement'] == 'JV Measurement':
             self.jv_plot.setLabel('left', 'Current', units = 'A')
@@ -66,6 +147,9 @@ class JVMeasure(Measurement):
         elif self.settings['Measurement'] == 'Current Tracking':
             self.jv_plot.setLabel('left', 'Current', units = 'A')
             self.jv_plot.setLabel('bottom', 'Seconds', units = 's')
+        elif self.settings['Measurement'] == 'MPP Tracking':
+            self.jv_plot.setLabel('left', 'Power', units = 'W')
+            self.jv_plot.setLabel('bottom', 'Seconds', units = 's')
         else:
             self.jv_plot.setLabel('left', 'Voltage', units = 'V')
             self.jv_plot.setLabel('bottom', 'Seconds', units = 's')
@@ -76,85 +160,222 @@ class JVMeasure(Measurement):
         self.ui.start_pushButton.setEnabled(False)
         self.ui.measurement_comboBox.setEnabled(False)
 
-        for lqname in "Measurement start_voltage end_voltage npoints constant_v itrack_delay constant_i vtrack_delay".split():
+        for lqname in "Measurement start_voltage end_voltage npoints sweep_mode track_mode constant_v itrack_delay constant_i vtrack_delay jv_delay track_window save_mode flush_interval save_profile SMU dual_channel cell_area light_intensity mpp_start_v mpp_step mpp_report_period adaptive_coarse_points adaptive_tolerance point_average sweep_repeats outlier_sigma".split():
             self.settings.as_dict()[lqname].change_readonly(True)
 
         self.keithley.settings.as_dict()['Measure_Delay'].change_readonly(True)
+        self.keithley.settings.as_dict()['Filter_Count'].change_readonly(True)
 
     def unlock_start_button(self):
         self.op_buttons['start'].setEnabled(True)
         self.ui.start_pushButton.setEnabled(True)
         self.ui.measurement_comboBox.setEnabled(True)
 
-        for lqname in "Measurement start_voltage end_voltage npoints constant_v itrack_delay constant_i vtrack_delay".split():
+        for lqname in "Measurement start_voltage end_voltage npoints sweep_mode track_mode constant_v itrack_delay constant_i vtrack_delay jv_delay track_window save_mode flush_interval save_profile SMU dual_channel cell_area light_intensity mpp_start_v mpp_step mpp_report_period adaptive_coarse_points adaptive_tolerance point_average sweep_repeats outlier_sigma".split():
             self.settings.as_dict()[lqname].change_readonly(False)
 
         self.keithley.settings.as_dict()['Measure_Delay'].change_readonly(False)
+        self.keithley.settings.as_dict()['Filter_Count'].change_readonly(False)
 
-    def fileExists(self,fname):
-        return os.path.isfile(fname)
-
-    def save_file(self):
+    def next_data_filename(self):
         dirname = self.app.settings['save_dir']
         sample_filename = self.app.settings['sample']
-        counter_sample_filename = sample_filename+'_'+str(self.counter)
 
         if sample_filename=='':
-            self.counter = 0
             now = datetime.now()
             dt_string = now.strftime("%Y%m%d_%Hh%Mm%Ss")
-            data_filename = os.path.join(dirname,dt_string)
+            return os.path.join(dirname,dt_string)
+
+        #the directory is scanned once per sample, after that the counter is kept in memory
+        key = (dirname, sample_filename)
+        if key not in self.file_counters:
+            self.file_counters[key] = self.scan_file_counter(dirname, sample_filename)
+        counter = self.file_counters[key]
+        self.file_counters[key] += 1
+
+        if counter == 0:
+            return os.path.join(dirname,sample_filename)
+        return os.path.join(dirname,sample_filename+'_'+str(counter))
+
+    def scan_file_counter(self, dirname, sample_filename):
+        pattern = re.compile(re.escape(sample_filename) + r'(_(\d+))?(_smu[ab])?\.csv(\.part)?$')
+        counter = 0
+        for fname in os.listdir(dirname):
+            m = pattern.match(fname)
+            if m:
+                counter = max(counter, int(m.group(2) or 0) + 1)
+        return counter
+
+    def h5_data_filename(self):
+        #all runs of a sample go into one file
+        sample_filename = self.app.settings['sample']
+        if sample_filename == '':
+            return self.next_data_filename()
+        return os.path.join(self.app.settings['save_dir'], sample_filename)
 
-        #increase filename counter if filename already exists
-        elif self.fileExists(os.path.join(dirname,sample_filename)) or self.fileExists(os.path.join(dirname,counter_sample_filename)):
-            self.counter += 1
-            data_filename = os.path.join(dirname,sample_filename+'_'+str(self.counter))
+    def save_file(self):
+        if self.parameters:
+            self.save_parameters()
 
-        else:
-            self.counter=0
-            data_filename = os.path.join(dirname,sample_filename)
+        if self.writers:
+            for writer in self.writers.values():
+                writer.close()
+                self.log.info('streamed {:d} rows to {}, {:.1f} us per push on the acquisition thread'.format(
+                    writer.rows, writer.fname, 1e6*writer.push_time/max(writer.rows, 1)))
+            return
 
+        for ch, store in self.stores.items():
+            data_filename = self.data_filename + self.channel_suffix(ch)
 
-        # save data depending on the type of measurement
-        if self.settings['Measurement'] == 'JV Measurement':
-            np.savetxt(data_filename+'.csv',np.vstack((self.vlist,np.array(self.data))).T, delimiter = ',')
+            # save data depending on the type of measurement, named in the first line for analyze_archive
+            measurement = self.settings['Measurement']
+            if measurement == 'JV Measurement':
+                np.savetxt(data_filename+'.csv',np.vstack((store.view('source'),store.view('value'))).T, delimiter = ',', header=measurement)
 
-        elif self.settings['Measurement'] == 'Current Tracking':
-            np.savetxt(data_filename+'.csv',np.vstack((np.array(self.tlist)-self.tlist[0],np.array(self.data))).T,delimiter = ',')
+            elif measurement == 'Current Tracking':
+                np.savetxt(data_filename+'.csv',np.vstack((store.view('time'),store.view('value'))).T,delimiter = ',', header=measurement)
 
-        else:
-            np.savetxt(data_filename+'.csv',np.vstack((np.array(self.tlist)-self.tlist[0],np.array(self.data))).T,delimiter = ',')
+            elif measurement == 'MPP Tracking':
+                np.savetxt(data_filename+'.csv',np.vstack((store.view('time'),store.view('source'),store.view('value'))).T,delimiter = ',', header=measurement)
+
+            else:
+                np.savetxt(data_filename+'.csv',np.vstack((store.view('time'),store.view('value'))).T,delimiter = ',', header=measurement)
+
+    def save_parameters(self):
+        #figures of merit go into the run group of HDF5 files, next to CSV files as <name>_params.csv
+        S = self.settings
+        direction = 'reverse' if S['end_voltage'] < S['start_voltage'] else 'forward'
+        other = 'forward' if direction == 'reverse' else 'reverse'
+
+        for ch, params in self.parameters.items():
+            previous = self.previous_sweeps.get((S['SMU'], ch, other))
+            if previous is not None:
+                params.HI = hysteresis_index(params, previous) if direction == 'forward' else hysteresis_index(previous, params)
+            self.previous_sweeps[(S['SMU'], ch, direction)] = params
+
+            values = params.values()
+            self.log.info('{}{}: '.format(S['SMU'], self.channel_suffix(ch)) + ', '.join(params.format()))
+            if ch in self.writers and hasattr(self.writers[ch], 'run_group'):
+                for name, value in values.items():
+                    self.writers[ch].run_group.attrs[name] = value
+            else:
+                with open(self.data_filename + self.channel_suffix(ch) + companion_suffixes['params'], 'w') as f:
+                    for name, value in values.items():
+                        f.write('{},{!r}\n'.format(name, value))
+        self.plotted_total = -1 #redraw with the hysteresis index
 
     def pre_run(self):
+        #refuse to start while a batch or another measurement drives the SMU
+        self.keithley.claim(self)
 
         if self.settings['Measurement'] == 'JV Measurement':
             self.vline.show()
             self.hline.show()
+            self.jv_plot.setClipToView(False)
+            self.jv_plot.setDownsampling(auto=False)
 
         else:
             self.vline.hide()
             self.hline.hide()
 
+            #tracking runs get long, only draw the visible range, min/max decimated to the pixel width
+            self.jv_plot.setClipToView(True)
+            self.jv_plot.setDownsampling(auto=True, mode='peak')
+
 
         self.lock_start_button()
         S = self.settings 
         self.vlist = np.linspace(S['start_voltage'],S['end_voltage'],S['npoints'])
-        self.tlist = []
-        self.data = []
+        window = S['track_window'] if S['Measurement'] != 'JV Measurement' else 0
+        self.channels = self.active_channels()
+        self.stores = dict((ch, MeasurementBuffer(window=window or None)) for ch in self.channels)
+        #the display keeps its own copy, fed from the queue, acquisition never waits for it
+        self.display_stores = dict((ch, MeasurementBuffer(window=window or None)) for ch in self.channels)
+        self.queue = SPSCQueue(self.queue_capacity)
+        self.publisher = BatchPublisher(self.queue, self.batch_size, self.display_period_range[0])
+        self.consumer = BatchConsumer(self.publisher, self.display_stores)
+        #tracking lines are drawn from a fixed size decimation, fed only the new points
+        self.decimators = dict((ch, PeakDecimator(self.display_buckets)) for ch in self.channels)
+        self.repaint_cost = 0
+        self.parameters = {}
+        if S['Measurement'] == 'JV Measurement':
+            self.parameters = dict((ch, JVParameters(S['cell_area'], 1e-3*S['light_intensity'])) for ch in self.channels)
+        self.t0 = None
+        self.plotted_total = -1
+
+        #the file name is picked up front so data can be streamed to it during the run.
+        #dual channel runs write one file per channel
+        self.writers = {}
+        if S['save_mode'] == 'HDF5':
+            from ScopeFoundry import h5_io
+            self.data_filename = self.h5_data_filename()
+            for ch in self.channels:
+                writer = H5StreamingWriter(self.data_filename+self.channel_suffix(ch)+'.h5', S['flush_interval'])
+                run_group = writer.run_group
+                run_group.attrs['Measurement'] = S['Measurement']
+                run_group.attrs['Channel'] = ch or ''
+                h5_io.h5_save_app_lq(self.app, run_group)
+                h5_io.h5_save_hardware_lq(self.app, run_group)
+                h5_io.h5_create_measurement_group(self, run_group)
+                self.writers[ch] = writer
+        else:
+            self.data_filename = self.next_data_filename()
+            if S['save_mode'] == 'Streaming':
+                #same columns as the end-of-run file
+                columns = {'JV Measurement': (1, 2), 'MPP Tracking': (0, 1, 2)}.get(S['Measurement'], (0, 2))
+                for ch in self.channels:
+                    self.writers[ch] = StreamingWriter(self.data_filename+self.channel_suffix(ch)+'.csv', S['flush_interval'], columns, S['Measurement'])
+        self.keithley.writes_avoided = 0
+        self.profiler.clear()
+        self.keithley.profiler.clear()
+        S['achieved_rate'] = 0
+        S['missed_deadlines'] = 0
+        S['mpp_loop_rate'] = 0
 
     def post_run(self):
+        self.keithley.release(self)
+        #keep what was streamed if run() stopped on an error
+        for writer in self.writers.values():
+            writer.close()
+        #saved here so a run that failed, e.g. on a timeout, still leaves its profile
+        if self.settings['save_profile']:
+            self.save_profile()
         self.unlock_start_button()
         self.set_progress(0)
 
     def run(self):
         S = self.settings
+        t_run = time.perf_counter()
 
         while not self.interrupt_measurement_called:
 
             if self.settings['Measurement'] == 'JV Measurement':
-                
+                self.configure_functions('Voltage', 'Current')
+
                 #need to call this in case someone does a tracking measurement and doesn't change the JV delay value
-                self.keithley.set_delay(self.ui.JVdelaytime_doubleSpinBox.value())
+                self.keithley.set_delay(S['jv_delay'])
+
+                if self.channels != [None]:
+                    if S['sweep_mode'] == 'Adaptive':
+                        self.log.warning('dual channel sweeps use the uniform grid')
+                    if S['sweep_repeats'] > 1:
+                        self.log.warning('dual channel runs sweep once, sweep_repeats is ignored')
+                    self.run_dual_sweep()
+                    break
+
+                if S['sweep_repeats'] > 1:
+                    if S['sweep_mode'] != 'Buffered':
+                        self.log.warning('repeated sweeps are buffered on the uniform grid')
+                    self.run_repeated_sweeps()
+                    break
+
+                if S['sweep_mode'] == 'Buffered':
+                    self.run_buffered_sweep()
+                    break
+
+                if S['sweep_mode'] == 'Adaptive':
+                    self.run_adaptive_sweep()
+                    break
 
 
                 self.keithley.clear_buffer()
@@ -163,7 +384,8 @@ class JVMeasure(Measurement):
                 #delay time is automatically set on the Keithley when any of the delay time spinboxes are changed, so no need for a time.sleep() function call
                 for i,v in enumerate(self.vlist):
                     self.keithley.set_level(v)
-                    self.data.append(self.keithley.read_measurement())
+                    reading = self.keithley.read_measurement()
+                    self.add_points(time.time(), v, reading)
                     self.set_progress(i/S['npoints']*100)
 
                     if self.interrupt_measurement_called:
@@ -175,40 +397,409 @@ class JVMeasure(Measurement):
                 break
 
 
-            elif self.settings['Measurement'] == 'Current Tracking':
+            elif S['Measurement'] == 'MPP Tracking':
+                self.configure_functions('Voltage', 'Current')
                 self.set_progress(50)
-                self.keithley.set_source('Voltage')
-                self.keithley.set_measureFunc('Current')
-                self.keithley.clear_buffer()
-                self.keithley.set_output('On')
-                self.keithley.set_level(S['constant_v'])
-                temp_dat, t = self.keithley.read_measurement_withTime()
+                self.run_mpp_tracking()
+                break
 
-                self.tlist.append(t)
-                self.data.append(temp_dat)
+            elif self.channels != [None]:
+                #two channels are only kept in step by the instrument, so always buffered
+                self.set_progress(50)
+                self.run_dual_tracking()
+                break
 
-                time.sleep(S['itrack_delay'])
+            elif S['track_mode'] == 'Buffered':
+                self.set_progress(50)
+                self.run_buffered_tracking()
+                break
 
             else:
                 self.set_progress(50)
-                self.keithley.set_source('Current')
-                self.keithley.set_measureFunc('Voltage')
-                self.keithley.clear_buffer()
-                self.keithley.set_output('On')
-                self.keithley.set_level(S['constant_i'])
+                self.run_scheduled_tracking()
+                break
 
-                temp_dat, t = self.keithley.read_measurement_withTime()
+        for args in self.channel_args():
+            self.keithley.set_output('Off', *args)
+        self.publisher.flush()
+        self.log.info('display queue peaked at {:d} of {:d} batches, {:d} dropped'.format(self.queue.high_water, self.queue.capacity, self.queue.dropped))
+        self.profiler.record('phase', 'acquisition', time.perf_counter() - t_run)
+        with self.profiler.phase('save_file'):
+            self.save_file()
+        self.log.info('{:d} redundant writes to {} avoided'.format(self.keithley.writes_avoided, self.keithley.name))
+
+
+    def save_profile(self):
+        profilers = {self.name: self.profiler, self.keithley.name: self.keithley.profiler}
+        if self.settings['save_mode'] != 'HDF5':
+            export_profiles(self.data_filename + companion_suffixes['profile'], profilers)
+            return
+        #the writers are closed by now, their run groups are opened again
+        import h5py
+        for writer in self.writers.values():
+            with h5py.File(writer.fname, 'a') as f:
+                save_profiles_h5(f[writer.run_name], profilers)
+
+    def add_points(self, t, source, value, ch=None):
+        t_start = time.perf_counter()
+        #times are stored relative to the first reading so plots and files need no offset
+        if self.t0 is None:
+            self.t0 = np.ravel(t)[0]
+        t = np.asarray(t) - self.t0
+        self.stores[ch].extend(t, source, value)
+        self.publisher.add(ch, t, source, value)
+        if ch in self.parameters:
+            self.parameters[ch].update(source, value)
+
+        if ch in self.writers:
+            self.writers[ch].push(t, source, value)
+        self.profiler.record('phase', 'add_points', time.perf_counter() - t_start)
+
+    def pause(self, seconds):
+        #time.sleep, counted in the profile. points still waiting for a full batch go to the display first
+        self.publisher.flush_stale()
+        with self.profiler.phase('sleep'):
+            time.sleep(seconds)
+
+    def run_buffered_sweep(self):
+        S = self.settings
 
-                self.tlist.append(t)
-                self.data.append(temp_dat)
+        #the whole sweep runs on the instrument, we only poll for new readings
+        self.keithley.start_sweep(self.vlist, S['jv_delay'])
+        n_read = 0
+        running = True
+        while running:
+            if self.interrupt_measurement_called:
+                self.keithley.abort_sweep()
+                break
 
-                time.sleep(S['vtrack_delay'])
+            running = self.keithley.sweep_running()
+            n = self.keithley.read_buffer_count()
+            if n > n_read:
+                v, i, t = self.keithley.read_sweep(n_read+1, n)
+                self.add_points(t, v, i)
+                n_read = n
+                self.set_progress(n_read/S['npoints']*100)
 
-        self.keithley.set_output('Off')
-        self.save_file()
+            if running:
+                self.pause(self.buffer_poll_period)
+
+    def run_adaptive_sweep(self):
+        S = self.settings
 
+        #passes arrive out of voltage order, the file and the parameters get the sorted points at the end
+        writers, parameters = self.writers, self.parameters
+        self.writers, self.parameters = {}, {}
+        self.adaptive_start = time.perf_counter()
+        self.point_period = None
+        try:
+            columns, passes = adaptive_sweep(self.measure_pass, S['start_voltage'], S['end_voltage'],
+                                             S['adaptive_coarse_points'], S['npoints'], S['adaptive_tolerance'])
+        finally:
+            self.writers, self.parameters = writers, parameters
+
+        self.stores[None].clear()
+        self.publisher.clear(None)
+        if columns:
+            v, i, t = columns
+            self.t0 = 0
+            self.add_points(t, v, i)
+            self.log.info('adaptive sweep: {:d} points in {:d} passes, {:.2f} s'.format(v.size, passes, time.perf_counter() - self.adaptive_start))
+
+    def run_repeated_sweeps(self):
+        S = self.settings
+        n_sweeps = S['sweep_repeats']
+
+        #the display shows the running mean, the file and the parameters get the aggregate at the end
+        writers, parameters = self.writers, self.parameters
+        self.writers, self.parameters = {}, {}
+        t_start = time.perf_counter()
+        currents = np.empty((n_sweeps, self.vlist.size))
+        mean = np.zeros(self.vlist.size)
+        done = 0
+        try:
+            for k in range(n_sweeps):
+                columns = self.measure_sweep()
+                if columns is None:
+                    break
+                v, currents[k], t = columns
+                if k == 0:
+                    #times of every sweep and of the aggregate count from the start of the first one
+                    t_first = t
+                    self.t0 = t[0]
+                done += 1
+                mean += (currents[k] - mean)/done
+                self.stores[None].clear()
+                self.publisher.clear(None)
+                self.add_points(t, v, mean)
+                self.set_progress(done/n_sweeps*100)
+        finally:
+            self.writers, self.parameters = writers, parameters
+
+        if done == 0:
+            return
+        currents = currents[:done]
+        stats = sweep_statistics(currents, S['outlier_sigma'])
+        self.stores[None].clear()
+        self.publisher.clear(None)
+        self.add_points(t_first, v, stats['clean_mean'])
+        self.save_repeats(v, currents, stats)
+        self.log.info('{:d} sweeps in {:.2f} s, mean std {:.3g} A, {:d} outliers'.format(
+            done, time.perf_counter() - t_start, float(np.mean(stats['std'])), int(stats['outliers'].sum())))
+
+    def measure_sweep(self):
+        #one buffered sweep of vlist, read back in one transfer once it is done. None when interrupted
+        S = self.settings
+        self.keithley.start_sweep(self.vlist, S['jv_delay'])
+        while self.keithley.sweep_running():
+            if self.interrupt_measurement_called:
+                self.keithley.abort_sweep()
+                return None
+            self.pause(self.buffer_poll_period)
+        n = self.keithley.read_buffer_count()
+        if n < self.vlist.size:
+            return None
+        return self.keithley.read_sweep(1, n)
+
+    def save_repeats(self, v, currents, stats):
+        #every sweep and the aggregate, in the run group of HDF5 files or next to CSV files as
+        #<name>_sweeps.csv (V, one current column per sweep), <name>_outliers.csv (V, 1 where a
+        #reading was left out) and <name>_stats.csv
+        names = ('mean', 'std', 'clean_mean', 'clean_std', 'n_used')
+        writer = self.writers.get(None)
+        if hasattr(writer, 'run_group'):
+            group = writer.run_group.create_group('repeats')
+            group.attrs['outlier_sigma'] = self.settings['outlier_sigma']
+            group.create_dataset('voltage', data=v)
+            group.create_dataset('currents', data=currents)
+            group.create_dataset('outliers', data=stats['outliers'])
+            for name in names:
+                group.create_dataset(name, data=stats[name])
+            return
+
+        sweeps = ','.join('I_{:d}'.format(k + 1) for k in range(currents.shape[0]))
+        np.savetxt(self.data_filename + companion_suffixes['sweeps'], np.column_stack((v, currents.T)), delimiter=',', header='V,' + sweeps)
+        np.savetxt(self.data_filename + companion_suffixes['outliers'], np.column_stack((v, stats['outliers'].T)), delimiter=',',
+                   header='V,' + sweeps, fmt=['%.18e'] + ['%d']*currents.shape[0])
+        np.savetxt(self.data_filename + companion_suffixes['stats'], np.column_stack([v] + [stats[name] for name in names]), delimiter=',',
+                   header='V,' + ','.join(names))
+
+    def measure_pass(self, vlist):
+        #one buffered sweep of an adaptive run, None when interrupted
+        S = self.settings
+        offset = time.perf_counter() - self.adaptive_start
+        self.keithley.start_sweep(vlist, S['jv_delay'])
+        chunks = []
+        n_read = 0
+        running = True
+        while running:
+            if self.interrupt_measurement_called:
+                self.keithley.abort_sweep()
+                return None
+
+            running = self.keithley.sweep_running()
+            n = self.keithley.read_buffer_count()
+            if n > n_read:
+                v, i, t = self.keithley.read_sweep(n_read+1, n)
+                chunks.append((v, i, t + offset))
+                self.add_points(t + offset, v, i)
+                n_read = n
+                self.set_progress(self.stores[None].total/S['npoints']*100)
+
+            if running:
+                #passes are short, after the first one wait about as long as the rest of the sweep takes
+                wait = self.buffer_poll_period
+                if self.point_period:
+                    wait = min(wait, max((vlist.size - n_read)*self.point_period, 1e-3))
+                self.pause(wait)
+        if not chunks:
+            return None
+        columns = [np.concatenate(c) for c in zip(*chunks)]
+        t = columns[2]
+        if t.size > 1:
+            self.point_period = (t[-1] - t[0])/(t.size - 1)
+        return columns
+
+    def configure_functions(self, source, measure):
+        #averaging within a point happens on the instrument. the 2450 keeps the filter per
+        #measure function, so it is set once the function is
+        for args in self.channel_args():
+            self.keithley.set_source(source, *args)
+            self.keithley.set_measureFunc(measure, *args)
+            self.keithley.set_filter_count(self.settings['point_average'], *args)
+
+    def configure_tracking(self):
+        #set up the source once on every channel, returns the level and requested sample period
+        S = self.settings
+
+        if S['Measurement'] == 'Current Tracking':
+            source, measure, level, period = 'Voltage', 'Current', S['constant_v'], S['itrack_delay']
+        else:
+            source, measure, level, period = 'Current', 'Voltage', S['constant_i'], S['vtrack_delay']
+
+        self.configure_functions(source, measure)
+        for args in self.channel_args():
+            self.keithley.set_output('On', *args)
+            self.keithley.set_level(level, *args)
+        return level, period
+
+    def sleep_until(self, deadline):
+        #sleep in short steps so Interrupt stays responsive during long periods
+        while not self.interrupt_measurement_called:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return True
+            self.pause(min(remaining, 0.1))
+        return False
+
+    def run_scheduled_tracking(self):
+        S = self.settings
+        level, period = self.configure_tracking()
+
+        #time one reading to see whether the host can keep up with the requested period
+        t_start = time.perf_counter()
+        temp_dat, t = self.keithley.read_measurement_withTime()
+        io_time = time.perf_counter() - t_start
+
+        if period < io_time:
+            self.log.info('{:.1f} ms period is shorter than {:.1f} ms host I/O, using instrument-timed buffered tracking'.format(1e3*period, 1e3*io_time))
+            self.run_buffered_tracking()
+            return
+
+        self.add_points(t, level, temp_dat)
+
+        #readings are fired on absolute deadlines t_start + k*period, so I/O jitter never accumulates
+        k = 1
+        n = 1
+        missed = 0
+        while self.sleep_until(t_start + k*period):
+            late = time.perf_counter() - (t_start + k*period)
+            if late > period:
+                #skip the deadlines we already missed instead of bursting to catch up
+                skipped = int(late // period)
+                missed += skipped
+                k += skipped
+
+            temp_dat, t = self.keithley.read_measurement_withTime()
+            self.add_points(t, level, temp_dat)
+            k += 1
+            n += 1
+
+            S['achieved_rate'] = n/(time.perf_counter() - t_start)
+            S['missed_deadlines'] = missed
+
+        self.log.info('tracking at {:.3g} Hz of {:.3g} Hz requested, {:d} missed deadlines'.format(S['achieved_rate'], 1/period, missed))
+
+    def run_buffered_tracking(self):
+        S = self.settings
+        level, period = self.configure_tracking()
+
+        #the instrument samples on its own timer, we only pull new readings in chunks.
+        #when a block of track_buffer_size readings is full a new one is started
+        t_start = time.perf_counter()
+        n_total = self.stores[None].total
+        while not self.interrupt_measurement_called:
+            self.keithley.start_tracking(period, self.track_buffer_size)
+            n_read = 0
+            running = True
+            while running:
+                if self.interrupt_measurement_called:
+                    break
+
+                running = self.keithley.tracking_running()
+                n = self.keithley.read_buffer_count()
+                if n > n_read:
+                    y, t = self.keithley.read_tracking(n_read+1, n)
+                    self.add_points(t, level, y)
+                    n_total += n - n_read
+                    n_read = n
+                    S['achieved_rate'] = n_total/(time.perf_counter() - t_start)
+
+                if running:
+                    self.pause(self.buffer_poll_period)
+
+        self.keithley.abort_tracking()
+
+    def run_mpp_tracking(self):
+        S = self.settings
+
+        #the perturb and observe loop runs on the instrument, we only read its reports
+        vmin, vmax = sorted((S['start_voltage'], S['end_voltage']))
+        self.keithley.start_mpp(S['mpp_start_v'], S['mpp_step'], vmin, vmax, S['mpp_report_period'])
+        t_start = time.perf_counter()
+        n_reports = 0
+        n_iterations = 0
+        try:
+            while not self.interrupt_measurement_called:
+                t, v, i, p, n = self.keithley.read_mpp()
+                self.add_points(t, v, i)
+                n_reports += 1
+                n_iterations += n
+                S['achieved_rate'] = n_reports/(time.perf_counter() - t_start)
+                S['mpp_loop_rate'] = n_iterations/t
+        finally:
+            self.keithley.abort_mpp()
+        self.log.info('MPP loop ran at {:.4g} Hz on {}, reported at {:.3g} Hz'.format(S['mpp_loop_rate'], self.keithley.name, S['achieved_rate']))
+
+    def run_dual_sweep(self):
+        S = self.settings
+
+        #both channels sweep in lock step on the instrument, each has its own buffer to read
+        self.keithley.start_dual_sweep(self.vlist, S['jv_delay'])
+        n_read = dict.fromkeys(self.channels, 0)
+        running = True
+        while running:
+            if self.interrupt_measurement_called:
+                for ch in self.channels:
+                    self.keithley.abort_sweep(ch)
+                break
+
+            running = self.keithley.dual_sweep_running()
+            for ch in self.channels:
+                n = self.keithley.read_buffer_count(ch)
+                if n > n_read[ch]:
+                    v, i, t = self.keithley.read_sweep(n_read[ch]+1, n, ch)
+                    self.add_points(t, v, i, ch)
+                    n_read[ch] = n
+            self.set_progress(min(n_read.values())/S['npoints']*100)
+
+            if running:
+                self.pause(self.buffer_poll_period)
+
+    def run_dual_tracking(self):
+        S = self.settings
+        level, period = self.configure_tracking()
+
+        #same as run_buffered_tracking, with both channels started by one command
+        t_start = time.perf_counter()
+        n_total = 0
+        while not self.interrupt_measurement_called:
+            self.keithley.start_dual_tracking(period, self.track_buffer_size)
+            n_read = dict.fromkeys(self.channels, 0)
+            running = True
+            while running:
+                if self.interrupt_measurement_called:
+                    break
+
+                running = self.keithley.dual_tracking_running()
+                for ch in self.channels:
+                    n = self.keithley.read_buffer_count(ch)
+                    if n > n_read[ch]:
+                        y, t = self.keithley.read_tracking(n_read[ch]+1, n, ch)
+                        self.add_points(t, level, y, ch)
+                        n_total += n - n_read[ch]
+                        n_read[ch] = n
+                S['achieved_rate'] = n_total/len(self.channels)/(time.perf_counter() - t_start)
+
+                if running:
+                    self.pause(self.buffer_poll_period)
+
+        for ch in self.channels:
+            self.keithley.abort_tracking(ch)
 
     def setup_figure(self):
+        #pyqtgraph is imported here rather than at module load to speed up startup
+        import pyqtgraph as pg
 
         pg.setConfigOption('background', 'w')
         pg.setConfigOption('foreground', 'k')
@@ -236,19 +827,96 @@ class JVMeasure(Measurement):
         # self.vline.hide()
         # self.hline.hide()
         self.jv_plot_line = self.jv_plot.plot(pen=pg.mkPen('b', width=5))
+        self.jv_plot_line_b = self.jv_plot.plot(pen=pg.mkPen('r', width=5)) #second channel of dual channel runs
         self.jv_plot.enableAutoRange()
 
-    def update_display(self):
+        #figures of merit of JV sweeps, next to the plot
+        self.parameters_label = self.graph_layout.addLabel('', justify='left')
 
-        try:
+        #oscilloscope style panning from the X axis context menu
+        self.autopan_tool = XAutoPanTool(self.jv_plot)
+        self.autopan_tool.attachToPlotItem(self.jv_plot)
 
+    def update_display(self):
+        #the display queue and stores are made by the first pre_run
+        if not hasattr(self, 'queue'):
+            return
+
+        t_start = time.perf_counter()
+        consumed = self.consume_batches()
+
+        #only redraw when new points arrived
+        total = sum(store.total for store in self.display_stores.values())
+        if not consumed and total == self.plotted_total:
+            return
+        self.plotted_total = total
+
+        lines = [self.jv_plot_line, self.jv_plot_line_b]
+        for line, ch in zip(lines, self.channels):
+            store = self.display_stores[ch]
             if self.settings['Measurement'] == 'JV Measurement':
-                self.jv_plot_line.setData(self.vlist[:np.size(self.data)],self.data)
+                v, i = store.view('source'), store.view('value')
+                if self.settings['sweep_mode'] == 'Adaptive':
+                    #refinement passes come in out of voltage order
+                    order = np.argsort(v)
+                    v, i = v[order], i[order]
+                line.setData(v, i)
             else:
-                self.jv_plot_line.setData(np.array(self.tlist)-self.tlist[0],self.data)
-
-        except (AttributeError, IndexError) as e:
-            pass
+                line.setData(*self.decimate(ch))
+        for line in lines[len(self.channels):]:
+            line.clear()
+        self.update_parameters_label()
+        cost = time.perf_counter() - t_start
+        self.profiler.record('phase', 'update_display', cost)
+        self.adapt_display_period(cost)
+
+    def decimate(self, ch):
+        #adds the points that arrived since the last refresh to the channel's decimator
+        store, decimator = self.display_stores[ch], self.decimators[ch]
+        new = store.total - decimator.total
+        n = min(new, len(store))
+        if new < 0 or n < new:
+            #cleared, or points left the window before they were drawn
+            decimator.clear(store.total - n)
+        if n > 0:
+            t, v = store.view('time')[-n:], store.view('value')[-n:]
+            if self.settings['Measurement'] == 'MPP Tracking':
+                v = -store.view('source')[-n:]*v
+            decimator.extend(t, v)
+        if store.window:
+            decimator.trim(store.total - len(store))
+        return decimator.data()
+
+    def consume_batches(self):
+        #move everything queued into the display stores, returns the number of batches
+        self.settings['queue_depth'] = len(self.queue)
+        self.settings['queue_dropped'] = self.queue.dropped
+        return self.consumer.consume()
+
+    def adapt_display_period(self, cost):
+        #redraw less often when repaints get expensive, so they take at most display_load of the GUI thread
+        self.repaint_cost = cost if not self.repaint_cost else 0.8*self.repaint_cost + 0.2*cost
+        fastest, slowest = self.display_period_range
+        period = min(max(self.repaint_cost/self.display_load, fastest), slowest)
+        if abs(period - self.display_update_period) > 0.1*self.display_update_period:
+            self.display_update_period = period
+            timer = getattr(self, 'display_update_timer', None)
+            if timer is not None:
+                timer.setInterval(int(1e3*period))
+        self.settings['display_rate'] = 1/self.display_update_period
+
+    def update_parameters_label(self):
+        if not (self.settings['show_parameters'] and self.parameters):
+            self.parameters_label.setText('')
+            return
+        colors = ['blue', 'red'] #same as the plot lines
+        text = []
+        for color, ch in zip(colors, self.channels):
+            lines = self.parameters[ch].format()
+            if ch:
+                lines.insert(0, ch)
+            text.append('<span style="color: {}">{}</span>'.format(color, '<br>'.join(lines)))
+        self.parameters_label.setText('<br><br>'.join(text))
 
 
 
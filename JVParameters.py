@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class JVParameters(object):
+    """
+    Photovoltaic figures of merit of a JV sweep, updated as readings arrive.
+
+    update() only looks at the new readings and the last few before them,
+    so its cost does not grow with the length of the sweep. Currents keep
+    the SMU's sign, generated current is negative and the cell delivers the
+    power -V*I. Voc and Isc are interpolated between the two readings around
+    the zero crossing. Rs and Rsh are least squares slopes dV/dI over up to
+    fit_points readings on each side of the crossing, refined as the
+    readings after it arrive.
+
+    area is in cm^2 and light_power in W/cm^2, Jsc and PCE are NaN without them.
+    """
+
+    names = ('Voc', 'Isc', 'Jsc', 'FF', 'Pmax', 'Vmpp', 'Impp', 'PCE', 'Rs', 'Rsh', 'HI')
+
+    fit_points = 4 #readings on each side of a zero crossing in the Rs and Rsh fits
+
+    def __init__(self, area=None, light_power=None):
+        self.area = area
+        self.light_power = light_power
+        self.clear()
+
+    def clear(self):
+        self.tail = (np.empty(0), np.empty(0)) #(v, i) of the last fit_points readings
+        self.windows = {} #'Rs' or 'Rsh': (v, i, readings after the crossing) while the fit still takes readings
+        self.Voc = self.Isc = self.Rs = self.Rsh = np.nan
+        self.Pmax = self.Vmpp = self.Impp = np.nan
+        self.HI = np.nan #hysteresis index, set once both sweep directions are known
+
+    @staticmethod
+    def crossing(x):
+        """Index k of the first zero crossing of x between x[k] and x[k+1], or None"""
+        k = np.flatnonzero((x[:-1]*x[1:] <= 0) & (x[:-1] != x[1:]))
+        return k[0] if k.size else None
+
+    @staticmethod
+    def slope(x, y):
+        #least squares dy/dx, NaN if x does not vary
+        dx = x - x.mean()
+        sxx = (dx*dx).sum()
+        return (dx*(y - y.mean())).sum()/sxx if sxx > 0 else np.nan
+
+    def fit(self, name, v, i):
+        if name == 'Rs':
+            self.Rs = self.slope(i, v)
+        else:
+            didv = self.slope(v, i)
+            self.Rsh = 1/didv if didv else np.inf
+
+    def start_fit(self, name, v, i, k):
+        #fit_points readings up to k and after it, the ones still to come are added by update()
+        lo, hi = max(k + 1 - self.fit_points, 0), k + 1 + self.fit_points
+        self.fit(name, v[lo:hi], i[lo:hi])
+        after = min(hi, v.size) - (k + 1)
+        if after < self.fit_points:
+            self.windows[name] = (v[lo:hi], i[lo:hi], after)
+
+    def update(self, v, i):
+        i = np.atleast_1d(np.asarray(i, dtype=float))
+        v = np.broadcast_to(np.asarray(v, dtype=float), i.shape)
+        if i.size == 0:
+            return
+
+        p = -v*i
+        k = np.argmax(p)
+        if not p[k] <= self.Pmax:
+            self.Pmax, self.Vmpp, self.Impp = p[k], v[k], i[k]
+
+        #readings after a crossing found earlier
+        for name, (wv, wi, after) in list(self.windows.items()):
+            n = min(self.fit_points - after, v.size)
+            wv, wi, after = np.concatenate((wv, v[:n])), np.concatenate((wi, i[:n])), after + n
+            self.fit(name, wv, wi)
+            if after < self.fit_points:
+                self.windows[name] = (wv, wi, after)
+            else:
+                del self.windows[name]
+
+        v = np.concatenate((self.tail[0], v))
+        i = np.concatenate((self.tail[1], i))
+        self.tail = (v[-self.fit_points:], i[-self.fit_points:])
+        if v.size < 2:
+            return
+
+        if np.isnan(self.Voc):
+            k = self.crossing(i)
+            if k is not None:
+                self.Voc = v[k] - i[k]*(v[k+1] - v[k])/(i[k+1] - i[k])
+                self.start_fit('Rs', v, i, k)
+        if np.isnan(self.Isc):
+            k = self.crossing(v)
+            if k is not None:
+                self.Isc = -(i[k] - v[k]*(i[k+1] - i[k])/(v[k+1] - v[k]))
+                self.start_fit('Rsh', v, i, k)
+
+    @property
+    def FF(self):
+        if self.Voc > 0 and self.Isc > 0 and self.Pmax > 0:
+            return self.Pmax/(self.Voc*self.Isc)
+        return np.nan
+
+    @property
+    def Jsc(self):
+        if self.area:
+            return self.Isc/self.area
+        return np.nan
+
+    @property
+    def PCE(self):
+        if self.area and self.light_power:
+            return self.Pmax/(self.area*self.light_power)
+        return np.nan
+
+    def values(self):
+        return dict((name, float(getattr(self, name))) for name in self.names)
+
+    def format(self):
+        """Lines for display, currents per area in mA/cm^2 and ratios in %"""
+        return ['Voc {:.4f} V'.format(self.Voc),
+                'Jsc {:.3f} mA/cm²'.format(1e3*self.Jsc) if self.area else 'Isc {:.4g} A'.format(self.Isc),
+                'FF {:.2f} %'.format(100*self.FF),
+                'PCE {:.2f} %'.format(100*self.PCE) if self.area and self.light_power else 'Pmax {:.4g} W'.format(self.Pmax),
+                'Rs {:.4g} Ω'.format(self.Rs),
+                'Rsh {:.4g} Ω'.format(self.Rsh),
+                'HI {:.3f}'.format(self.HI)]
+
+
+def hysteresis_index(forward, reverse):
+    """(Pmax reverse - Pmax forward)/Pmax reverse of two JVParameters"""
+    if reverse.Pmax > 0:
+        return (reverse.Pmax - forward.Pmax)/reverse.Pmax
+    return np.nan
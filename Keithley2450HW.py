@@ -1,26 +1,84 @@
-from ScopeFoundry import HardwareComponent
-import pyvisa
+from KeithleyTSPBase import KeithleyTSPBase, InvalidSourceError, InvalidTerminalError, InvalidMeasurementError, InvalidSenseError
+import numpy as np
+import hashlib
 
-class InvalidSourceError(Exception):
-    pass
 
-class InvalidTerminalError(Exception):
-    pass
-
-class InvalidMeasurementError(Exception):
-    pass
-
-class InvalidSenseError(Exception):
-    pass
-
-
-class Keithley2450HW(HardwareComponent):
+class Keithley2450HW(KeithleyTSPBase):
 
     name = 'Keithley 2450'
 
+    #TSP functions loaded into the instrument by load_library().
+    #jv_print(name, ...) prints the named settings tab separated, in one round trip.
+    #jv_mpp() is perturb and observe maximum power point tracking, run by start_mpp(). every
+    #period seconds it prints the elapsed time, the mean V, I and P since the last report
+    #and the number of loop iterations they cover
+    tsp_library = (
+        "local function pick(value, on, a, b) if value == on then return a end return b end",
+        "local getters = {",
+        "source = function() return pick(smu.source.func, smu.FUNC_DC_CURRENT, 'Current', 'Voltage') end,",
+        "measure = function() return pick(smu.measure.func, smu.FUNC_DC_VOLTAGE, 'Voltage', 'Current') end,",
+        "level = function() return smu.source.level end,",
+        "ilimit = function() return smu.source.ilimit.level end,",
+        "vlimit = function() return smu.source.vlimit.level end,",
+        "sense = function() return pick(smu.measure.sense, smu.SENSE_4WIRE, '4Wire', '2Wire') end,",
+        "terminals = function() return pick(smu.measure.terminals, smu.TERMINALS_FRONT, 'Front', 'Rear') end,",
+        "autorange = function() return pick(smu.measure.autorange, smu.ON, 'On', 'Off') end,",
+        "nplc = function() return smu.measure.nplc end,",
+        "output = function() return pick(smu.source.output, smu.ON, 'On', 'Off') end,",
+        "delay = function() return smu.source.delay end,",
+        "autodelay = function() return pick(smu.source.autodelay, smu.ON, 'On', 'Off') end,",
+        "filter = function() if smu.measure.filter.enable == smu.ON then return smu.measure.filter.count end return 1 end,",
+        "}",
+        "function jv_print(...)",
+        "local values = {}",
+        "for k, name in ipairs({...}) do values[k] = tostring(getters[name]()) end",
+        "print(table.concat(values, '\t'))",
+        "end",
+        "function jv_mpp(v, dv, vmin, vmax, period, nreports)",
+        "smu.source.level = v",
+        "local p = -v*smu.measure.read()",
+        "local t0 = timer.gettime()",
+        "local r = 0",
+        "while nreports <= 0 or r < nreports do",
+        "local n, sv, si, sp, t = 0, 0, 0, 0, 0",
+        "repeat",
+        "if v + dv > vmax or v + dv < vmin then dv = -dv end",
+        "v = v + dv",
+        "smu.source.level = v",
+        "local i = smu.measure.read()",
+        "if -v*i < p then dv = -dv end",
+        "p = -v*i",
+        "n = n + 1 sv = sv + v si = si + i sp = sp + p",
+        "t = timer.gettime() - t0",
+        "until t >= (r + 1)*period",
+        "print(t, sv/n, si/n, sp/n, n)",
+        "r = r + 1",
+        "end",
+        "end",
+    )
+    #logged quantities read back together by read_from_hardware(), with their jv_print names
+    hardware_settings = (('Source', 'source'), ('Measurement', 'measure'), ('Level', 'level'),
+                         ('ILimit', 'ilimit'), ('VLimit', 'vlimit'), ('Sense', 'sense'),
+                         ('Terminals', 'terminals'), ('Autorange', 'autorange'), ('NPLC', 'nplc'),
+                         ('Output', 'output'), ('Measure_Delay', 'delay'), ('AutoDelay', 'autodelay'),
+                         ('Filter_Count', 'filter'))
+
+    #numeric settings and the value they take when they read as nil
+    numeric_settings = {'level': 0.0, 'ilimit': 0.0, 'vlimit': 210.0, 'nplc': 1.0, 'delay': 0.0, 'filter': 1.0}
+
+    #cached settings the 2450 keeps per source function and per measure function.
+    #after a function change the instrument uses the values last set for that function
+    source_settings = ('level', 'delay', 'autodelay')
+    measure_settings = ('nplc', 'autorange', 'sense', 'filter')
+
+    #*IDN? replies of the instruments this component drives, for discover()
+    idn_pattern = r'MODEL\s*2450'
+
+    library_version = hashlib.sha1('\n'.join(tsp_library).encode()).hexdigest()[:12]
 
     def setup(self):
         
+        self.setup_visa_settings('GPIB0::18::INSTR')
         self.settings.New('Source', dtype=str, choices=[("Voltage","Voltage"),("Current","Current")], initial='Voltage')
         self.settings.New('Measurement', dtype=str, choices=[("Voltage","Voltage"),("Current","Current")], initial='Current')
         self.settings.New('Level', dtype = float, initial = 0, vmin=-50, vmax=50)
@@ -33,12 +91,12 @@ class Keithley2450HW(HardwareComponent):
         self.settings.New('Autorange', dtype=str, choices = [('On','On'),('Off','Off')], initial = 'On')
         self.settings.New('AutoDelay', dtype=str, choices = [('On','On'),('Off','Off')])
         self.settings.New('NPLC', dtype = float, initial = 1, vmin=0.01, vmax = 10)
-        self.add_operation('Reset', self.reset)
-        self.add_operation('Beep', self.beep)
+        #readings the SMU averages into each measurement, 1 turns its repeat filter off
+        self.settings.New('Filter_Count', dtype=int, initial=1, vmin=1, vmax=100)
+        self.setup_connect_settings()
 
     def connect(self):
-        self.rm = pyvisa.ResourceManager()
-        self.keithley = self.rm.open_resource('GPIB0::18::INSTR')
+        self.open_connection()
 
         LQ = self.settings.as_dict()
 
@@ -74,28 +132,49 @@ class Keithley2450HW(HardwareComponent):
         LQ['AutoDelay'].hardware_set_func = self.set_autodelay
         LQ['AutoDelay'].hardware_read_func = self.read_autodelay
 
+        LQ['Filter_Count'].hardware_set_func = self.set_filter_count
+        LQ['Filter_Count'].hardware_read_func = self.read_filter_count
+
         LQ["ILimit"].hardware_set_func    = self.set_ilimit
         LQ["ILimit"].hardware_read_func    = self.read_ilimit
 
         LQ['VLimit'].hardware_set_func = self.set_vlimit
         LQ["VLimit"].hardware_read_func    = self.read_vlimit
 
-        #Reset the Keithley, which also reads all the default values from hardware
-        self.reset()
+        self.finish_connect()
 
-        self.settings['ILimit'] = 1
-        self.settings['Sense'] = '2Wire'
+    def query_settings(self, *names):
+        #values of the named settings as text, through the library in one round trip
+        return self.keithley.query("jv_print({})".format(', '.join("'{}'".format(name) for name in names))).strip().split('\t')
+
+    def cached_write(self, key, value, cmd):
+        """Write cmd unless value is already applied on the instrument.
+        Returns True if the write was sent
+        """
+        if key in self.cache and self.cache[key] == value:
+            self.writes_avoided += 1
+            return False
+        self.keithley.write(cmd)
+        self.cache[key] = value
+        return True
+
+    def evict(self, keys):
+        #forget cached values the instrument no longer holds
+        for key in keys:
+            self.cache.pop(key, None)
 
     def set_source(self,func='Voltage'):
         if func == 'Voltage':
-            self.keithley.write("smu.source.func = smu.FUNC_DC_VOLTAGE")
+            if self.cached_write('source', func, "smu.source.func = smu.FUNC_DC_VOLTAGE"):
+                self.evict(self.source_settings)
 
             #Maximum and minimum levels from Keithley 2450 manual
             self.settings.Level.vmin = -210
             self.settings.Level.vmax = 210
             self.settings.Level.unit = 'V'
         elif func == 'Current':
-            self.keithley.write("smu.source.func = smu.FUNC_DC_CURRENT")
+            if self.cached_write('source', func, "smu.source.func = smu.FUNC_DC_CURRENT"):
+                self.evict(self.source_settings)
 
             #Maximum and minimum levels from Keithley 2450 manual
             self.settings.Level.vmin = -1.05
@@ -105,177 +184,234 @@ class Keithley2450HW(HardwareComponent):
             raise InvalidSourceError('Invalid source function')
 
     def read_sourceFunc(self):
-        self.keithley.write("mfunc = smu.source.func")
-        func =  str(self.keithley.query("print(source)"))
-        if func == 'smu.FUNC_DC_CURRENT':
-            return 'Current'
-        else:
-            return 'Voltage'
+        return self.read_setting('source')
 
     def set_measureFunc(self,func='Current'):
 
         if func == 'Voltage':
-            self.keithley.write("smu.measure.func = smu.FUNC_DC_VOLTAGE")
+            if self.cached_write('measure', func, "smu.measure.func = smu.FUNC_DC_VOLTAGE"):
+                self.evict(self.measure_settings)
         elif func == 'Current':
-            self.keithley.write("smu.measure.func = smu.FUNC_DC_CURRENT")
+            if self.cached_write('measure', func, "smu.measure.func = smu.FUNC_DC_CURRENT"):
+                self.evict(self.measure_settings)
         else:
             raise InvalidMeasurementError('Invalid measurement function')
 
     def read_measureFunc(self):
-        self.keithley.write("mfunc = smu.measure.func")
-        func =  str(self.keithley.query("print(mfunc)"))
-        if func == 'smu.FUNC_DC_CURRENT':
-            return 'Current'
-        else:
-            return 'Voltage'
+        return self.read_setting('measure')
 
     def set_level(self,level):
-        self.keithley.write("smu.source.level= {:f}".format(level))
+        self.cached_write('level', level, "smu.source.level= {:f}".format(level))
 
     def read_level(self):
-        self.keithley.write("level = smu.source.level")
-        return float(self.keithley.query("print(level)"))
+        return self.read_setting('level')
 
     def set_ilimit(self,limit):
-        self.keithley.write("smu.source.ilimit.level = {:f}".format(limit))
+        self.cached_write('ilimit', limit, "smu.source.ilimit.level = {:f}".format(limit))
 
         if self.settings['Source'] =='Current':
             self.settings.Level.vmax = limit
 
     def read_ilimit(self):
-        self.keithley.write("ilimit = smu.source.ilimit.level")
-        return float(self.keithley.query("print(ilimit)"))
+        return self.read_setting('ilimit')
 
     def set_vlimit(self, limit):
-        self.keithley.write("smu.source.vlimit.level = {:f}".format(limit))
+        self.cached_write('vlimit', limit, "smu.source.vlimit.level = {:f}".format(limit))
 
         if self.settings['Source'] =='Voltage':
             self.settings.Level.vmax = limit
 
     def read_vlimit(self):
-        self.keithley.write("vlimit = smu.source.vlimit.level")
-        vlim = self.keithley.query("print(vlimit)")
-        if vlim == 'nil\n':
-            return 210
-        else:
-            return float(vlim)
+        return self.read_setting('vlimit')
 
     def set_sense(self,m_type):
         if m_type == '2Wire':
-            self.keithley.write("smu.measure.sense=smu.SENSE_2WIRE")
+            self.cached_write('sense', m_type, "smu.measure.sense=smu.SENSE_2WIRE")
         elif m_type == '4Wire':
-            self.keithley.write("smu.measure.sense=smu.SENSE_4WIRE")
+            self.cached_write('sense', m_type, "smu.measure.sense=smu.SENSE_4WIRE")
         else:
             raise InvalidSenseError('Invalid sense type')
 
     def read_sense(self):
-        self.keithley.write("sensing = smu.source.sense")
-        sense = str(self.keithley.query("print(sensing)"))
-        if sense == 'smu.SENSE_2WIRE':
-            return '2Wire'
-        else:
-            return '4Wire'
+        return self.read_setting('sense')
 
     def set_terminals(self,terminal):
         if terminal == 'Front':
-            self.keithley.write("smu.measure.terminals = smu.TERMINALS_FRONT")
+            self.cached_write('terminals', terminal, "smu.measure.terminals = smu.TERMINALS_FRONT")
         elif terminal == 'Rear':
-            self.keithley.write("smu.measure.terminals = smu.TERMINALS_REAR")
+            self.cached_write('terminals', terminal, "smu.measure.terminals = smu.TERMINALS_REAR")
         else:
             raise InvalidTerminalError('Invalid terminal')
 
     def read_terminals(self):
-        self.keithley.write("terminals = smu.source.sense")
-        terminals = str(self.keithley.query("print(terminals)"))
-        if terminals == 'smu.TERMINALS_FRONT':
-            return 'Front'
-        else:
-            return 'Rear'
+        return self.read_setting('terminals')
 
     def set_autorange(self,autorange='On'):
         if autorange == 'On':
-            self.keithley.write("smu.measure.autorange = smu.ON")
+            self.cached_write('autorange', autorange, "smu.measure.autorange = smu.ON")
         else:
-            self.keithley.write("smu.measure.autorange = smu.OFF")
+            self.cached_write('autorange', autorange, "smu.measure.autorange = smu.OFF")
 
     def read_autorange(self):
-        self.keithley.write("autorange = smu.source.autorange")
-        ans =  str(self.keithley.query("print(autorange)"))
-        if ans == 'smu.ON':
-            return 'On'
-        else:
-            return 'Off'
+        return self.read_setting('autorange')
 
     def set_NPLC(self,NPLC):
-        self.keithley.write("smu.measure.nplc = {:f}".format(NPLC))
+        self.cached_write('nplc', NPLC, "smu.measure.nplc = {:f}".format(NPLC))
 
     def read_NPLC(self):
-        self.keithley.write("nplc = smu.measure.nplc")
-        nplc = self.keithley.query("print(nplc)")
-        if nplc == 'nil\n':
-            return float(1)
-        else:
-            return float(nplc)
+        return self.read_setting('nplc')
 
     def set_output(self,output):
         if output == 'On':
-            self.keithley.write("smu.source.output=smu.ON")
+            self.cached_write('output', output, "smu.source.output=smu.ON")
         else:
-            self.keithley.write("smu.source.output=smu.OFF")
+            self.cached_write('output', output, "smu.source.output=smu.OFF")
 
     def read_output(self):
-        output = str(self.keithley.query("print(smu.source.output)"))
-        if output == 'smu.ON':
-            return 'On'
-        else:
-            return 'Off'
+        return self.read_setting('output')
 
     def set_delay(self,delay):
-        self.keithley.write("smu.source.delay = {:f}".format(delay))
+        self.cached_write('delay', delay, "smu.source.delay = {:f}".format(delay))
 
     def read_delay(self):
-        return float(self.keithley.query("print(smu.source.delay)"))
+        return self.read_setting('delay')
 
     def read_autodelay(self):
-        self.keithley.write("state = smu.source.autodelay")
-        state = str(self.keithley.query("print(state)"))
-
-        if state == 'smu.ON':
-            return 'On'
-        else:
-            return 'Off'
+        return self.read_setting('autodelay')
 
     def set_autodelay(self,state):
         if state =='On':
-            self.keithley.write('smu.source.autodelay = smu.ON')
+            self.cached_write('autodelay', state, 'smu.source.autodelay = smu.ON')
         else:
-            self.keithley.write('smu.source.autodelay = smu.OFF')
+            self.cached_write('autodelay', state, 'smu.source.autodelay = smu.OFF')
+
+    def set_filter_count(self, count):
+        """Average count readings into every measurement with the repeating
+        average filter, noise drops as 1/sqrt(count) and each measurement
+        takes count times as long. 1 turns the filter off"""
+        count = int(count)
+        if count > 1:
+            self.cached_write('filter', count, "smu.measure.filter.count = {:d} smu.measure.filter.type = smu.FILTER_REPEAT_AVG "
+                              "smu.measure.filter.enable = smu.ON".format(count))
+        else:
+            self.cached_write('filter', 1, "smu.measure.filter.enable = smu.OFF")
+
+    def read_filter_count(self):
+        return int(self.read_setting('filter'))
 
     def read_measurement(self):
+        self.cache.pop('buffer_cleared', None)
         return float(self.keithley.query("print(smu.measure.read())"))
 
     def read_measurement_withTime(self):
-        self.keithley.write("amp, sec, fracSec = smu.measure.readwithtime()")
-        amp = self.keithley.query("print(amp)")
-        sec = self.keithley.query("print(sec)")
-        fracSec = self.keithley.query("print(fracSec)")
-        print(float(sec)+float(fracSec))
+        self.cache.pop('buffer_cleared', None)
+        #one round trip for the reading and its instrument timestamp
+        amp, sec, fracSec = self.keithley.query("amp, sec, fracSec = smu.measure.readwithtime() print(amp, sec, fracSec)").split()
         return float(amp), float(sec)+float(fracSec)
 
     def clear_buffer(self):
-        self.keithley.write("defbuffer1.clear()")
-
-    def reset(self):
-        self.keithley.write("reset()")
-        self.read_from_hardware()
-
-    def beep(self, duration=2, freq=2400):
-        self.keithley.write('beeper.beep({0:f}, {1:f})'.format(duration,freq))
-
-    def disconnect(self):
-        try:
-            self.rm.close()
-            del self.rm
-            del self.keithley
-        except AttributeError as e:
-            pass
+        self.cached_write('buffer_cleared', True, "defbuffer1.clear()")
+
+    def start_sweep(self, vlist, delay):
+        """Load vlist into a source configuration list and run it as a list
+        sweep on the instrument's trigger model. Returns immediately, readings
+        accumulate in defbuffer1 and are fetched with read_sweep()
+        """
+        #the sweep changes level, output and buffer behind the cache's back
+        for key in ('level', 'output', 'buffer_cleared'):
+            self.cache.pop(key, None)
+
+        self.keithley.write("pcall(smu.source.configlist.delete, 'JVLIST')")
+        self.keithley.write("smu.source.configlist.create('JVLIST')")
+
+        #store the source levels in chunks so a single write never gets too long
+        vlist = np.asarray(vlist, dtype=float)
+        for i in range(0, vlist.size, self.sweep_chunk):
+            levels = ','.join('{:.9g}'.format(v) for v in vlist[i:i+self.sweep_chunk])
+            self.keithley.write("for _, v in ipairs({{{}}}) do smu.source.level = v smu.source.configlist.store('JVLIST') end".format(levels))
+
+        self.clear_buffer()
+        self.keithley.write("smu.source.sweeplist('JVLIST', 1, {:f}, 1, smu.OFF, defbuffer1)".format(delay))
+        self.keithley.write("trigger.model.initiate()")
+
+    def sweep_running(self):
+        state = str(self.keithley.query("print(trigger.model.state())"))
+        return state.split()[0] in ('trigger.STATE_RUNNING', 'trigger.STATE_WAITING', 'trigger.STATE_BUILDING', 'trigger.STATE_ABORTING')
+
+    def read_buffer_count(self):
+        return int(float(self.keithley.query("print(defbuffer1.n)")))
+
+    def read_sweep(self, start, end):
+        """Bulk read of buffer points start..end (1-based, inclusive).
+        Returns source values, readings and relative timestamps as arrays
+        """
+        chunks = []
+        for i in range(start, end+1, self.read_chunk):
+            j = min(i+self.read_chunk-1, end)
+            chunks.append(self.query_buffer("printbuffer({0:d}, {1:d}, defbuffer1.sourcevalues, defbuffer1.readings, defbuffer1.relativetimestamps)".format(i,j)))
+        data = np.concatenate(chunks).reshape(-1,3)
+        return data[:,0], data[:,1], data[:,2]
+
+    def start_tracking(self, period, count):
+        """Take count readings at the present source level, one every period
+        seconds on the instrument's timer. Returns immediately, readings
+        accumulate in defbuffer1 and are fetched with read_tracking()
+        """
+        self.cache.pop('buffer_cleared', None)
+        self.keithley.write("trigger.model.load('Empty')")
+        self.keithley.write("defbuffer1.capacity = {:d}".format(count))
+        self.clear_buffer()
+        self.keithley.write("trigger.timer[1].reset()")
+        self.keithley.write("trigger.timer[1].delay = {:f}".format(period))
+        self.keithley.write("trigger.timer[1].count = 0")
+        self.keithley.write("trigger.timer[1].start.stimulus = trigger.EVENT_NOTIFY1")
+        self.keithley.write("trigger.timer[1].enable = trigger.ON")
+        self.keithley.write("trigger.model.setblock(1, trigger.BLOCK_NOTIFY, trigger.EVENT_NOTIFY1)")
+        self.keithley.write("trigger.model.setblock(2, trigger.BLOCK_WAIT, trigger.EVENT_TIMER1)")
+        self.keithley.write("trigger.model.setblock(3, trigger.BLOCK_MEASURE_DIGITIZE, defbuffer1)")
+        self.keithley.write("trigger.model.setblock(4, trigger.BLOCK_BRANCH_COUNTER, {:d}, 2)".format(count))
+        self.keithley.write("trigger.model.initiate()")
+
+    def tracking_running(self):
+        return self.sweep_running()
+
+    def read_tracking(self, start, end):
+        """Bulk read of tracking readings start..end (1-based, inclusive).
+        Returns readings and instrument clock timestamps in seconds
+        """
+        chunks = []
+        for i in range(start, end+1, self.read_chunk):
+            j = min(i+self.read_chunk-1, end)
+            chunks.append(self.query_buffer("printbuffer({0:d}, {1:d}, defbuffer1.readings, defbuffer1.seconds, defbuffer1.fractionalseconds)".format(i,j)))
+        data = np.concatenate(chunks).reshape(-1,3)
+        return data[:,0], data[:,1] + data[:,2]
+
+    def abort_tracking(self):
+        self.keithley.write("trigger.model.abort()")
+
+    def start_mpp(self, v, dv, vmin, vmax, period, nreports=0):
+        """Run perturb and observe MPP tracking on the instrument, starting at
+        v with steps of dv within vmin..vmax, until abort_mpp() or for nreports
+        reports. Returns immediately, reports are fetched with read_mpp()
+        """
+        self.set_source('Voltage')
+        self.set_measureFunc('Current')
+        self.set_output('On')
+        self.cache.pop('level', None)
+
+        #reads wait for the next report, which is up to a period away
+        self.mpp_timeout = self.keithley.timeout
+        self.keithley.timeout = max(self.keithley.timeout, 2000*period + 1000)
+        self.keithley.write("jv_mpp({:f}, {:f}, {:f}, {:f}, {:f}, {:d})".format(v, dv, vmin, vmax, period, nreports))
+
+    def abort_mpp(self):
+        #a device clear stops the running script
+        self.keithley.clear()
+        self.keithley.timeout = self.mpp_timeout
+        self.keithley.write("smu.source.output=smu.OFF")
+        self.cache['output'] = 'Off'
+
+    def abort_sweep(self):
+        self.keithley.write("trigger.model.abort()")
+        self.keithley.write("smu.source.output=smu.OFF")
+        self.cache['output'] = 'Off'
@@ -1,28 +1,83 @@
-from ScopeFoundry import HardwareComponent
+from KeithleyTSPBase import KeithleyTSPBase, InvalidSourceError, InvalidTerminalError, InvalidMeasurementError, InvalidSenseError
 import numpy as np
-import time
-import pyvisa
+import hashlib
 
-class InvalidSourceError(Exception):
-    pass
 
-class InvalidTerminalError(Exception):
-    pass
-
-class InvalidMeasurementError(Exception):
-    pass
-
-class InvalidSenseError(Exception):
-    pass
-
-
-class Keithley2600HW(HardwareComponent):
+class Keithley2600HW(KeithleyTSPBase):
 
     name = 'Keithley 2600'
 
+    channels = ('smua', 'smub')
+
+    #TSP functions loaded into the instrument by load_library().
+    #jv_print(ch, name, ...) prints the named settings of channel ch ('smua' or 'smub')
+    #tab separated, in one round trip.
+    #jv_mpp(smu, ...) is perturb and observe maximum power point tracking on channel smu,
+    #run by start_mpp(). every period seconds it prints the elapsed time, the mean V, I
+    #and P since the last report and the number of loop iterations they cover
+    tsp_library = (
+        "local function pick(value, on, a, b) if value == on then return a end return b end",
+        "local channels = {smua = smua, smub = smub}",
+        "local getters = {",
+        "source = function(smu, ch) return pick(smu.source.func, smu.OUTPUT_DCAMPS, 'Current', 'Voltage') end,",
+        "measure = function(smu, ch) return pick(display[ch].measure.func, display.MEASURE_DCVOLTS, 'Voltage', 'Current') end,",
+        "level = function(smu, ch) if smu.source.func == smu.OUTPUT_DCAMPS then return smu.source.leveli end return smu.source.levelv end,",
+        "ilimit = function(smu, ch) return smu.source.limiti end,",
+        "vlimit = function(smu, ch) return smu.source.limitv end,",
+        "sense = function(smu, ch) return pick(smu.sense, smu.SENSE_REMOTE, '4Wire', '2Wire') end,",
+        "autorange = function(smu, ch) local a = smu.measure.autorangei if smu.source.func == smu.OUTPUT_DCAMPS then a = smu.measure.autorangev end return pick(a, smu.AUTORANGE_ON, 'On', 'Off') end,",
+        "nplc = function(smu, ch) return smu.measure.nplc end,",
+        "output = function(smu, ch) return pick(smu.source.output, smu.OUTPUT_ON, 'On', 'Off') end,",
+        "delay = function(smu, ch) return smu.source.delay end,",
+        "filter = function(smu, ch) if smu.measure.filter.enable == smu.FILTER_ON then return smu.measure.filter.count end return 1 end,",
+        "}",
+        "function jv_print(ch, ...)",
+        "local values = {}",
+        "for k, name in ipairs({...}) do values[k] = tostring(getters[name](channels[ch], ch)) end",
+        "print(table.concat(values, '\t'))",
+        "end",
+        "function jv_mpp(smu, v, dv, vmin, vmax, period, nreports)",
+        "smu.source.levelv = v",
+        "local p = -v*smu.measure.i()",
+        "local t0 = timer.measure.t()",
+        "local r = 0",
+        "while nreports <= 0 or r < nreports do",
+        "local n, sv, si, sp, t = 0, 0, 0, 0, 0",
+        "repeat",
+        "if v + dv > vmax or v + dv < vmin then dv = -dv end",
+        "v = v + dv",
+        "smu.source.levelv = v",
+        "local i = smu.measure.i()",
+        "if -v*i < p then dv = -dv end",
+        "p = -v*i",
+        "n = n + 1 sv = sv + v si = si + i sp = sp + p",
+        "t = timer.measure.t() - t0",
+        "until t >= (r + 1)*period",
+        "print(t, sv/n, si/n, sp/n, n)",
+        "r = r + 1",
+        "end",
+        "end",
+    )
+    #logged quantities read back together by read_from_hardware(), with their jv_print names
+    hardware_settings = (('Source', 'source'), ('Measurement', 'measure'), ('Level', 'level'),
+                         ('ILimit', 'ilimit'), ('VLimit', 'vlimit'), ('Sense', 'sense'),
+                         ('Autorange', 'autorange'), ('NPLC', 'nplc'), ('Output', 'output'),
+                         ('Measure_Delay', 'delay'), ('Filter_Count', 'filter'))
+
+    #numeric settings and the value they take when they read as nil
+    numeric_settings = {'level': 0.0, 'ilimit': 0.0, 'vlimit': 210.0, 'nplc': 1.0, 'delay': 0.0, 'filter': 1.0}
+
+    #*IDN? replies of the instruments this component drives, for discover()
+    idn_pattern = r'MODEL\s*26\d\d'
+
+    library_version = hashlib.sha1('\n'.join(tsp_library).encode()).hexdigest()[:12]
 
     def setup(self):
-        
+
+        self.setup_visa_settings('GPIB0::26::INSTR')
+
+        #the settings below apply to this channel, every command also takes an optional ch
+        self.settings.New('Channel', dtype=str, choices=self.channels, initial='smua')
         self.settings.New('Source', dtype=str, choices=[("Voltage","Voltage"),("Current","Current")], initial='Voltage')
         self.settings.New('Measurement', dtype=str, choices=[("Voltage","Voltage"),("Current","Current")], initial='Current')
         self.settings.New('Level', dtype = float, initial = 0, vmin=-50, vmax=50)
@@ -33,13 +88,18 @@ class Keithley2600HW(HardwareComponent):
         self.settings.New('VLimit', dtype= float, unit = 'V', si = True, initial = 20)
         self.settings.New('Autorange', dtype=str, choices = [('On','On'),('Off','Off')], initial = 'On')
         self.settings.New('NPLC', dtype = float, initial = 1, vmin=0.01, vmax = 10)
-        self.add_operation('Reset', self.reset)
-        self.add_operation('Beep', self.beep)
+        #readings the SMU averages into each measurement, 1 turns its repeat filter off
+        self.settings.New('Filter_Count', dtype=int, initial=1, vmin=1, vmax=100)
+        self.setup_connect_settings()
+
+        #instrument time of the first reading of each channel's tracking block, see read_tracking()
+        self.tracking_base = {}
+
+        self.settings.Channel.add_listener(self.channel_change)
 
 
     def connect(self):
-        self.rm = pyvisa.ResourceManager()
-        self.keithley = self.rm.open_resource('GPIB0::26::INSTR')
+        self.open_connection()
 
         LQ = self.settings.as_dict()
 
@@ -69,28 +129,57 @@ class Keithley2600HW(HardwareComponent):
         LQ['Measure_Delay'].hardware_set_func = self.set_delay
         LQ['Measure_Delay'].hardware_read_func = self.read_delay
 
+        LQ['Filter_Count'].hardware_set_func = self.set_filter_count
+        LQ['Filter_Count'].hardware_read_func = self.read_filter_count
+
         LQ["ILimit"].hardware_set_func    = self.set_ilimit
         LQ["ILimit"].hardware_read_func    = self.read_ilimit
 
         LQ['VLimit'].hardware_set_func = self.set_vlimit
         LQ["VLimit"].hardware_read_func    = self.read_vlimit
 
-        #Reset the Keithley, which also reads all the default values from hardware
-        self.reset()
-
-        self.settings['ILimit'] = 1
-        self.settings['Sense'] = '2Wire'
-
-    def set_source(self,func='Voltage'):
+        self.finish_connect()
+
+    def channel(self, ch=None):
+        return ch or self.settings['Channel']
+
+    def channel_change(self):
+        #show the newly selected channel's state
+        if self.settings['connected']:
+            self.read_from_hardware()
+
+    def query_settings(self, *names, ch=None):
+        #values of the named settings as text, through the library in one round trip
+        args = ', '.join("'{}'".format(name) for name in (self.channel(ch),) + names)
+        return self.keithley.query("jv_print({})".format(args)).strip().split('\t')
+
+    def cached_write(self, key, value, cmd, ch=None):
+        """Write cmd unless value is already applied to the channel.
+        Returns True if the write was sent
+        """
+        key = (self.channel(ch), key)
+        if key in self.cache and self.cache[key] == value:
+            self.writes_avoided += 1
+            return False
+        self.keithley.write(cmd)
+        self.cache[key] = value
+        return True
+
+    def source_func(self, ch=None):
+        #last source function written to the channel, the setting if unknown
+        return self.cache.get((self.channel(ch), 'source'), self.settings['Source'])
+
+    def set_source(self,func='Voltage', ch=None):
+        ch = self.channel(ch)
         if func == 'Voltage':
-            self.keithley.write("smua.source.func = smua.OUTPUT_DCVOLTS ")
+            self.cached_write('source', func, "{0}.source.func = {0}.OUTPUT_DCVOLTS".format(ch), ch)
 
             #Maximum and minimum levels from Keithley 2450 manual
             self.settings.Level.vmin = -210
             self.settings.Level.vmax = 210
             self.settings.Level.unit = 'V'
         elif func == 'Current':
-            self.keithley.write("smua.source.func = smua.OUTPUT_DCAMPS")
+            self.cached_write('source', func, "{0}.source.func = {0}.OUTPUT_DCAMPS".format(ch), ch)
 
             #Maximum and minimum levels from Keithley 2450 manual
             self.settings.Level.vmin = -1.05
@@ -100,166 +189,311 @@ class Keithley2600HW(HardwareComponent):
             raise InvalidSourceError('Invalid source function')
 
     def read_sourceFunc(self):
-        func =  str(self.keithley.query("print(smua.source.func)"))
-        if func == 'smua.OUTPUT_DCAMPS':
-            return 'Current'
-        else:
-            return 'Voltage'
-
-    def set_measureFunc(self,func='Current'):
+        return self.read_setting('source')
 
+    def set_measureFunc(self,func='Current', ch=None):
+        ch = self.channel(ch)
         if func == 'Voltage':
-            self.keithley.write("display.smua.measure.func = display.MEASURE_DCVOLTS")
+            self.cached_write('measure', func, "display.{0}.measure.func = display.MEASURE_DCVOLTS".format(ch), ch)
         elif func == 'Current':
-            self.keithley.write("display.smua.measure.func = display.MEASURE_DCAMPS")
+            self.cached_write('measure', func, "display.{0}.measure.func = display.MEASURE_DCAMPS".format(ch), ch)
         else:
             raise InvalidMeasurementError('Invalid measurement function')
 
     def read_measureFunc(self):
-        func =  str(self.keithley.query("print(display.smua.measure.func)"))
-        if func == 'display.MEASURE_DCVOLTS':
-            return 'Voltage'
-        else:
-            return 'Current'
+        return self.read_setting('measure')
 
-    def set_level(self,level):
-
-        if self.settings['Source'] =='Voltage':
-            self.keithley.write("smua.source.levelv= {:f}".format(level))
+    def set_level(self,level, ch=None):
+        ch = self.channel(ch)
+        if self.source_func(ch) =='Voltage':
+            self.cached_write('levelv', level, "{0}.source.levelv= {1:f}".format(ch, level), ch)
         else:
-            self.keithley.write("smua.source.leveli= {:f}".format(level))
+            self.cached_write('leveli', level, "{0}.source.leveli= {1:f}".format(ch, level), ch)
 
     def read_level(self):
+        return self.read_setting('level')
 
-        if self.settings['Source'] =='Voltage':
-            return float(self.keithley.query("print(smua.source.levelv)"))
-        else:
-            return float(self.keithley.query("print(smua.source.leveli)"))
-
-    def set_ilimit(self,limit):
-        self.keithley.write("smua.source.limiti = {:f}".format(limit))
+    def set_ilimit(self,limit, ch=None):
+        ch = self.channel(ch)
+        self.cached_write('ilimit', limit, "{0}.source.limiti = {1:f}".format(ch, limit), ch)
 
     def read_ilimit(self):
-        return float(self.keithley.query("print(smua.source.limiti)"))
+        return self.read_setting('ilimit')
 
-    def set_vlimit(self, limit):
-        self.keithley.write("smua.source.limitv = {:f}".format(limit))
+    def set_vlimit(self, limit, ch=None):
+        ch = self.channel(ch)
+        self.cached_write('vlimit', limit, "{0}.source.limitv = {1:f}".format(ch, limit), ch)
 
     def read_vlimit(self):
-        vlim = self.keithley.query("print(smua.source.limitv)")
-        if vlim == 'nil\n':
-            return 210
-        else:
-            return float(vlim)
+        return self.read_setting('vlimit')
 
-    def set_sense(self,m_type):
+    def set_sense(self,m_type, ch=None):
+        ch = self.channel(ch)
         if m_type == '2Wire':
-            self.keithley.write("smua.sense = smua.SENSE_LOCAL")
+            self.cached_write('sense', m_type, "{0}.sense = {0}.SENSE_LOCAL".format(ch), ch)
         elif m_type == '4Wire':
-            self.keithley.write("smua.sense = smua.SENSE_REMOTE")
+            self.cached_write('sense', m_type, "{0}.sense = {0}.SENSE_REMOTE".format(ch), ch)
         else:
             raise InvalidSenseError('Invalid sense type')
 
     def read_sense(self):
-        sense = str(self.keithley.query("print(smua.sense)"))
-        if sense == 'smua.SENSE_LOCAL':
-            return '2Wire'
-        else:
-            return '4Wire'
+        return self.read_setting('sense')
 
 
-    def set_autorange(self,autorange='On'):
-        if self.settings['Source'] =='Voltage':
+    def set_autorange(self,autorange='On', ch=None):
+        ch = self.channel(ch)
+        if self.source_func(ch) =='Voltage':
             if autorange == 'On':
-                self.keithley.write("smua.measure.autorangei = smua.AUTORANGE_ON")
+                self.cached_write('autorangei', autorange, "{0}.measure.autorangei = {0}.AUTORANGE_ON".format(ch), ch)
             else:
-                self.keithley.write("smua.measure.autorangei = smua.AUTORANGE_OFF")
+                self.cached_write('autorangei', autorange, "{0}.measure.autorangei = {0}.AUTORANGE_OFF".format(ch), ch)
         else:
             if autorange == 'On':
-                self.keithley.write("smua.measure.autorangev = smua.AUTORANGE_ON")
+                self.cached_write('autorangev', autorange, "{0}.measure.autorangev = {0}.AUTORANGE_ON".format(ch), ch)
             else:
-                self.keithley.write("smua.measure.autorangev = smua.AUTORANGE_OFF")
+                self.cached_write('autorangev', autorange, "{0}.measure.autorangev = {0}.AUTORANGE_OFF".format(ch), ch)
 
     def read_autorange(self):
+        return self.read_setting('autorange')
 
-        if self.settings['Source'] =='Voltage':
-            ans =  str(self.keithley.query("print(smua.measure.autorangei)"))
-            if ans == 'smua.AUTORANGE_ON':
-                return 'On'
-            else:
-                return 'Off'
-        else:
-            ans =  str(self.keithley.query("print(smua.measure.autorangev)"))
-            if ans == 'smua.AUTORANGE_ON':
-                return 'On'
-            else:
-                return 'Off'
-
-    def set_NPLC(self,NPLC):
-        self.keithley.write("smua.measure.nplc = {:f}".format(NPLC))
+    def set_NPLC(self,NPLC, ch=None):
+        ch = self.channel(ch)
+        self.cached_write('nplc', NPLC, "{0}.measure.nplc = {1:f}".format(ch, NPLC), ch)
 
     def read_NPLC(self):
-        nplc = self.keithley.query("print(smua.source.nplc)")
-        if nplc == 'nil\n':
-            return float(1)
-        else:
-            return float(nplc)
+        return self.read_setting('nplc')
 
-    def set_output(self,output):
+    def set_output(self,output, ch=None):
+        ch = self.channel(ch)
         if output == 'On':
-            self.keithley.write("smua.source.output = smua.OUTPUT_ON")
+            self.cached_write('output', output, "{0}.source.output = {0}.OUTPUT_ON".format(ch), ch)
         else:
-            self.keithley.write("smua.source.output = smua.OUTPUT_OFF")
+            self.cached_write('output', output, "{0}.source.output = {0}.OUTPUT_OFF".format(ch), ch)
 
     def read_output(self):
-        output = str(self.keithley.query("print(smua.source.output)"))
-        if output == 'smua.OUTPUT_ON':
-            return 'On'
-        else:
-            return 'Off'
+        return self.read_setting('output')
 
-    def set_delay(self,delay):
-        self.keithley.write("smua.source.delay = {:f}".format(delay))
+    def set_delay(self,delay, ch=None):
+        ch = self.channel(ch)
+        self.cached_write('delay', delay, "{0}.source.delay = {1:f}".format(ch, delay), ch)
 
     def read_delay(self):
-        ans = self.keithley.query("print(smua.source.delay)")
-        if ans=='smua.DELAY_AUTO' or ans =='-1':
-            return float(-1)
-        elif ans=='smua.DELAY_OFF' or ans =='0':
-            return float(0)
+        #DELAY_AUTO is -1 and DELAY_OFF 0
+        return self.read_setting('delay')
+
+    def set_filter_count(self, count, ch=None):
+        """Average count readings into every measurement with the repeating
+        average filter, noise drops as 1/sqrt(count) and each measurement
+        takes count times as long. 1 turns the filter off"""
+        ch = self.channel(ch)
+        count = int(count)
+        if count > 1:
+            self.cached_write('filter', count, "{0}.measure.filter.count = {1:d} {0}.measure.filter.type = {0}.FILTER_REPEAT_AVG "
+                              "{0}.measure.filter.enable = {0}.FILTER_ON".format(ch, count), ch)
         else:
-            return float(ans)
+            self.cached_write('filter', 1, "{0}.measure.filter.enable = {0}.FILTER_OFF".format(ch), ch)
 
-    def read_measurement(self):
-        if self.settings['Source'] =='Voltage':
-            return float(self.keithley.query("print(smua.measure.i())"))
+    def read_filter_count(self):
+        return int(self.read_setting('filter'))
+
+    def read_measurement(self, ch=None):
+        ch = self.channel(ch)
+        self.cache.pop((ch, 'buffer_cleared'), None)
+        if self.source_func(ch) =='Voltage':
+            return float(self.keithley.query("print({0}.measure.i())".format(ch)))
+        else:
+            return float(self.keithley.query("print({0}.measure.v())".format(ch)))
+
+    def read_measurement_withTime(self, ch=None):
+        ch = self.channel(ch)
+        self.cache.pop((ch, 'buffer_cleared'), None)
+        #one round trip for the reading and the instrument's timer
+        if self.source_func(ch) =='Voltage':
+            val, t = self.keithley.query("print({0}.measure.i(), timer.measure.t())".format(ch)).split()
+        else:
+            val, t = self.keithley.query("print({0}.measure.v(), timer.measure.t())".format(ch)).split()
+        return float(val), float(t)
+
+    def load_sweep(self, vlist, delay, ch=None):
+        """Load vlist into the channel's trigger model as a voltage list sweep
+        that measures current into its nvbuffer1, without starting it
+        """
+        ch = self.channel(ch)
+        #the sweep leaves the source level and buffer changed behind the cache's back
+        for key in ('levelv', 'buffer_cleared'):
+            self.cache.pop((ch, key), None)
+
+        self.keithley.write("jvlist_{0} = {{}}".format(ch))
+
+        #build the list in chunks so a single write never gets too long
+        vlist = np.asarray(vlist, dtype=float)
+        for i in range(0, vlist.size, self.sweep_chunk):
+            levels = ','.join('{:.9g}'.format(v) for v in vlist[i:i+self.sweep_chunk])
+            self.keithley.write("for _, v in ipairs({{{1}}}) do table.insert(jvlist_{0}, v) end".format(ch, levels))
+
+        self.setup_sweep_buffer(ch)
+        self.cached_write('source', 'Voltage', "{0}.source.func = {0}.OUTPUT_DCVOLTS".format(ch), ch)
+        self.cached_write('delay', delay, "{0}.source.delay = {1:f}".format(ch, delay), ch)
+        self.keithley.write("{0}.trigger.source.listv(jvlist_{0})".format(ch))
+        self.keithley.write("{0}.trigger.source.action = {0}.ENABLE".format(ch))
+        self.keithley.write("{0}.trigger.measure.i({0}.nvbuffer1)".format(ch))
+        self.keithley.write("{0}.trigger.measure.action = {0}.ENABLE".format(ch))
+        self.keithley.write("{0}.trigger.count = {1:d}".format(ch, vlist.size))
+        self.keithley.write("{0}.trigger.arm.count = 1".format(ch))
+        self.keithley.write("{0}.trigger.endsweep.action = {0}.SOURCE_IDLE".format(ch))
+        #undo any synchronization left from a dual channel sweep
+        self.keithley.write("{0}.trigger.source.stimulus = 0 {0}.trigger.measure.stimulus = 0".format(ch))
+        self.cached_write('output', 'On', "{0}.source.output = {0}.OUTPUT_ON".format(ch), ch)
+
+    def start_sweep(self, vlist, delay, ch=None):
+        """Run vlist as a voltage list sweep on the channel. Returns
+        immediately, readings are fetched with read_sweep()
+        """
+        ch = self.channel(ch)
+        self.load_sweep(vlist, delay, ch)
+        self.keithley.write("{0}.trigger.initiate()".format(ch))
+
+    def start_dual_sweep(self, vlist, delay):
+        """Run vlist on smua and smub at the same time. The trigger models
+        are chained so every point is sourced on both channels before smua
+        measures, keeping the two sweeps in lock step on the instrument.
+        Readings are fetched per channel with read_sweep()
+        """
+        for ch in self.channels:
+            self.load_sweep(vlist, delay, ch)
+        self.keithley.write("smub.trigger.source.stimulus = smua.trigger.SOURCE_COMPLETE_EVENT_ID")
+        self.keithley.write("smua.trigger.measure.stimulus = smub.trigger.SOURCE_COMPLETE_EVENT_ID")
+        #smub has to be waiting on smua before smua starts
+        self.keithley.write("smub.trigger.initiate() smua.trigger.initiate()")
+
+    def setup_sweep_buffer(self, ch=None):
+        ch = self.channel(ch)
+        self.cache.pop((ch, 'buffer_cleared'), None)
+        self.keithley.write("{0}.nvbuffer1.clear()".format(ch))
+        self.keithley.write("{0}.nvbuffer1.collectsourcevalues = 1".format(ch))
+        self.keithley.write("{0}.nvbuffer1.collecttimestamps = 1".format(ch))
+
+    def status_running(self, register, channels):
+        #the SMUA/SMUB bits of the status.operation register are set while the channel is busy
+        mask = '+'.join('status.operation.{0}.SMU{1}'.format(register, ch[-1].upper()) for ch in channels)
+        return int(float(self.keithley.query("print(bit.bitand(status.operation.{0}.condition, {1}))".format(register, mask)))) != 0
+
+    def sweep_running(self, ch=None):
+        return self.status_running('sweeping', [self.channel(ch)])
+
+    def dual_sweep_running(self):
+        return self.status_running('sweeping', self.channels)
+
+    def read_buffer_count(self, ch=None):
+        return int(float(self.keithley.query("print({0}.nvbuffer1.n)".format(self.channel(ch)))))
+
+    def read_sweep(self, start, end, ch=None):
+        """Bulk read of buffer points start..end (1-based, inclusive), split
+        into read_chunk sized queries for long sweeps.
+        Returns source values, readings and timestamps as arrays
+        """
+        ch = self.channel(ch)
+        chunks = []
+        for i in range(start, end+1, self.read_chunk):
+            j = min(i+self.read_chunk-1, end)
+            chunks.append(self.query_buffer("printbuffer({0:d}, {1:d}, {2}.nvbuffer1.sourcevalues, {2}.nvbuffer1.readings, {2}.nvbuffer1.timestamps)".format(i,j,ch)))
+        data = np.concatenate(chunks).reshape(-1,3)
+        return data[:,0], data[:,1], data[:,2]
+
+    def tracking_commands(self, period, count, ch):
+        self.cache.pop((ch, 'buffer_cleared'), None)
+        self.tracking_base.pop(ch, None)
+        self.keithley.write("{0}.nvbuffer1.clear()".format(ch))
+        self.keithley.write("{0}.nvbuffer1.collecttimestamps = 1".format(ch))
+        self.keithley.write("{0}.measure.count = {1:d}".format(ch, count))
+        self.keithley.write("{0}.measure.interval = {1:f}".format(ch, period))
+        if self.source_func(ch) =='Voltage':
+            return "{0}.measure.overlappedi({0}.nvbuffer1)".format(ch)
         else:
-            return float(self.keithley.query("print(smua.measure.v())"))
-
-    def read_measurement_withTime(self):
-        val = self.read_measurement()
-        t = time.time()
-        return val, t
-
-    def linVSweepMeasureI(self,Vstart,Vstop,pts,delay):
-        self.keithley.write('SweepVLinMeasureI(smua, {0:f}, {1:f}, {2:f}, {3:d})'.format(Vstart,Vstop,delay,pts))
-        readings = self.keithly.query('printbuffer(1,{:d}, smua.nvbuffer1.readings)'.format(pts)).split(', ')
-        return np.array([float(i) for i in readings])
-
-    def clear_buffer(self):
-        self.keithley.write("smua.nvbuffer1.clear()")
-
-    def reset(self):
-        self.keithley.write("reset()")
-        self.read_from_hardware()
-
-    def beep(self, duration=2, freq=2400):
-        self.keithley.write('beeper.beep({0:f}, {1:f})'.format(duration,freq))
-
-    def disconnect(self):
-        try:
-            self.rm.close()
-            del self.rm
-            del self.keithley
-        except AttributeError as e:
-            pass
+            return "{0}.measure.overlappedv({0}.nvbuffer1)".format(ch)
+
+    def start_tracking(self, period, count, ch=None):
+        """Take count overlapped readings at the present source level, one
+        every period seconds on the instrument's measure interval timer.
+        Returns immediately, readings are fetched with read_tracking()
+        """
+        ch = self.channel(ch)
+        self.keithley.write(self.tracking_commands(period, count, ch))
+
+    def start_dual_tracking(self, period, count):
+        #both channels are started by the same command so their timers run together
+        self.keithley.write(' '.join([self.tracking_commands(period, count, ch) for ch in self.channels]))
+
+    def tracking_running(self, ch=None):
+        return self.status_running('measuring', [self.channel(ch)])
+
+    def dual_tracking_running(self):
+        return self.status_running('measuring', self.channels)
+
+    def read_tracking(self, start, end, ch=None):
+        """Bulk read of tracking readings start..end (1-based, inclusive).
+        Returns readings and instrument timestamps in seconds
+        """
+        ch = self.channel(ch)
+        chunks = []
+        for i in range(start, end+1, self.read_chunk):
+            j = min(i+self.read_chunk-1, end)
+            chunks.append(self.query_buffer("printbuffer({0:d}, {1:d}, {2}.nvbuffer1.readings, {2}.nvbuffer1.timestamps)".format(i,j,ch)))
+        data = np.concatenate(chunks).reshape(-1,2)
+        #buffer timestamps count from its first reading, so each new block would start again at 0.
+        #the block's base timestamp puts them all on the instrument's clock
+        if ch not in self.tracking_base:
+            self.tracking_base[ch] = float(self.keithley.query("print({0}.nvbuffer1.basetimestamp)".format(ch)))
+        return data[:,0], data[:,1] + self.tracking_base[ch]
+
+    def start_mpp(self, v, dv, vmin, vmax, period, nreports=0, ch=None):
+        """Run perturb and observe MPP tracking on the instrument, starting at
+        v with steps of dv within vmin..vmax, until abort_mpp() or for nreports
+        reports. Returns immediately, reports are fetched with read_mpp()
+        """
+        ch = self.channel(ch)
+        self.set_source('Voltage', ch)
+        self.set_measureFunc('Current', ch)
+        self.set_output('On', ch)
+        self.cache.pop((ch, 'levelv'), None)
+
+        #reads wait for the next report, which is up to a period away
+        self.mpp_timeout = self.keithley.timeout
+        self.keithley.timeout = max(self.keithley.timeout, 2000*period + 1000)
+        self.mpp_channel = ch
+        self.keithley.write("jv_mpp({0}, {1:f}, {2:f}, {3:f}, {4:f}, {5:f}, {6:d})".format(ch, v, dv, vmin, vmax, period, nreports))
+
+    def abort_mpp(self):
+        #a device clear stops the running script
+        self.keithley.clear()
+        self.keithley.timeout = self.mpp_timeout
+        ch = self.mpp_channel
+        self.keithley.write("{0}.source.output = {0}.OUTPUT_OFF".format(ch))
+        self.cache[(ch, 'output')] = 'Off'
+
+    def abort_tracking(self, ch=None):
+        ch = self.channel(ch)
+        self.keithley.write("{0}.abort()".format(ch))
+        self.keithley.write("{0}.measure.count = 1".format(ch))
+
+    def abort_sweep(self, ch=None):
+        ch = self.channel(ch)
+        self.keithley.write("{0}.abort()".format(ch))
+        self.cached_write('output', 'Off', "{0}.source.output = {0}.OUTPUT_OFF".format(ch), ch)
+
+    def linVSweepMeasureI(self,Vstart,Vstop,pts,delay, ch=None):
+        """Linear voltage sweep using the factory SweepVLinMeasureI script.
+        Blocks until the sweep is done and returns voltages, currents and
+        timestamps as arrays
+        """
+        ch = self.channel(ch)
+        self.setup_sweep_buffer(ch)
+        #the factory script reconfigures the channel, nothing cached can be trusted afterwards
+        self.invalidate_cache()
+        self.keithley.write('SweepVLinMeasureI({0}, {1:f}, {2:f}, {3:f}, {4:d})'.format(ch,Vstart,Vstop,delay,pts))
+        n = int(float(self.keithley.query('waitcomplete() print({0}.nvbuffer1.n)'.format(ch))))
+        return self.read_sweep(1, n, ch)
+
+    def clear_buffer(self, ch=None):
+        ch = self.channel(ch)
+        self.cached_write('buffer_cleared', True, "{0}.nvbuffer1.clear()".format(ch), ch)
@@ -0,0 +1,287 @@
+from ScopeFoundry import HardwareComponent
+from CommandProfiler import CommandProfiler, ProfiledResource
+from ResourcePool import resource_pool, LockedResource
+import numpy as np
+import threading
+import time
+
+class InvalidSourceError(Exception):
+    pass
+
+class InvalidTerminalError(Exception):
+    pass
+
+class InvalidMeasurementError(Exception):
+    pass
+
+class InvalidSenseError(Exception):
+    pass
+
+
+class KeithleyTSPBase(HardwareComponent):
+    """
+    What the TSP SMU drivers share: opening the VISA session with retries,
+    discovery by *IDN?, reconnecting on timeouts, the TSP library and the
+    batched settings readback through it, and bulk buffer transfers.
+
+    Subclasses provide tsp_library, library_version, hardware_settings,
+    numeric_settings, idn_pattern, query_settings() and the setting
+    functions, and call setup_visa_settings(), setup_connect_settings(),
+    open_connection() and finish_connect() from setup() and connect().
+    """
+
+    #number of points per write when loading a sweep and per query when reading it back
+    sweep_chunk = 100
+    read_chunk = 1000
+
+    #format used for bulk buffer reads: 'ASCII', 'REAL32' or 'REAL64'
+    buffer_format = 'REAL64'
+
+    #seconds before the first reconnect attempt, doubled for each one after
+    retry_delay = 0.5
+
+    #lock shared with the other instruments on the bus, see use_bus_lock()
+    bus_lock = None
+
+    #measurement driving the instrument, see claim()
+    owner = None
+    owner_lock = threading.Lock()
+
+    def setup_visa_settings(self, address):
+        #'auto' connects to the first instrument matching idn_pattern found on the bus, see discover()
+        self.settings.New('VISA_address', dtype=str, initial=address)
+        #session timeout and read chunk size, a chunk holds a whole bulk buffer read in one call
+        self.settings.New('visa_timeout', dtype=int, initial=2000, vmin=100, unit='ms')
+        self.settings.New('chunk_size', dtype=int, initial=1048576, vmin=1024, unit='B')
+
+    def setup_connect_settings(self):
+        #off keeps the instrument as it is on connect and only reads its settings back
+        self.settings.New('reset_on_connect', dtype=bool, initial=True)
+        self.settings.New('connect_retries', dtype=int, initial=2, vmin=0)
+        self.add_operation('Reset', self.reset)
+        self.add_operation('Reconnect', self.reconnect)
+        self.add_operation('Discover', self.discover)
+        self.add_operation('Beep', self.beep)
+        self.add_operation('Invalidate Cache', self.invalidate_cache)
+
+        #latency of every command sent, see CommandProfiler
+        self.profiler = CommandProfiler()
+        self.add_operation('Clear Profile', self.profiler.clear)
+
+        #last value written for each setting, used to skip redundant writes
+        self.cache = {}
+        self.writes_avoided = 0
+
+    def open_connection(self):
+        #first part of connect(), before the logged quantities are wired up
+        self.rm = resource_pool.acquire()
+        if self.settings['VISA_address'] == 'auto':
+            self.discover()
+        self.open_instrument()
+
+    def finish_connect(self):
+        #last part of connect(), once the logged quantities have their hardware functions
+        LQ = self.settings.as_dict()
+        LQ['visa_timeout'].hardware_set_func = self.set_visa_timeout
+        LQ['chunk_size'].hardware_set_func = self.set_chunk_size
+
+        #settings reads and writes are safe to repeat, after a VISA timeout they reconnect and try again
+        for lq_name, name in self.hardware_settings:
+            LQ[lq_name].hardware_set_func = self.retry_on_timeout(LQ[lq_name].hardware_set_func)
+            LQ[lq_name].hardware_read_func = self.retry_on_timeout(LQ[lq_name].hardware_read_func)
+
+        if self.settings['reset_on_connect']:
+            #Reset the Keithley, which also reads all the default values from hardware
+            self.reset()
+
+            self.settings['ILimit'] = 1
+            self.settings['Sense'] = '2Wire'
+        else:
+            self.read_from_hardware()
+
+    def open_instrument(self):
+        """Open the VISA resource and load the TSP library. On a timeout,
+        e.g. from a script left running or a wedged bus, the resource is
+        closed and opened again with a device clear, connect_retries times
+        """
+        retries = self.settings['connect_retries']
+        #a reconnect while the bus is shared keeps the lock and its wait time
+        previous = getattr(self, 'keithley', None)
+        wait_time = previous.wait_time if isinstance(previous, LockedResource) else 0
+        for attempt in range(retries + 1):
+            resource = None
+            try:
+                resource = resource_pool.open(self.settings['VISA_address'], self.settings['visa_timeout'], self.settings['chunk_size'])
+                self.keithley = ProfiledResource(resource, self.profiler)
+                if self.bus_lock is not None:
+                    self.keithley = LockedResource(self.keithley, self.bus_lock, wait_time)
+                if attempt:
+                    self.keithley.clear()
+                self.load_library()
+                return
+            except Exception as e:
+                if attempt == retries or not self.is_timeout(e):
+                    raise
+                self.log.warning('{} timed out on connect, retrying ({:d} of {:d})'.format(self.settings['VISA_address'], attempt+1, retries))
+                if resource is not None:
+                    resource.close()
+                time.sleep(self.retry_delay*2**attempt)
+
+    def discover(self):
+        """Set VISA_address to the first instrument on the bus whose *IDN?
+        matches idn_pattern, skipping the addresses of other connected SMUs
+        """
+        taken = [hw.settings['VISA_address'] for hw in self.app.hardware.values()
+                 if hw is not self and hw.settings['connected'] and 'VISA_address' in hw.settings.as_dict()]
+        resource_pool.acquire()
+        try:
+            found = resource_pool.find(self.idn_pattern, exclude=taken)
+            if not found:
+                raise IOError('no instrument matching {} among {}'.format(self.idn_pattern, ', '.join(resource_pool.list_resources()) or 'no resources'))
+            self.log.info('{} found at {}: {}'.format(self.name, found[0], resource_pool.identify(found[0])))
+        finally:
+            resource_pool.release()
+        self.settings['VISA_address'] = found[0]
+
+    def use_bus_lock(self, lock):
+        """Hold lock for every command from now on, including after a
+        reconnect, or stop locking if lock is None. For instruments sharing
+        a GPIB board, see AcquisitionScheduler
+        """
+        self.bus_lock = lock
+        resource = getattr(self, 'keithley', None)
+        if isinstance(resource, LockedResource):
+            resource = resource.resource
+        if resource is not None:
+            self.keithley = resource if lock is None else LockedResource(resource, lock)
+
+    def claim(self, owner):
+        """Mark the instrument as driven by the measurement owner until
+        release(owner), so two measurements never run on it at once. Raises
+        RuntimeError if another measurement has it
+        """
+        with self.owner_lock:
+            if self.owner is not None and self.owner is not owner:
+                raise RuntimeError('{} is in use by {}'.format(self.name, self.owner.name))
+            self.owner = owner
+
+    def release(self, owner):
+        with self.owner_lock:
+            if self.owner is owner:
+                self.owner = None
+
+    def set_visa_timeout(self, timeout):
+        self.keithley.timeout = timeout
+
+    def set_chunk_size(self, chunk_size):
+        self.keithley.chunk_size = chunk_size
+
+    def reconnect(self):
+        #new session after a timeout, the instrument keeps its settings
+        try:
+            self.keithley.close()
+        except Exception:
+            pass
+        self.invalidate_cache()
+        self.open_instrument()
+        self.read_from_hardware()
+
+    @staticmethod
+    def is_timeout(error):
+        import pyvisa
+        return isinstance(error, pyvisa.errors.VisaIOError) and error.error_code == pyvisa.constants.StatusCode.error_timeout
+
+    def retry_on_timeout(self, func):
+        """func, reconnecting and calling it once more if it hits a VISA
+        timeout. Only for commands that are safe to repeat
+        """
+        def call(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self.is_timeout(e):
+                    raise
+                self.log.warning('{} timed out, reconnecting to {}'.format(func.__name__, self.settings['VISA_address']))
+                self.reconnect()
+                return func(*args, **kwargs)
+        return call
+
+    def load_library(self):
+        """Load tsp_library as the jvlib script and run it to define its
+        functions. They stay on the instrument through reset() and reconnects
+        until it is power cycled, so loading is skipped when the version matches.
+        Returns True if the library was loaded
+        """
+        if self.keithley.query("print(jvlib_version)").strip() == self.library_version:
+            return False
+        self.keithley.write("loadscript jvlib")
+        self.keithley.write("jvlib_version = '{}'".format(self.library_version))
+        for line in self.tsp_library:
+            self.keithley.write(line)
+        self.keithley.write("endscript")
+        self.keithley.write("jvlib.run()")
+        return True
+
+    def parse_setting(self, name, text):
+        #jv_print text of a setting as its logged quantity value
+        if name not in self.numeric_settings:
+            return text
+        if text == 'nil':
+            return self.numeric_settings[name]
+        return float(text)
+
+    def read_setting(self, name):
+        return self.parse_setting(name, self.query_settings(name)[0])
+
+    def invalidate_cache(self):
+        #use after a reset, reconnect or front panel changes
+        self.cache = {}
+
+    def read_from_hardware(self):
+        """Read every logged quantity (of the selected channel on a 2600)
+        back in one round trip, a single tab separated record from jv_print"""
+        self.invalidate_cache()
+        values = self.query_settings(*(name for lq_name, name in self.hardware_settings))
+        LQ = self.settings.as_dict()
+        for (lq_name, name), text in zip(self.hardware_settings, values):
+            LQ[lq_name].update_value(self.parse_setting(name, text), update_hardware=False)
+
+    def query_buffer(self, cmd):
+        """Run a printbuffer command and return the values as a flat array.
+        In the binary formats the readings come back as little endian floats
+        and are decoded straight into numpy, print() is switched back to
+        ASCII in the same command so other queries are unaffected
+        """
+        if self.buffer_format == 'ASCII':
+            return np.array(self.keithley.query(cmd).split(','), dtype=float)
+
+        datatype = 'f' if self.buffer_format == 'REAL32' else 'd'
+        return self.keithley.query_binary_values(
+            "format.byteorder = format.LITTLEENDIAN format.data = format.{0} {1} format.data = format.ASCII".format(self.buffer_format, cmd),
+            datatype=datatype, is_big_endian=False, container=np.array)
+
+    def read_mpp(self):
+        """Blocks for the next report of the MPP loop. Returns the instrument
+        time, mean V, I and P and the number of loop iterations since the last report
+        """
+        t, v, i, p, n = self.keithley.read().split()
+        return float(t), float(v), float(i), float(p), int(float(n))
+
+    def reset(self):
+        self.keithley.write("reset()")
+        self.read_from_hardware()
+
+    def beep(self, duration=2, freq=2400):
+        self.keithley.write('beeper.beep({0:f}, {1:f})'.format(duration,freq))
+
+    def disconnect(self):
+        self.invalidate_cache()
+        try:
+            self.keithley.close()
+            del self.keithley
+        except AttributeError as e:
+            pass
+        #the manager is shared, it closes when the last component lets go
+        if hasattr(self, 'rm'):
+            del self.rm
+            resource_pool.release()
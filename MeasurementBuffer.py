@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class MeasurementBuffer(object):
+    """
+    Preallocated column store for measurement data (time, source value and
+    measured value).
+
+    Appends are O(1) amortized: the arrays are allocated up front and doubled
+    when full. view() returns zero-copy numpy views of the valid data, for
+    plotting and saving.
+
+    With a window, the buffer is a fixed size ring that keeps only the newest
+    window points, for indefinite tracking. Every point is written twice, at
+    i and i+window, so the newest window points are always contiguous and
+    view() stays zero-copy.
+    """
+
+    columns = (('time', np.float64), ('source', np.float64), ('value', np.float64))
+
+    def __init__(self, capacity=1024, window=None):
+        self.window = window
+        if window:
+            capacity = 2*window
+        self._arrays = dict((name, np.zeros(capacity, dtype=dtype)) for name, dtype in self.columns)
+        self._capacity = capacity
+        self.total = 0 #points appended since creation, including ones dropped from the ring
+
+    def __len__(self):
+        if self.window:
+            return min(self.total, self.window)
+        return self.total
+
+    def _grow(self, n):
+        capacity = self._capacity
+        while capacity < n:
+            capacity *= 2
+        for name, arr in self._arrays.items():
+            new = np.zeros(capacity, dtype=arr.dtype)
+            new[:self.total] = arr[:self.total]
+            self._arrays[name] = new
+        self._capacity = capacity
+
+    def append(self, time, source, value):
+        self.extend([time], [source], [value])
+
+    def extend(self, time, source, value):
+        values = {'time': time, 'source': source, 'value': value}
+        n = np.size(value)
+
+        if not self.window:
+            if self.total + n > self._capacity:
+                self._grow(self.total + n)
+            for name, arr in self._arrays.items():
+                arr[self.total:self.total+n] = values[name]
+            self.total += n
+            return
+
+        #only the newest window points of a long extend can survive
+        w = self.window
+        skip = max(0, n - w)
+        for name, arr in self._arrays.items():
+            col = np.broadcast_to(values[name], (n,))[skip:]
+            idx = (self.total + skip + np.arange(n - skip)) % w
+            arr[idx] = col
+            arr[idx + w] = col
+        self.total += n
+
+    def view(self, name):
+        arr = self._arrays[name]
+        n = len(self)
+        if self.window and self.total > self.window:
+            start = self.total % self.window
+            return arr[start:start+n]
+        return arr[:n]
+
+    def clear(self):
+        self.total = 0
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+class PeakDecimator(object):
+    """
+    Fixed size min/max decimation of a growing series, for plotting long
+    tracking runs.
+
+    Points go into buckets of bucket_size consecutive points, each kept as
+    its first x and its min and max y, so spikes stay visible. extend()
+    only touches the new points. When there are more than max_buckets full
+    buckets, neighbouring pairs are merged and bucket_size doubles, so
+    data() never returns more than 2*(max_buckets + 1) points however long
+    the run. trim() drops the buckets before a given point, for windowed
+    stores.
+    """
+
+    def __init__(self, max_buckets=2000):
+        self.max_buckets = max_buckets
+        self.clear()
+
+    def clear(self, first=0):
+        """Start over, the next point added has index first"""
+        self.bucket_size = 1
+        self.start = first #index of the first point in the first bucket
+        self.total = first #index of the next point
+        self.x = np.zeros(0)
+        self.ymin = np.zeros(0)
+        self.ymax = np.zeros(0)
+        self.partial = None #(points, x, ymin, ymax) of the bucket being filled
+
+    def extend(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.total += y.size
+        buckets = [(self.x, self.ymin, self.ymax)]
+
+        if self.partial is not None:
+            count, px, pmin, pmax = self.partial
+            take = min(self.bucket_size - count, y.size)
+            if take:
+                pmin, pmax = min(pmin, y[:take].min()), max(pmax, y[:take].max())
+            x, y = x[take:], y[take:]
+            if count + take < self.bucket_size:
+                self.partial = (count + take, px, pmin, pmax)
+                return
+            buckets.append(([px], [pmin], [pmax]))
+            self.partial = None
+
+        full = y.size//self.bucket_size*self.bucket_size
+        if full:
+            blocks = y[:full].reshape(-1, self.bucket_size)
+            buckets.append((x[:full:self.bucket_size], blocks.min(axis=1), blocks.max(axis=1)))
+        if full < y.size:
+            self.partial = (y.size - full, x[full], y[full:].min(), y[full:].max())
+
+        self.x, self.ymin, self.ymax = [np.concatenate(column) for column in zip(*buckets)]
+        while self.x.size > self.max_buckets:
+            self._merge()
+
+    def _merge(self):
+        #pairs of buckets become one, an odd last bucket joins the one being filled
+        n = self.x.size//2*2
+        if n < self.x.size:
+            count, x, ymin, ymax = self.bucket_size, self.x[-1], self.ymin[-1], self.ymax[-1]
+            if self.partial is not None:
+                pcount, px, pmin, pmax = self.partial
+                count, ymin, ymax = count + pcount, min(ymin, pmin), max(ymax, pmax)
+            self.partial = (count, x, ymin, ymax)
+        self.x = self.x[:n:2]
+        self.ymin = np.minimum(self.ymin[:n:2], self.ymin[1:n:2])
+        self.ymax = np.maximum(self.ymax[:n:2], self.ymax[1:n:2])
+        self.bucket_size *= 2
+
+    def trim(self, first):
+        """Drop the buckets that only hold points before index first"""
+        drop = min(max(first - self.start, 0)//self.bucket_size, self.x.size)
+        if drop:
+            self.x, self.ymin, self.ymax = self.x[drop:], self.ymin[drop:], self.ymax[drop:]
+            self.start += drop*self.bucket_size
+
+    def data(self):
+        """x and y to plot, each bucket as its min and max at its first x"""
+        x, ymin, ymax = self.x, self.ymin, self.ymax
+        if self.partial is not None:
+            count, px, pmin, pmax = self.partial
+            x, ymin, ymax = np.append(x, px), np.append(ymin, pmin), np.append(ymax, pmax)
+        return np.repeat(x, 2), np.column_stack((ymin, ymax)).ravel()
@@ -0,0 +1,76 @@
+from ScopeFoundry import Measurement
+from CommandProfiler import export_profiles
+import time
+import os
+
+
+class ProfileMeasure(Measurement):
+    """Live table of the command latencies recorded by the SMUs and the run
+    phases recorded by the measurements, see CommandProfiler. Start it to
+    refresh the table while other measurements run.
+    """
+
+    name = "Command Profile"
+
+    columns = ('source', 'kind', 'label', 'calls', 'total', 'mean', 'p50', 'p95', 'max')
+
+    def setup(self):
+        self.settings.New('refresh_period', dtype=float, initial=1.0, vmin=0.1, unit='s', si=True)
+        self.settings.New('max_rows', dtype=int, initial=50, vmin=1)
+        self.display_update_period = 1.0 #seconds
+
+        self.add_operation('Refresh', self.update_display)
+        self.add_operation('Clear All', self.clear_profiles)
+        self.add_operation('Export CSV', self.export)
+
+    def setup_figure(self):
+        from qtpy import QtWidgets
+        self.ui = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(self.ui)
+        layout.addWidget(self.settings.New_UI())
+        self.table = QtWidgets.QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels([c if c in ('source', 'kind', 'label', 'calls') else c + ' (ms)' for c in self.columns])
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+    def profilers(self):
+        #every hardware component and measurement that keeps a profile, by name
+        components = list(self.app.hardware.items()) + list(self.app.measurements.items())
+        return dict((name, c.profiler) for name, c in components if hasattr(c, 'profiler'))
+
+    def clear_profiles(self):
+        for profiler in self.profilers().values():
+            profiler.clear()
+        self.update_display()
+
+    def export(self):
+        fname = os.path.join(self.app.settings['save_dir'], 'profile_{}.csv'.format(time.strftime('%Y%m%d_%H%M%S')))
+        export_profiles(fname, self.profilers())
+        self.log.info('profile written to ' + fname)
+
+    def run(self):
+        #nothing to acquire, the table refreshes on the display timer until interrupted
+        self.display_update_period = self.settings['refresh_period']
+        while not self.interrupt_measurement_called:
+            time.sleep(0.1)
+
+    def update_display(self):
+        from qtpy import QtWidgets
+        rows = []
+        for source, profiler in self.profilers().items():
+            rows += [dict(row, source=source) for row in profiler.rows()]
+        rows.sort(key=lambda row: -row['total'])
+        rows = rows[:self.settings['max_rows']]
+
+        self.table.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, column in enumerate(self.columns):
+                value = row[column]
+                if column == 'total':
+                    text = '{:.1f}'.format(1e3*value)
+                elif isinstance(value, float):
+                    text = '{:.3g}'.format(1e3*value)
+                else:
+                    text = str(value)
+                self.table.setItem(r, c, QtWidgets.QTableWidgetItem(text))
+        self.table.resizeColumnsToContents()
@@ -0,0 +1,139 @@
+import threading
+import time
+import re
+
+
+class ResourcePool(object):
+    """
+    One pyvisa ResourceManager for the whole process, shared by the hardware
+    components. acquire() and release() count its users and the manager is
+    only closed when the last one lets go, so disconnecting one SMU no longer
+    closes the sessions of the others on the same backend.
+
+    The resource list and the *IDN? reply of each address are cached while
+    the manager is open, so finding the SMUs scans the bus once.
+    """
+
+    def __init__(self, backend='', factory=None):
+        self.backend = backend #e.g. '@py' for pyvisa-py, '' for the default VISA library
+        self.factory = factory #makes the manager instead of pyvisa, e.g. a SimulatedResourceManager
+        self.lock = threading.RLock()
+        self.manager = None
+        self.users = 0
+        self.resources = {} #query: resource names
+        self.identities = {} #address: *IDN? reply, '' if it did not answer
+
+    def acquire(self):
+        with self.lock:
+            if self.manager is None and self.factory is not None:
+                self.manager = self.factory()
+            elif self.manager is None:
+                #pyvisa is slow to import and only needed once something connects
+                import pyvisa
+                self.manager = pyvisa.ResourceManager(self.backend) if self.backend else pyvisa.ResourceManager()
+            self.users += 1
+            return self.manager
+
+    def release(self):
+        with self.lock:
+            self.users = max(self.users - 1, 0)
+            if self.users == 0 and self.manager is not None:
+                self.manager.close()
+                self.manager = None
+                self.resources = {}
+                self.identities = {}
+
+    def open(self, address, timeout=None, chunk_size=None):
+        """Session to address, with the timeout (ms) and read chunk size (bytes) if given"""
+        resource = self.manager.open_resource(address)
+        if timeout:
+            resource.timeout = timeout
+        if chunk_size:
+            resource.chunk_size = chunk_size
+        return resource
+
+    def list_resources(self, query='?*::INSTR', refresh=False):
+        with self.lock:
+            if refresh or query not in self.resources:
+                self.resources[query] = tuple(self.manager.list_resources(query))
+            return self.resources[query]
+
+    def identify(self, address, refresh=False, timeout=1000):
+        """*IDN? reply of the instrument at address, '' if it does not answer"""
+        with self.lock:
+            if refresh or address not in self.identities:
+                try:
+                    resource = self.open(address, timeout)
+                    try:
+                        self.identities[address] = resource.query('*IDN?').strip()
+                    finally:
+                        resource.close()
+                except Exception:
+                    #not every resource on the bus is an instrument that answers
+                    self.identities[address] = ''
+            return self.identities[address]
+
+    def find(self, pattern, exclude=(), refresh=False):
+        """Addresses whose *IDN? reply matches the regular expression pattern,
+        ignoring case, in the order the manager lists them
+        """
+        return [address for address in self.list_resources(refresh=refresh)
+                if address not in exclude and re.search(pattern, self.identify(address, refresh), re.I)]
+
+
+class LockedResource(object):
+    """
+    pyvisa resource wrapper that holds a bus lock for every command.
+    Instruments sharing a GPIB board take turns per command rather than per
+    measurement, so one instrument can be read out while another runs a
+    sweep from its own trigger model. Attribute reads and writes, such as
+    timeout, go straight to the resource
+    """
+
+    def __init__(self, resource, lock, wait_time=0):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'lock', lock)
+        object.__setattr__(self, 'wait_time', wait_time) #seconds spent waiting for the bus
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resource, name, value)
+
+    def _locked(self, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        with self.lock:
+            object.__setattr__(self, 'wait_time', self.wait_time + time.perf_counter() - t0)
+            return func(*args, **kwargs)
+
+    def write(self, *args, **kwargs):
+        return self._locked(self.resource.write, *args, **kwargs)
+
+    def write_raw(self, *args, **kwargs):
+        return self._locked(self.resource.write_raw, *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._locked(self.resource.query, *args, **kwargs)
+
+    def query_ascii_values(self, *args, **kwargs):
+        return self._locked(self.resource.query_ascii_values, *args, **kwargs)
+
+    def query_binary_values(self, *args, **kwargs):
+        return self._locked(self.resource.query_binary_values, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._locked(self.resource.read, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        return self._locked(self.resource.read_raw, *args, **kwargs)
+
+    def clear(self):
+        return self._locked(self.resource.clear)
+
+    def close(self):
+        return self._locked(self.resource.close)
+
+
+#shared by every hardware component in the process
+resource_pool = ResourcePool()
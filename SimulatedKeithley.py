@@ -0,0 +1,849 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulated Keithley 2450 / 2600 SMU.
+
+SimulatedKeithley stands in for the pyvisa resource the hardware components
+talk to. It understands the subset of TSP that Keithley2450HW and
+Keithley2600HW send, models the I-V response of an illuminated solar cell
+(single diode with series and shunt resistance) and sleeps for a
+configurable latency on every command, so acquisition speed can be measured
+without an instrument:
+
+    hw.keithley = SimulatedKeithley('2450', latency=2e-3)
+    hw.load_library()
+"""
+
+import numpy as np
+import pyvisa.util
+import re
+import time
+
+
+class _Buffer(object):
+    """Reading buffer that fills itself as the simulated clock passes the
+    scheduled measurement times
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.readings = np.zeros(0)
+        self.sourcevalues = np.zeros(0)
+        self.t = np.zeros(0)
+        self.pending = None
+        self.kind = None
+        self.averages = 1
+
+    def schedule(self, times, levels, source_voltage, kind, averages=1):
+        self.pending = (np.asarray(times, dtype=float), np.asarray(levels, dtype=float), source_voltage)
+        self.kind = kind
+        self.averages = averages
+
+    def update(self, now, sim):
+        if self.pending is None:
+            return
+        times, levels, source_voltage = self.pending
+        k = np.searchsorted(times, now, side='right')
+        if k > 0:
+            self.readings = np.concatenate((self.readings, sim.measure(levels[:k], source_voltage, self.averages)))
+            self.sourcevalues = np.concatenate((self.sourcevalues, levels[:k]))
+            self.t = np.concatenate((self.t, times[:k]))
+            times, levels = times[k:], levels[k:]
+            self.pending = (times, levels, source_voltage) if times.size else None
+
+    def running(self, kind=None):
+        return self.pending is not None and (kind is None or self.kind == kind)
+
+    def column(self, name, sim):
+        if name == 'readings':
+            return self.readings
+        elif name == 'sourcevalues':
+            return self.sourcevalues
+        elif name in ('timestamps', 'relativetimestamps'):
+            #both count from the first reading, on a 2600 that is the buffer's basetimestamp
+            return self.t - self.t[0] if self.t.size else self.t
+        elif name == 'seconds':
+            return np.floor(self.t)
+        elif name == 'fractionalseconds':
+            return self.t - np.floor(self.t)
+        raise KeyError(name)
+
+
+class SimulatedKeithley(object):
+    """pyvisa resource stand-in for a Keithley 2450 or 2600 series SMU
+
+    :param model: '2450' or '2600', only changes the *IDN? response
+    :param latency: seconds added to every write and query, like a GPIB round trip
+    :param line_freq: power line frequency used to turn NPLC into integration time
+    """
+
+    channels = ('smua', 'smub')
+
+    #single diode solar cell, roughly 0.9 V Voc and 20 mA Isc
+    Iph = 20e-3
+    I0 = 1e-12
+    n_ideality = 1.5
+    Vt = 0.02585
+    Rs = 2.0
+    Rsh = 1e4
+    noise = 1e-7
+
+    #source settling and script time per iteration of an on-instrument control loop
+    loop_overhead = 2e-4
+
+    #2450 settings stored per function, each function brings back its own values when selected
+    function_settings = {
+        'smu.source.func': ('smu.source.level', 'smu.source.delay', 'smu.source.autodelay'),
+        'smu.measure.func': ('smu.measure.nplc', 'smu.measure.autorange', 'smu.measure.sense',
+                             'smu.measure.filter.enable', 'smu.measure.filter.count', 'smu.measure.filter.type'),
+    }
+
+    def __init__(self, model='2450', latency=0.0, line_freq=60, seed=None):
+        self.model = model
+        self.latency = latency
+        self.line_freq = line_freq
+        self.timeout = 2000
+        self.chunk_size = 20*1024
+        self.rng = np.random.default_rng(seed)
+        self.n_writes = 0
+        self.n_queries = 0
+        #the runtime environment outlives reset(), as on the instrument
+        self.vars = {}
+        self.scripts = set() #names of functions defined by the host
+        self.function_lines = {} #lines of each function defined by a script, up to the next one
+        self.loaded_scripts = {}
+        self.loading = None
+        self.reset()
+
+    # pyvisa resource interface
+
+    def write(self, cmd):
+        self.n_writes += 1
+        self._wait()
+        self._execute(cmd)
+
+    def read(self):
+        if not self._output and self.mpp is not None:
+            self._mpp_report()
+        out, self._output = self._output, b''
+        return out.decode('latin-1')
+
+    def read_raw(self):
+        out, self._output = self._output, b''
+        return out
+
+    def query(self, cmd):
+        self.n_queries += 1
+        self._wait()
+        self._execute(cmd)
+        return self.read()
+
+    def query_binary_values(self, cmd, datatype='f', is_big_endian=False, container=list, **kwargs):
+        self.n_queries += 1
+        self._wait()
+        self._execute(cmd)
+        return pyvisa.util.from_ieee_block(self.read_raw(), datatype, is_big_endian, container)
+
+    def clear(self):
+        #device clear also stops a running script
+        self._output = b''
+        self.mpp = None
+
+    def close(self):
+        pass
+
+    # instrument model
+
+    def reset(self):
+        self.state = {
+            'smu.source.func': 'smu.FUNC_DC_VOLTAGE',
+            'smu.measure.func': 'smu.FUNC_DC_CURRENT',
+            'smu.source.level': 0.0,
+            'smu.source.ilimit.level': 0.105,
+            'smu.source.vlimit.level': 21.0,
+            'smu.source.output': 'smu.OFF',
+            'smu.source.delay': 0.0,
+            'smu.source.autodelay': 'smu.ON',
+            'smu.measure.nplc': 1.0,
+            'smu.measure.autorange': 'smu.ON',
+            'smu.measure.sense': 'smu.SENSE_2WIRE',
+            'smu.measure.terminals': 'smu.TERMINALS_FRONT',
+            'smu.measure.filter.enable': 'smu.OFF',
+            'smu.measure.filter.count': 10.0,
+            'smu.measure.filter.type': 'smu.FILTER_REPEAT_AVG',
+            'format.data': 'format.ASCII',
+            'trigger.timer[1].delay': 1e-3,
+        }
+        #(function setting, function): the settings stored for a function while another is selected
+        self.function_state = {}
+        for target, names in self.function_settings.items():
+            for func in ('smu.FUNC_DC_VOLTAGE', 'smu.FUNC_DC_CURRENT'):
+                self.function_state[(target, func)] = dict((name, self.state[name]) for name in names)
+        self.buffers = {'defbuffer1': _Buffer(), 'defbuffer2': _Buffer()}
+        self.sweep_list = {}
+        self.sweep_buffer = {}
+        for ch in self.channels:
+            self.state.update({
+                ch + '.source.func': ch + '.OUTPUT_DCVOLTS',
+                ch + '.source.levelv': 0.0,
+                ch + '.source.leveli': 0.0,
+                ch + '.source.limiti': 0.1,
+                ch + '.source.limitv': 20.0,
+                ch + '.source.output': ch + '.OUTPUT_OFF',
+                ch + '.source.delay': 0.0,
+                ch + '.measure.nplc': 1.0,
+                ch + '.measure.count': 1.0,
+                ch + '.measure.interval': 0.0,
+                ch + '.measure.filter.enable': ch + '.FILTER_OFF',
+                ch + '.measure.filter.count': 1.0,
+                ch + '.measure.filter.type': ch + '.FILTER_REPEAT_AVG',
+                ch + '.measure.autorangei': ch + '.AUTORANGE_ON',
+                ch + '.measure.autorangev': ch + '.AUTORANGE_ON',
+                ch + '.sense': ch + '.SENSE_LOCAL',
+                ch + '.trigger.count': 1.0,
+            })
+            self.buffers[ch + '.nvbuffer1'] = _Buffer()
+            self.buffers[ch + '.nvbuffer2'] = _Buffer()
+            self.sweep_list[ch] = []
+            self.sweep_buffer[ch] = ch + '.nvbuffer1'
+        self.mpp = None
+        self.configlists = {}
+        self.trigger_plan = None
+        self.trigger_state = 'trigger.STATE_IDLE'
+        self.timer0 = time.time()
+        self.busy_until = 0
+        self._output = b''
+
+    def iv_current(self, v):
+        """Current for applied voltages v, solving the junction voltage by bisection"""
+        v = np.asarray(v, dtype=float)
+        lo = np.minimum(v, 0) - 10
+        hi = np.maximum(v, 0) + self.Rs*self.Iph + 1
+        for _ in range(60):
+            vj = (lo + hi)/2
+            g = vj + self.Rs*self._junction_current(vj) - v
+            lo = np.where(g < 0, vj, lo)
+            hi = np.where(g < 0, hi, vj)
+        vj = (lo + hi)/2
+        return self._junction_current(vj)
+
+    def iv_voltage(self, i):
+        """Voltage for sourced currents i"""
+        i = np.asarray(i, dtype=float)
+        lo = -(np.abs(i) + self.Iph)*self.Rsh - 1
+        hi = self.n_ideality*self.Vt*np.log((np.abs(i) + self.Iph)/self.I0 + 1) + 1
+        for _ in range(60):
+            vj = (lo + hi)/2
+            g = self._junction_current(vj) - i
+            lo = np.where(g < 0, vj, lo)
+            hi = np.where(g < 0, hi, vj)
+        vj = (lo + hi)/2
+        return vj + i*self.Rs
+
+    def _junction_current(self, vj):
+        return self.I0*(np.exp(np.minimum(vj/(self.n_ideality*self.Vt), 700)) - 1) + vj/self.Rsh - self.Iph
+
+    def measure(self, levels, source_voltage, averages=1):
+        #the repeat filter averages independent readings, noise drops as 1/sqrt(averages)
+        levels = np.asarray(levels, dtype=float)
+        noise = self.noise/np.sqrt(averages)
+        if source_voltage:
+            return self.iv_current(levels) + self.rng.normal(0, noise, levels.shape)
+        return self.iv_voltage(levels) + self.rng.normal(0, noise*self.Rsh*1e-2, levels.shape)
+
+    def filter_count(self, prefix):
+        """Readings averaged per measurement, 1 when the filter is off"""
+        on = 'smu.ON' if prefix == 'smu' else prefix + '.FILTER_ON'
+        if self.state[prefix + '.measure.filter.enable'] != on:
+            return 1
+        return max(int(float(self.state[prefix + '.measure.filter.count'])), 1)
+
+    def integration_time(self, prefix):
+        return self.filter_count(prefix)*float(self.state[prefix + '.measure.nplc'])/self.line_freq
+
+    def _source_voltage(self, prefix):
+        if prefix == 'smu':
+            return self.state['smu.source.func'] == 'smu.FUNC_DC_VOLTAGE'
+        return self.state[prefix + '.source.func'] == prefix + '.OUTPUT_DCVOLTS'
+
+    def _level(self, prefix):
+        if prefix == 'smu':
+            return float(self.state['smu.source.level'])
+        if self._source_voltage(prefix):
+            return float(self.state[prefix + '.source.levelv'])
+        return float(self.state[prefix + '.source.leveli'])
+
+    def _read_point(self, prefix):
+        time.sleep(self.integration_time(prefix))
+        return float(self.measure(self._level(prefix), self._source_voltage(prefix), self.filter_count(prefix)))
+
+    def _wait(self):
+        time.sleep(self.latency)
+        dt = self.busy_until - time.time()
+        if dt > 0:
+            time.sleep(dt)
+
+    def _update_buffers(self):
+        now = time.time()
+        for buf in self.buffers.values():
+            buf.update(now, self)
+
+    # TSP interpreter
+
+    _path = re.compile(r"[A-Za-z_][\w\.]*(\[\d+\])?[\w\.]*")
+    _number = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+    _for = re.compile(r"for\s+_,\s*(\w+)\s+in\s+ipairs\((\{[^}]*\})\)\s+do\s+(.*?)\s+end\b", re.S)
+
+    def _execute(self, code):
+        code = code.strip()
+        if code == '*IDN?':
+            self._emit('KEITHLEY INSTRUMENTS,MODEL {},04089762,1.7.3b\n'.format(self.model))
+            return
+        if self.loading is not None:
+            if code == 'endscript':
+                name, lines = self.loading
+                self.loaded_scripts[name] = lines
+                self.loading = None
+            else:
+                self.loading[1].append(code)
+            return
+        m = re.match(r'loadscript\s+(\w+)$', code)
+        if m:
+            self.loading = (m.group(1), [])
+            return
+        m = re.match(r'function\s+(\w+)', code)
+        if m:
+            #bodies are not interpreted, defined functions are modelled in _script_functions
+            self.scripts.add(m.group(1))
+            return
+        pos = 0
+        while True:
+            pos = self._skip(code, pos)
+            if pos >= len(code):
+                break
+            m = self._for.match(code, pos)
+            if m:
+                for v in self._eval(m.group(2)):
+                    self.vars[m.group(1)] = v
+                    self._execute(m.group(3))
+                pos = m.end()
+                continue
+            pos = self._statement(code, pos)
+
+    def _skip(self, code, pos):
+        while pos < len(code) and code[pos] in ' \t\r\n;':
+            pos += 1
+        return pos
+
+    def _statement(self, code, pos):
+        targets = []
+        while True:
+            m = self._path.match(code, pos)
+            if m is None:
+                raise ValueError('Simulated SMU cannot parse: ' + code[pos:])
+            end = self._skip(code, m.end())
+            if end < len(code) and code[end] == '(':
+                close = self._matching(code, end, '(', ')')
+                self._call(m.group(0), code[end+1:close])
+                return close + 1
+            targets.append(m.group(0))
+            if end < len(code) and code[end] == ',':
+                pos = self._skip(code, end+1)
+                continue
+            if code.startswith('=', end):
+                rhs_start = self._skip(code, end+1)
+                rhs_end = self._expression_end(code, rhs_start)
+                values = self._eval_multi(code[rhs_start:rhs_end])
+                for target, value in zip(targets, values):
+                    self._assign(target, value)
+                return rhs_end
+            raise ValueError('Simulated SMU cannot parse: ' + code[pos:])
+
+    def _matching(self, code, start, open_char, close_char):
+        depth = 0
+        for i in range(start, len(code)):
+            if code[i] == open_char:
+                depth += 1
+            elif code[i] == close_char:
+                depth -= 1
+                if depth == 0:
+                    return i
+        raise ValueError('Simulated SMU: unbalanced ' + open_char)
+
+    def _expression_end(self, code, pos):
+        if code[pos] in '\'"':
+            return code.index(code[pos], pos+1) + 1
+        if code[pos] == '{':
+            return self._matching(code, pos, '{', '}') + 1
+        m = self._number.match(code, pos)
+        if m:
+            return m.end()
+        m = self._path.match(code, pos)
+        end = self._skip(code, m.end())
+        if end < len(code) and code[end] == '(':
+            return self._matching(code, end, '(', ')') + 1
+        return m.end()
+
+    def _split_args(self, text):
+        args, depth, start = [], 0, 0
+        for i, c in enumerate(text):
+            if c in '({':
+                depth += 1
+            elif c in ')}':
+                depth -= 1
+            elif c == ',' and depth == 0:
+                args.append(text[start:i])
+                start = i + 1
+        if text.strip():
+            args.append(text[start:])
+        return [a.strip() for a in args]
+
+    def _eval_multi(self, text):
+        text = text.strip()
+        m = self._path.match(text)
+        if m and text.endswith(')') and not self._number.fullmatch(text):
+            open_paren = text.index('(', m.end())
+            return self._call(m.group(0), text[open_paren+1:-1])
+        return [self._eval(text)]
+
+    def _eval(self, text):
+        text = text.strip()
+        if text[0] in '\'"':
+            return text[1:-1]
+        if text[0] == '{':
+            return [self._eval(a) for a in self._split_args(text[1:-1])]
+        if self._number.fullmatch(text):
+            return float(text)
+        if text.endswith(')'):
+            values = self._eval_multi(text)
+            return values[0] if values else None
+        return self._lookup(text)
+
+    def _lookup(self, path):
+        if path in self.vars:
+            return self.vars[path]
+        if path in self.state:
+            return self.state[path]
+        if path == 'nil':
+            return None
+        if path in self.buffers or path in self.channels:
+            return path
+        for name, buf in self.buffers.items():
+            if path == name + '.n':
+                self._update_buffers()
+                return float(buf.readings.size)
+            if path == name + '.capacity':
+                return float(buf.capacity)
+            if path == name + '.basetimestamp':
+                self._update_buffers()
+                return float(buf.t[0] - self.timer0) if buf.t.size else 0.0
+        if path.startswith('status.operation.'):
+            register = path.split('.')[2]
+            if path.endswith('.SMUA'):
+                return 2.0
+            if path.endswith('.SMUB'):
+                return 4.0
+            if path.endswith('.condition'):
+                self._update_buffers()
+                kind = 'sweep' if register == 'sweeping' else 'overlapped'
+                return float(sum(2*(k+1) for k, ch in enumerate(self.channels)
+                                 if any(self.buffers[ch + b].running(kind) for b in ('.nvbuffer1', '.nvbuffer2'))))
+        #constants like smu.ON and buffer columns evaluate to their own name, unset fields are nil
+        if '.' in path:
+            parent, field = path.rsplit('.', 1)
+            if field.isupper() or parent in self.buffers:
+                return path
+        return None
+
+    def _assign(self, target, value):
+        for name, buf in self.buffers.items():
+            if target == name + '.capacity':
+                buf.capacity = int(value)
+                buf.clear()
+                return
+        if target in self.function_settings and value != self.state[target]:
+            names = self.function_settings[target]
+            self.function_state[(target, self.state[target])] = dict((name, self.state[name]) for name in names)
+            self.state.update(self.function_state.get((target, value), {}))
+        if '.' in target:
+            self.state[target] = value
+        else:
+            self.vars[target] = value
+
+    def _emit(self, out):
+        if isinstance(out, str):
+            out = out.encode('latin-1')
+        self._output += out
+
+    def _format(self, value):
+        if value is None:
+            return 'nil'
+        if isinstance(value, float):
+            if value.is_integer() and abs(value) < 1e15:
+                return '{:d}'.format(int(value))
+            return '{:.12g}'.format(value)
+        return str(value)
+
+    def _run_script(self, lines):
+        #only function definitions and global string assignments are taken from a script
+        function = None
+        for line in lines:
+            m = re.match(r'function\s+(\w+)', line)
+            if m:
+                function = m.group(1)
+                self.scripts.add(function)
+                self.function_lines[function] = []
+            elif re.match(r"\w+\s*=\s*'[^']*'$", line):
+                self._execute(line)
+            if function is not None:
+                self.function_lines[function].append(line)
+
+    def _call(self, name, argtext):
+        args = [self._eval(a) for a in self._split_args(argtext)]
+        script = name[:-4] if name.endswith('.run') else name
+        if script in self.loaded_scripts:
+            self._run_script(self.loaded_scripts[script])
+            return []
+        if name in self._script_functions:
+            if name not in self.scripts:
+                raise ValueError("Simulated SMU: attempt to call a nil value (global '{}')".format(name))
+            return self._script_functions[name](self, *args) or []
+        func = self._functions.get(name)
+        if func is None and name[:5] in ('smua.', 'smub.'):
+            #channel functions get the channel as their first argument
+            func = self._channel_functions.get(name[5:])
+            if func is not None:
+                return func(self, name[:4], *args) or []
+        if func is None:
+            for buf_name in self.buffers:
+                if name == buf_name + '.clear':
+                    self.buffers[buf_name].clear()
+                    return []
+            return []
+        return func(self, *args) or []
+
+    # TSP functions
+
+    def _print(self, *args):
+        self._emit('\t'.join(self._format(a) for a in args) + '\n')
+
+    def _printbuffer(self, start, end, *columns):
+        self._update_buffers()
+        start, end = int(start) - 1, int(end)
+        data = []
+        for col in columns:
+            buf_name, col_name = col.rsplit('.', 1)
+            data.append(self.buffers[buf_name].column(col_name, self)[start:end])
+        data = np.column_stack(data).ravel()
+        fmt = self.state['format.data']
+        if fmt == 'format.ASCII':
+            self._emit(', '.join('{:.6e}'.format(x) for x in data) + '\n')
+        else:
+            dtype = '<f4' if fmt == 'format.REAL32' else '<f8'
+            if self.state.get('format.byteorder') == 'format.BIGENDIAN':
+                dtype = dtype.replace('<', '>')
+            self._emit(b'#0' + data.astype(dtype).tobytes() + b'\n')
+
+    def _pcall(self, name, *args):
+        #errors are swallowed like lua's pcall
+        func = self._functions.get(name)
+        try:
+            if func is not None:
+                func(self, *args)
+        except (KeyError, IndexError, ValueError):
+            pass
+        return []
+
+    def _reset(self):
+        self.reset()
+
+    def _smu_read(self):
+        value = self._read_point('smu')
+        return [value]
+
+    def _smu_readwithtime(self):
+        value = self._read_point('smu')
+        t = time.time()
+        return [value, float(np.floor(t)), t - np.floor(t)]
+
+    def _configlist_create(self, name):
+        self.configlists[name] = []
+
+    def _configlist_delete(self, name):
+        del self.configlists[name]
+
+    def _configlist_store(self, name):
+        self.configlists[name].append(float(self.state['smu.source.level']))
+
+    def _sweeplist(self, name, index=1, delay=0, count=1, failabort=None, buffer_name='defbuffer1'):
+        levels = np.tile(self.configlists[name][int(index)-1:], int(count))
+        self.trigger_plan = ('list', levels, float(delay) + self.integration_time('smu'), buffer_name)
+
+    def _model_load(self, name, *args):
+        self.trigger_plan = ('blocks', {})
+
+    def _setblock(self, index, block, *args):
+        if self.trigger_plan is None or self.trigger_plan[0] != 'blocks':
+            self.trigger_plan = ('blocks', {})
+        self.trigger_plan[1][int(index)] = (block,) + args
+
+    def _model_initiate(self):
+        now = time.time()
+        if self.trigger_plan is None:
+            return
+        if self.trigger_plan[0] == 'list':
+            _, levels, dt, buffer_name = self.trigger_plan
+            times = now + dt*np.arange(1, levels.size+1)
+        else:
+            blocks = self.trigger_plan[1]
+            buffer_name = 'defbuffer1'
+            count = 1
+            for block in blocks.values():
+                if block[0] == 'trigger.BLOCK_MEASURE_DIGITIZE' and len(block) > 1:
+                    buffer_name = block[1]
+                if block[0] == 'trigger.BLOCK_BRANCH_COUNTER':
+                    count = int(block[1])
+            period = max(float(self.state['trigger.timer[1].delay']), self.integration_time('smu'))
+            times = now + period*np.arange(1, count+1)
+            levels = np.full(count, self._level('smu'))
+        self.buffers[buffer_name].schedule(times, levels, self._source_voltage('smu'), 'sweep', self.filter_count('smu'))
+        self.trigger_state = 'trigger.STATE_RUNNING'
+
+    def _model_abort(self):
+        for buf in self.buffers.values():
+            buf.pending = None
+        self.trigger_state = 'trigger.STATE_ABORTED'
+
+    def _model_state(self):
+        self._update_buffers()
+        if any(b.running() for b in self.buffers.values()):
+            state = 'trigger.STATE_RUNNING'
+        elif self.trigger_state == 'trigger.STATE_RUNNING':
+            state = self.trigger_state = 'trigger.STATE_IDLE'
+        else:
+            state = self.trigger_state
+        return [state, state, 1.0]
+
+    def _channel_measure(self, ch, *args):
+        return [self._read_point(ch)]
+
+    def _listv(self, ch, levels):
+        self.sweep_list[ch] = list(levels)
+
+    def _trigger_measure(self, ch, buffer_name):
+        self.sweep_buffer[ch] = buffer_name
+
+    def _channel_initiate(self, ch):
+        #trigger stimuli are not modelled, chained channels simply start together
+        sweep_list = self.sweep_list[ch]
+        levels = np.tile(sweep_list, int(float(self.state[ch + '.trigger.count'])//max(len(sweep_list), 1)) or 1)
+        dt = float(self.state[ch + '.source.delay']) + self.integration_time(ch)
+        times = time.time() + dt*np.arange(1, levels.size+1)
+        self.buffers[self.sweep_buffer[ch]].schedule(times, levels, True, 'sweep', self.filter_count(ch))
+
+    def _channel_abort(self, ch):
+        for name, buf in self.buffers.items():
+            if name.startswith(ch + '.'):
+                buf.pending = None
+
+    def _overlapped(self, ch, buffer_name):
+        count = int(float(self.state[ch + '.measure.count']))
+        period = max(float(self.state[ch + '.measure.interval']), self.integration_time(ch))
+        times = time.time() + period*np.arange(count)
+        levels = np.full(count, self._level(ch))
+        self.buffers[buffer_name].schedule(times, levels, self._source_voltage(ch), 'overlapped', self.filter_count(ch))
+
+    def _sweep_v_lin_measure_i(self, smu, start, stop, stime, points):
+        levels = np.linspace(float(start), float(stop), int(points))
+        dt = float(stime) + self.integration_time(smu)
+        times = time.time() + dt*np.arange(1, levels.size+1)
+        buf = self.buffers[smu + '.nvbuffer1']
+        buf.clear()
+        buf.schedule(times, levels, True, 'sweep', self.filter_count(smu))
+        #factory sweep scripts block the command interface until they finish
+        self.busy_until = times[-1]
+
+    def _waitcomplete(self, *args):
+        self._update_buffers()
+        for buf in self.buffers.values():
+            if buf.pending is not None:
+                time.sleep(max(0, buf.pending[0][-1] - time.time()))
+        self._update_buffers()
+
+    def _timer_t(self):
+        return [time.time() - self.timer0]
+
+    def _timer_reset(self):
+        self.timer0 = time.time()
+
+    def _bitand(self, a, b):
+        return [float(int(a) & int(b))]
+
+    def _table_insert(self, table, value):
+        table.append(value)
+
+    # scripts defined by the drivers
+
+    #settings printed by jv_print: the field and, for enumerations, the value read as
+    #the first of two names, or for counts the enable field and its on value. {p} is the channel, {s} and {m} the source and measure
+    #function letters
+    _library_settings = {
+        'source': ('{p}.source.func', '{p}.OUTPUT_DCAMPS', 'Current', 'Voltage'),
+        'measure': ('display.{p}.measure.func', 'display.MEASURE_DCVOLTS', 'Voltage', 'Current'),
+        'level': ('{p}.source.level{s}',),
+        'ilimit': ('{p}.source.limiti',),
+        'vlimit': ('{p}.source.limitv',),
+        'sense': ('{p}.sense', '{p}.SENSE_REMOTE', '4Wire', '2Wire'),
+        'autorange': ('{p}.measure.autorange{m}', '{p}.AUTORANGE_ON', 'On', 'Off'),
+        'nplc': ('{p}.measure.nplc',),
+        'output': ('{p}.source.output', '{p}.OUTPUT_ON', 'On', 'Off'),
+        'delay': ('{p}.source.delay',),
+        'filter': ('{p}.measure.filter.count', '{p}.measure.filter.enable', '{p}.FILTER_ON'),
+    }
+
+    _library_settings_2450 = {
+        'source': ('smu.source.func', 'smu.FUNC_DC_CURRENT', 'Current', 'Voltage'),
+        'measure': ('smu.measure.func', 'smu.FUNC_DC_VOLTAGE', 'Voltage', 'Current'),
+        'level': ('smu.source.level',),
+        'ilimit': ('smu.source.ilimit.level',),
+        'vlimit': ('smu.source.vlimit.level',),
+        'sense': ('smu.measure.sense', 'smu.SENSE_4WIRE', '4Wire', '2Wire'),
+        'terminals': ('smu.measure.terminals', 'smu.TERMINALS_FRONT', 'Front', 'Rear'),
+        'autorange': ('smu.measure.autorange', 'smu.ON', 'On', 'Off'),
+        'nplc': ('smu.measure.nplc',),
+        'output': ('smu.source.output', 'smu.ON', 'On', 'Off'),
+        'delay': ('smu.source.delay',),
+        'autodelay': ('smu.source.autodelay', 'smu.ON', 'On', 'Off'),
+        'filter': ('smu.measure.filter.count', 'smu.measure.filter.enable', 'smu.ON'),
+    }
+
+    def _jv_print(self, *names):
+        if names and names[0] in self.channels:
+            prefix, names = names[0], names[1:]
+            table = self._library_settings
+            current_source = self.state[prefix + '.source.func'] == prefix + '.OUTPUT_DCAMPS'
+        else:
+            prefix = 'smu'
+            table = self._library_settings_2450
+            current_source = False
+        fields = {'p': prefix, 's': 'i' if current_source else 'v', 'm': 'v' if current_source else 'i'}
+        values = []
+        for name in names:
+            entry = [text.format(**fields) for text in table[name]]
+            value = self._lookup(entry[0])
+            if len(entry) == 3:
+                #a count that only applies while its enable field is on, 1 otherwise
+                value = value if self._lookup(entry[1]) == entry[2] else 1.0
+            elif len(entry) > 1:
+                value = entry[2] if value == entry[1] else entry[3]
+            values.append(value)
+        self._print(*values)
+
+    def _jv_mpp(self, *args):
+        #the loop is run by _mpp_report as the host reads each report
+        prefix = 'smu'
+        if len(args) == 7:
+            prefix, args = args[0], args[1:]
+        v, dv, vmin, vmax, period, nreports = (float(a) for a in args)
+        #the loop is modelled here, a reset of the global timer in the loaded one still happens
+        if any(re.search(r'timer\.(reset|cleartime)\(\)', line) for line in self.function_lines.get('jv_mpp', ())):
+            self._timer_reset()
+        grid = np.linspace(vmin - abs(dv), vmax + abs(dv), 2001)
+        iv = self.iv_current(grid)
+        self.mpp = {'prefix': prefix, 'v': v, 'dv': dv, 'vmin': vmin, 'vmax': vmax, 'period': period,
+                    'nreports': int(nreports), 'reports': 0, 't0': time.time(), 'grid': grid, 'iv': iv,
+                    'p': -v*float(np.interp(v, grid, iv))}
+
+    def _mpp_report(self):
+        mpp = self.mpp
+        t_report = mpp['t0'] + (mpp['reports'] + 1)*mpp['period']
+        time.sleep(max(0, t_report - time.time()))
+
+        n = max(1, int(mpp['period']/(self.integration_time(mpp['prefix']) + self.loop_overhead)))
+        v, dv, p = mpp['v'], mpp['dv'], mpp['p']
+        noise = self.rng.normal(0, self.noise/np.sqrt(self.filter_count(mpp['prefix'])), n)
+        vs = np.empty(n)
+        currents = np.empty(n)
+        for k in range(n):
+            if not mpp['vmin'] <= v + dv <= mpp['vmax']:
+                dv = -dv
+            v += dv
+            i = float(np.interp(v, mpp['grid'], mpp['iv'])) + noise[k]
+            if -v*i < p:
+                dv = -dv
+            p = -v*i
+            vs[k] = v
+            currents[k] = i
+        mpp.update(v=v, dv=dv, p=p, reports=mpp['reports'] + 1)
+        self.state['smu.source.level' if mpp['prefix'] == 'smu' else mpp['prefix'] + '.source.levelv'] = v
+
+        self._print(t_report - mpp['t0'], float(vs.mean()), float(currents.mean()), float(np.mean(-vs*currents)), float(n))
+        if mpp['nreports'] > 0 and mpp['reports'] >= mpp['nreports']:
+            self.mpp = None
+
+    _functions = {
+        'print': _print,
+        'printbuffer': _printbuffer,
+        'pcall': _pcall,
+        'reset': _reset,
+        'smu.measure.read': _smu_read,
+        'smu.measure.readwithtime': _smu_readwithtime,
+        'smu.source.configlist.create': _configlist_create,
+        'smu.source.configlist.delete': _configlist_delete,
+        'smu.source.configlist.store': _configlist_store,
+        'smu.source.sweeplist': _sweeplist,
+        'trigger.model.load': _model_load,
+        'trigger.model.setblock': _setblock,
+        'trigger.model.initiate': _model_initiate,
+        'trigger.model.abort': _model_abort,
+        'trigger.model.state': _model_state,
+        'SweepVLinMeasureI': _sweep_v_lin_measure_i,
+        'waitcomplete': _waitcomplete,
+        'timer.measure.t': _timer_t,
+        'timer.reset': _timer_reset,
+        'timer.gettime': _timer_t,
+        'timer.cleartime': _timer_reset,
+        'bit.bitand': _bitand,
+        'table.insert': _table_insert,
+    }
+
+    _script_functions = {
+        'jv_print': _jv_print,
+        'jv_mpp': _jv_mpp,
+    }
+
+    _channel_functions = {
+        'measure.i': _channel_measure,
+        'measure.v': _channel_measure,
+        'measure.overlappedi': _overlapped,
+        'measure.overlappedv': _overlapped,
+        'trigger.source.listv': _listv,
+        'trigger.measure.i': _trigger_measure,
+        'trigger.initiate': _channel_initiate,
+        'abort': _channel_abort,
+    }
+
+
+class SimulatedResourceManager(object):
+    """pyvisa ResourceManager stand-in that hands out SimulatedKeithley resources"""
+
+    def __init__(self, resources=None, latency=0.0):
+        if resources is None:
+            resources = {'GPIB0::18::INSTR': '2450', 'GPIB0::26::INSTR': '2600'}
+        self.resources = resources
+        self.latency = latency
+        self.instruments = {} #one per address, kept across sessions like the real thing
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self.resources)
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.instruments:
+            self.instruments[resource_name] = SimulatedKeithley(self.resources[resource_name], latency=self.latency)
+        return self.instruments[resource_name]
+
+    def close(self):
+        pass
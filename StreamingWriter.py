@@ -0,0 +1,197 @@
+import numpy as np
+import threading
+import queue
+import time
+import glob
+import os
+
+
+#files JVMeasure writes next to a data file <name>, as <name><suffix>. Every
+#new one goes in here so that analyze_archive skips it
+companion_suffixes = {
+    'params': '_params.csv',
+    'profile': '_profile.csv',
+    'sweeps': '_sweeps.csv',
+    'outliers': '_outliers.csv',
+    'stats': '_stats.csv',
+}
+
+
+class StreamingWriter(object):
+    """
+    Append-as-you-go CSV writer.
+
+    push() only queues the new columns, a background thread stacks and
+    formats the queued rows with np.savetxt and appends them to
+    fname + '.part' every flush_interval seconds, fsyncing after each flush.
+    close() writes what is left and renames the file to fname. If the
+    program dies before close(), recover() turns the .part file into a
+    normal data file. An open writer touches its .part file at least every
+    heartbeat_period seconds, so recover_dir() can tell it from a dead one.
+
+    Rows are pushed as (time, source, value) columns, columns picks
+    the ones that go into the file. header, e.g. the measurement, becomes a
+    '# ' comment line at the top of a new file.
+    """
+
+    part_suffix = '.part'
+    heartbeat_period = 5.0 #seconds
+
+    #.part files of the writers open in this process
+    _open_parts = set()
+    _open_lock = threading.Lock()
+
+    def __init__(self, fname, flush_interval=1.0, columns=(0, 1, 2), header=''):
+        self.fname = fname
+        self.flush_interval = flush_interval
+        self.columns = list(columns)
+        self.header = header
+
+        #time spent in push() on the acquisition thread, to measure the writer's overhead
+        self.push_time = 0
+        self.rows = 0
+
+        self._open()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StreamingWriter', daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        self.part_fname = self.fname + self.part_suffix
+        self._file = open(self.part_fname, 'ab')
+        if self.header and self._file.tell() == 0:
+            self._file.write('# {}\n'.format(self.header).encode('ascii'))
+        with self._open_lock:
+            self._open_parts.add(os.path.abspath(self.part_fname))
+
+    def push(self, time_, source, value):
+        t0 = time.perf_counter()
+        #stacking into rows is left to the writer thread
+        self._queue.put((time_, source, value))
+        self.rows += np.size(value)
+        self.push_time += time.perf_counter() - t0
+
+    def _run(self):
+        last_flush = time.perf_counter()
+        while not self._stop.wait(min(self.flush_interval, self.heartbeat_period)):
+            if time.perf_counter() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.perf_counter()
+            self._heartbeat()
+        self._flush()
+
+    def _heartbeat(self):
+        #slow acquisitions have nothing to write for a while, the file still shows the writer is alive
+        os.utime(self.part_fname)
+
+    def _flush(self):
+        chunks = []
+        while True:
+            try:
+                columns = self._queue.get_nowait()
+                n = np.size(columns[2])
+                chunks.append(np.column_stack([np.broadcast_to(c, (n,)) for c in columns]))
+            except queue.Empty:
+                break
+        if chunks:
+            self._write(np.vstack(chunks))
+
+    def _write(self, rows):
+        np.savetxt(self._file, rows[:, self.columns], delimiter=',')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close(self):
+        self._file.close()
+        os.replace(self.part_fname, self.fname)
+        with self._open_lock:
+            self._open_parts.discard(os.path.abspath(self.part_fname))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._thread.join()
+        self._close()
+
+    @classmethod
+    def recover(cls, part_fname):
+        """Drop a partially written last row from a .part file left by a crash
+        and rename it to the data file name. Returns the recovered file name
+        """
+        with open(part_fname, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            f.truncate(end)
+        fname = part_fname[:-len(cls.part_suffix)]
+        if os.path.exists(fname):
+            root, ext = os.path.splitext(fname)
+            fname = root + '_recovered' + ext
+        os.replace(part_fname, fname)
+        return fname
+
+    @classmethod
+    def recover_dir(cls, dirname, stale_after=60.0):
+        """Recover the .part files in dirname whose writer is gone: not open
+        in this process and not touched for stale_after seconds, so runs still
+        being written by another measurement or app are left alone. Returns
+        the recovered file names
+        """
+        with cls._open_lock:
+            open_parts = set(cls._open_parts)
+        recovered = []
+        for part_fname in glob.glob(os.path.join(dirname, '*' + cls.part_suffix)):
+            if os.path.abspath(part_fname) in open_parts or time.time() - os.path.getmtime(part_fname) < stale_after:
+                continue
+            recovered.append(cls.recover(part_fname))
+        return recovered
+
+
+class H5StreamingWriter(StreamingWriter):
+    """
+    Streams the (time, source, value) columns into chunked, gzip
+    compressed, extendable datasets of a new run_NNNN group in fname.
+
+    Every run of a sample shares one file, the next run number is kept in
+    the file's attributes so no probing is needed. Settings metadata goes
+    into run_group, see JVMeasure. The file is flushed after every write so
+    a crash loses at most one flush_interval of data.
+    """
+
+    names = ('time', 'source', 'value')
+    dtypes = ('f8', 'f8', 'f8')
+
+    def __init__(self, fname, flush_interval=1.0, chunk=4096, compression='gzip'):
+        self.chunk = chunk
+        self.compression = compression
+        StreamingWriter.__init__(self, fname, flush_interval)
+
+    def _open(self):
+        #h5py is slow to import and only needed for HDF5 output
+        import h5py
+        self._file = h5py.File(self.fname, 'a')
+        run = int(self._file.attrs.get('next_run', 0))
+        self._file.attrs['next_run'] = run + 1
+        self.run_name = 'run_{:04d}'.format(run)
+        self.run_group = self._file.create_group(self.run_name)
+        self.run_group.attrs['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.datasets = [self.run_group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                                                       chunks=(self.chunk,), compression=self.compression, shuffle=True)
+                         for name, dtype in zip(self.names, self.dtypes)]
+
+    def _heartbeat(self):
+        #HDF5 runs are written in place, there is no .part file to recover
+        pass
+
+    def _write(self, rows):
+        n0 = self.datasets[0].shape[0]
+        for i, ds in enumerate(self.datasets):
+            ds.resize((n0 + rows.shape[0],))
+            ds[n0:] = rows[:, i]
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
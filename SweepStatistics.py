@@ -0,0 +1,51 @@
+import numpy as np
+
+#small sample corrections for the MAD as an estimate of the standard deviation, Croux and Rousseeuw (1992).
+#above 9 sweeps the correction is n/(n - 0.8)
+mad_correction = {2: 1.196, 3: 1.495, 4: 1.363, 5: 1.206, 6: 1.200, 7: 1.140, 8: 1.129, 9: 1.107}
+
+#fewest sweeps for the outlier test, below that a point's spread is too rough to tell a glitch from noise
+min_sweeps = 5
+
+
+def sweep_statistics(currents, outlier_sigma=5, neighbours=5):
+    """
+    Aggregate of repeated sweeps, currents[sweep, point], computed for all
+    points at once.
+
+    A reading is an outlier when it is further than outlier_sigma robust
+    standard deviations from the median of its point. The robust standard
+    deviation of a point is 1.4826 times the median absolute deviation over
+    the sweeps with its finite sample correction, averaged over the points
+    up to neighbours away along the sweep. Noise changes with the current
+    and so with the point, but slowly enough that the neighbours steady the
+    estimate. 0 flags nothing, and so do fewer than min_sweeps sweeps.
+    A point whose readings would all be flagged keeps them all.
+    Returns a dict of per point arrays: mean and std of every sweep,
+    clean_mean and clean_std without the outliers, n_used, and outliers, a
+    boolean mask the shape of currents.
+    """
+    currents = np.atleast_2d(np.asarray(currents, dtype=float))
+    n = currents.shape[0]
+    mean = currents.mean(axis=0)
+    std = np.sqrt(((currents - mean)**2).sum(axis=0)/max(n - 1, 1))
+
+    if outlier_sigma > 0 and n >= min_sweeps:
+        median = np.median(currents, axis=0)
+        deviation = np.abs(currents - median)
+        mad = np.median(deviation, axis=0)
+        window = np.ones(2*neighbours + 1)
+        local_mad = np.convolve(mad, window, 'same')/np.convolve(np.ones_like(mad), window, 'same')
+        sigma = 1.4826*mad_correction.get(n, n/(n - 0.8))*local_mad
+        outliers = (sigma > 0) & (deviation > outlier_sigma*sigma)
+        #with an even number of sweeps even the two middle readings can be flagged, such a point gets the plain mean
+        outliers[:, outliers.all(axis=0)] = False
+    else:
+        outliers = np.zeros(currents.shape, dtype=bool)
+
+    n_used = n - outliers.sum(axis=0)
+    clean_mean = np.where(outliers, 0, currents).sum(axis=0)/n_used
+    residuals = np.where(outliers, 0, currents - clean_mean)
+    clean_std = np.sqrt((residuals**2).sum(axis=0)/np.maximum(n_used - 1, 1))
+    return {'mean': mean, 'std': std, 'clean_mean': clean_mean, 'clean_std': clean_std,
+            'n_used': n_used, 'outliers': outliers}
@@ -0,0 +1,58 @@
+from ScopeFoundry.helper_funcs import load_qt_ui_file
+import importlib.util
+import hashlib
+import os
+
+#compiled layouts live outside the program folder, a PyInstaller bundle unpacks to a new temp folder every launch
+cache_dir = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', '.cache')), 'KeithleyJVGUI')
+
+#bumped when the compiled modules change, older ones are compiled again
+cache_version = 2
+
+
+def compiled_ui_module(ui_filename):
+    """Python module compiled from a Qt Designer file by uic. It is
+    compiled once per version of the .ui (keyed by its hash) and imported
+    from the cache after that, so startup skips parsing the XML. The module
+    also gets root_class, the class name of the top widget
+    """
+    with open(ui_filename, 'rb') as f:
+        data = f.read()
+    name = '{}_{}_v{:d}'.format(os.path.splitext(os.path.basename(ui_filename))[0], hashlib.sha1(data).hexdigest()[:12], cache_version)
+    py_fname = os.path.join(cache_dir, name + '.py')
+
+    if not os.path.exists(py_fname):
+        from qtpy import uic
+        import xml.etree.ElementTree as ET
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(py_fname + '.tmp', 'w') as f:
+            uic.compileUi(ui_filename, f)
+            f.write('\nroot_class = {!r}\n'.format(ET.fromstring(data).find('widget').get('class')))
+        os.replace(py_fname + '.tmp', py_fname)
+
+    spec = importlib.util.spec_from_file_location(name, py_fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_qt_ui_file_cached(ui_filename):
+    """Drop-in for ScopeFoundry's load_qt_ui_file that builds the widget
+    from the compiled layout. Falls back to load_qt_ui_file where uic
+    cannot compile (PySide) or the cache is not writable
+    """
+    try:
+        module = compiled_ui_module(ui_filename)
+    except (ImportError, AttributeError, OSError):
+        return load_qt_ui_file(ui_filename)
+
+    from qtpy import QtWidgets
+    ui_class = [getattr(module, name) for name in dir(module) if name.startswith('Ui_')][0]
+
+    widget = getattr(QtWidgets, module.root_class)()
+    ui = ui_class()
+    ui.setupUi(widget)
+    #child widgets become attributes of the top widget, as with uic.loadUi
+    for name, value in vars(ui).items():
+        setattr(widget, name, value)
+    return widget
@@ -1,7 +1,6 @@
 from qtpy import QtWidgets,QtCore
-from PyQt5 import QtGui
 
-class XAutoPanTool(QtGui.QAction):
+class XAutoPanTool(QtWidgets.QAction):
     """
     A tool that provides the "AutoPan" for the X axis of a plot
     (aka "oscilloscope mode"). It is implemented as an Action, and provides a
@@ -10,7 +9,7 @@ class XAutoPanTool(QtGui.QAction):
     """
 
     def __init__(self, parent=None):
-        QtGui.QAction.__init__(self, 'Auto Pan', parent)
+        QtWidgets.QAction.__init__(self, 'Auto Pan', parent)
         self.setCheckable(True)
         self.toggled.connect(self._onToggled)
         self._timer = QtCore.QTimer()
@@ -30,8 +29,10 @@ class XAutoPanTool(QtGui.QAction):
         self._viewBox.sigXRangeChanged.connect(self._onXRangeChanged)
 
     def _addToMenu(self, menu):
-        for m in menu.axes:
-            if m.title() == 'X Axis':
+        #older pyqtgraph lists the axis menus in menu.axes, newer only as submenus
+        for action in menu.actions():
+            m = action.menu()
+            if m is not None and m.title().lower() == 'x axis':
                 x_menu = m
                 self._XactionMenu = x_menu.actions()[0]
                 x_menu.insertAction(self._XactionMenu, self)
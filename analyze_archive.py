@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch analysis of saved JV files.
+
+Scans a directory tree for the CSV files written by JVMeasure, extracts the
+device parameters of each one (see JVParameters) on a pool of processes and
+writes them to one summary table:
+
+    python analyze_archive.py "C:/Data" summary.csv --area 0.1
+
+Results are kept in a cache keyed by the SHA-1 of each file's contents
+(.jv_analysis_cache.jsonl in the scanned directory by default), so a repeated
+run only analyses new or changed files, and an interrupted run picks up where
+it stopped. Files whose size and modification time are unchanged are not
+even read again.
+
+Every CSV with two columns is analysed as voltage, current. Tracking files
+get NaN parameters: the ones whose '# ' header line names a measurement
+other than JV Measurement and, for older files without the header line, the
+ones whose first column is constant or does not run one way. An older
+tracking file with an increasing time column cannot be told from a sweep.
+The files written next to the data, such as _params.csv, are skipped, see
+companion_suffixes in StreamingWriter. Unreadable files are listed in the
+summary with their error.
+"""
+
+from JVParameters import JVParameters
+from StreamingWriter import companion_suffixes
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import argparse
+import warnings
+import hashlib
+import csv
+import json
+import time
+import io
+import os
+
+#area independent, Jsc and PCE are worked out from these when the summary is written
+cached_names = ('points', 'Voc', 'Isc', 'FF', 'Pmax', 'Vmpp', 'Impp', 'Rs', 'Rsh')
+
+#entries of other versions in the cache are analysed again
+cache_version = 2
+
+summary_names = ('points', 'Voc', 'Isc', 'Jsc', 'FF', 'Pmax', 'PCE', 'Vmpp', 'Impp', 'Rs', 'Rsh')
+
+
+def load_csv(data):
+    """Measurement named in the '# ' header line, '' if there is none, and
+    the columns of a numeric CSV written by np.savetxt. Raises ValueError
+    on anything that is not a full table of numbers
+    """
+    text = data.decode('ascii')
+    measurement = text[2:text.find('\n')].strip() if text.startswith('# ') else ''
+    with warnings.catch_warnings():
+        #an empty file is reported below rather than warned about
+        warnings.simplefilter('ignore', UserWarning)
+        values = np.loadtxt(io.StringIO(text), delimiter=',', ndmin=2)
+    if values.size == 0:
+        raise ValueError('no data')
+    return measurement, values.T
+
+
+def is_tracking(measurement, columns):
+    if measurement:
+        return measurement != 'JV Measurement'
+    steps = np.diff(columns[0])
+    return not (np.all(steps > 0) or np.all(steps < 0))
+
+
+def analyze_file(path):
+    """Cache entry of one file, the values or the error that stopped it"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    entry = {'hash': hashlib.sha1(data).hexdigest(), 'version': cache_version}
+    try:
+        measurement, columns = load_csv(data)
+        if is_tracking(measurement, columns):
+            #a time column would cross zero at its first reading and give a made up Isc
+            values = dict.fromkeys(cached_names, float('nan'))
+        elif len(columns) != 2:
+            raise ValueError('{:d} columns'.format(len(columns)))
+        else:
+            params = JVParameters()
+            params.update(columns[0], columns[1])
+            values = params.values()
+        values['points'] = columns.shape[1]
+        entry['values'] = dict((name, values[name]) for name in cached_names)
+    except (ValueError, UnicodeDecodeError) as e:
+        entry['error'] = str(e)
+    return entry
+
+
+def find_files(root, exclude=()):
+    exclude = set(os.path.abspath(fname) for fname in exclude)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.endswith('.csv') and not fname.endswith(tuple(companion_suffixes.values())):
+                path = os.path.join(dirpath, fname)
+                if os.path.abspath(path) not in exclude:
+                    yield path
+
+
+def load_cache(fname):
+    """Entries by content hash and (size, mtime, hash) by path, later lines win"""
+    by_hash = {}
+    by_path = {}
+    if not os.path.exists(fname):
+        return by_hash, by_path
+    with open(fname) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                #the last line of an interrupted run can be cut short
+                continue
+            if entry.get('version') != cache_version:
+                continue
+            by_hash[entry['hash']] = entry
+            by_path[entry['path']] = (entry['size'], entry['mtime'], entry['hash'])
+    return by_hash, by_path
+
+
+def summary_row(entry, area, light_power):
+    if 'values' not in entry:
+        return dict.fromkeys(summary_names, ''), entry.get('error', '')
+    values = dict(entry['values'])
+    values['Jsc'] = values['Isc']/area if area else np.nan
+    values['PCE'] = values['Pmax']/(area*light_power) if area and light_power else np.nan
+    return values, ''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('summary', help='summary table to write (CSV)')
+    parser.add_argument('--cache', help='cache file, default .jv_analysis_cache.jsonl in the directory')
+    parser.add_argument('--area', type=float, default=0, help='cell area in cm^2, for Jsc and PCE')
+    parser.add_argument('--light-intensity', type=float, default=100, help='in mW/cm^2, for PCE')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes, default one per CPU')
+    args = parser.parse_args(argv)
+
+    cache_fname = args.cache or os.path.join(args.directory, '.jv_analysis_cache.jsonl')
+    by_hash, by_path = load_cache(cache_fname)
+
+    t_start = time.perf_counter()
+    files = list(find_files(args.directory, exclude=(args.summary,)))
+    hashes = {}
+    todo = []
+    for path in files:
+        st = os.stat(path)
+        key = os.path.relpath(path, args.directory)
+        cached = by_path.get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns and cached[2] in by_hash:
+            hashes[path] = cached[2]
+        else:
+            todo.append((path, key, st))
+    print('{:d} files, {:d} cached, {:d} to analyse'.format(len(files), len(hashes), len(todo)), flush=True)
+
+    #every result is appended as it comes in, so an interrupted run keeps what it finished
+    if todo:
+        with ProcessPoolExecutor(args.jobs) as pool, open(cache_fname, 'a') as cache:
+            results = pool.map(analyze_file, [path for path, key, st in todo], chunksize=64)
+            for k, ((path, key, st), entry) in enumerate(zip(todo, results)):
+                entry.update(path=key, size=st.st_size, mtime=st.st_mtime_ns)
+                cache.write(json.dumps(entry) + '\n')
+                by_hash[entry['hash']] = entry
+                hashes[path] = entry['hash']
+                if (k+1) % 1000 == 0:
+                    cache.flush()
+                    print('{:d}/{:d}'.format(k+1, len(todo)), flush=True)
+
+    with open(args.summary, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('file',) + summary_names + ('error',))
+        for path in files:
+            values, error = summary_row(by_hash[hashes[path]], args.area, 1e-3*args.light_intensity)
+            writer.writerow([os.path.relpath(path, args.directory)] + [values[name] for name in summary_names] + [error])
+
+    elapsed = time.perf_counter() - t_start
+    print('{:d} files in {:.1f} s, {:.0f} files/s, summary in {}'.format(len(files), elapsed, len(files)/max(elapsed, 1e-9), args.summary))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Acquisition throughput benchmarks for the Keithley drivers.
+
+Connects to the SMU without the GUI and times the same JV sweep taken point
+by point (one set_level write and one read query per point) and as a buffered
+sweep running on the instrument.
+
+    python benchmark_acquisition.py 2450 --npoints 101
+
+Tracking is timed the same way, as the per-sample loop JVMeasure runs and
+as instrument-timed buffered tracking. With --simulated the drivers talk to
+SimulatedKeithley instead, so the numbers can be reproduced on any machine:
+
+    python benchmark_acquisition.py all --simulated --latency 5e-3 --nplc 0.01
+
+The buffer transfer formats and the streaming writer's cost on the
+acquisition loop can be measured offline, without an instrument:
+
+    python benchmark_acquisition.py --formats --writer --h5
+
+and the multi-instrument scheduler against simulated SMUs on one GPIB bus:
+
+    python benchmark_acquisition.py --batch 4 --latency 5e-3
+
+--mpp runs the on-instrument MPP tracking loop for the given number of
+seconds and prints its loop rate.
+--adaptive compares the time and the Voc, FF and Pmax error of a uniform and
+an adaptive voltage grid with the same point budget.
+--profiler measures what CommandProfiler adds to each command.
+--getters times the settings reads through the TSP library loaded at connect
+against the raw TSP snippets they replace, and the library load itself.
+--repeats N times N back to back sweeps point by point and buffered, one
+readback per sweep, and the spread across them with the SMU averaging each
+point and without.
+"""
+
+from ScopeFoundry import BaseApp
+from ScopeFoundry.helper_funcs import OrderedAttrDict
+import numpy as np
+import pyvisa.util
+import argparse
+import tempfile
+import time
+import os
+
+
+class BenchmarkApp(BaseApp):
+
+    name = 'Keithley JV Benchmark'
+
+    def __init__(self, argv):
+        BaseApp.__init__(self, argv)
+        self.hardware = OrderedAttrDict()
+
+    def add_hardware(self, hw):
+        self.hardware[hw.name] = hw
+        return hw
+
+
+def load_hardware(app, model, simulated=False, latency=0.0):
+    if model == '2450':
+        from Keithley2450HW import Keithley2450HW
+        hw = app.add_hardware(Keithley2450HW(app))
+    else:
+        from Keithley2600HW import Keithley2600HW
+        hw = app.add_hardware(Keithley2600HW(app))
+
+    if simulated:
+        from SimulatedKeithley import SimulatedKeithley
+        hw.keithley = SimulatedKeithley(model, latency=latency)
+        hw.load_library()
+    else:
+        hw.settings['connected'] = True
+    return hw
+
+
+def bench_point_by_point(hw, vlist):
+    t0 = time.perf_counter()
+    t_first = None
+    hw.set_output('On')
+    for v in vlist:
+        hw.set_level(v)
+        hw.read_measurement()
+        if t_first is None:
+            t_first = time.perf_counter() - t0
+    hw.set_output('Off')
+    return time.perf_counter() - t0, t_first
+
+
+def bench_buffered(hw, vlist, poll_period=0.01):
+    t0 = time.perf_counter()
+    t_first = None
+    hw.start_sweep(vlist, 0)
+    n_read = 0
+    running = True
+    while running:
+        running = hw.sweep_running()
+        n = hw.read_buffer_count()
+        if n > n_read:
+            hw.read_sweep(n_read+1, n)
+            n_read = n
+            if t_first is None:
+                t_first = time.perf_counter() - t0
+        if running:
+            time.sleep(poll_period)
+    hw.set_output('Off')
+    return time.perf_counter() - t0, t_first
+
+
+def buffered_sweep(hw, vlist, poll_period=0.01, point_period=None):
+    #voltages, currents and timestamps of one buffered sweep. with the time per
+    #point known, the first wait is about as long as the sweep, like JVMeasure's adaptive passes
+    hw.start_sweep(vlist, 0)
+    wait = poll_period
+    if point_period:
+        wait = min(wait, max(len(vlist)*point_period, 1e-3))
+    while hw.sweep_running():
+        time.sleep(wait)
+        wait = poll_period
+    v, i, t = hw.read_sweep(1, hw.read_buffer_count())
+    hw.set_output('Off')
+    return v, i, t
+
+
+def bench_adaptive(hw, start, stop, npoints, tolerance=1e-3):
+    """Points, time and error of Voc, FF and Pmax for a uniform sweep of
+    npoints, an adaptive sweep with the same budget and a uniform sweep with
+    as many points as the adaptive one took, against a uniform sweep 10
+    times denser
+    """
+    from JVParameters import JVParameters
+    from AdaptiveSweep import adaptive_sweep
+
+    def parameters(v, i):
+        params = JVParameters()
+        params.update(v, i)
+        return np.array([params.Voc, params.FF, params.Pmax])
+
+    def timed_uniform(n):
+        t0 = time.perf_counter()
+        v, i, t = buffered_sweep(hw, np.linspace(start, stop, n))
+        return (v, i), time.perf_counter() - t0
+
+    point_period = [None]
+    def measure(vlist):
+        #one buffered sweep per pass, waiting about as long as it takes
+        v, i, t = buffered_sweep(hw, vlist, point_period=point_period[0])
+        if t.size > 1:
+            point_period[0] = (t[-1] - t[0])/(t.size - 1)
+        return v, i
+
+    reference = parameters(*buffered_sweep(hw, np.linspace(start, stop, 10*npoints))[:2])
+    uniform, t_uniform = timed_uniform(npoints)
+    t0 = time.perf_counter()
+    adaptive, passes = adaptive_sweep(measure, start, stop, 21, npoints, tolerance)
+    t_adaptive = time.perf_counter() - t0
+    same_points, t_same_points = timed_uniform(adaptive[0].size)
+
+    for label, (v, i), elapsed in (('uniform grid', uniform, t_uniform),
+                                   ('adaptive, {:d} passes'.format(passes), adaptive, t_adaptive),
+                                   ('uniform, same points', same_points, t_same_points)):
+        error = np.abs(parameters(v, i)/reference - 1)
+        print('{0:<24s} {1:8d} pts {2:9.3f} s  error Voc {3:.1e} FF {4:.1e} Pmax {5:.1e}'.format(label, v.size, elapsed, *error))
+
+
+def bench_dual_sweep(hw, vlist, poll_period=0.01):
+    #smua and smub in lock step, both buffers read as they fill
+    t0 = time.perf_counter()
+    t_first = None
+    hw.start_dual_sweep(vlist, 0)
+    n_read = dict.fromkeys(hw.channels, 0)
+    running = True
+    while running:
+        running = hw.dual_sweep_running()
+        for ch in hw.channels:
+            n = hw.read_buffer_count(ch)
+            if n > n_read[ch]:
+                hw.read_sweep(n_read[ch]+1, n, ch)
+                n_read[ch] = n
+                if t_first is None:
+                    t_first = time.perf_counter() - t0
+        if running:
+            time.sleep(poll_period)
+    for ch in hw.channels:
+        hw.set_output('Off', ch)
+    return time.perf_counter() - t0, t_first
+
+
+def bench_linear_sweep(hw, vlist):
+    t0 = time.perf_counter()
+    hw.linVSweepMeasureI(vlist[0], vlist[-1], len(vlist), 0)
+    hw.set_output('Off')
+    elapsed = time.perf_counter() - t0
+    return elapsed, elapsed
+
+
+def bench_point_by_point_tracking(hw, npoints, level):
+    #the same calls JVMeasure makes for every Current Tracking sample
+    t0 = time.perf_counter()
+    t_first = None
+    for _ in range(npoints):
+        hw.set_source('Voltage')
+        hw.set_measureFunc('Current')
+        hw.clear_buffer()
+        hw.set_output('On')
+        hw.set_level(level)
+        hw.read_measurement_withTime()
+        if t_first is None:
+            t_first = time.perf_counter() - t0
+    hw.set_output('Off')
+    return time.perf_counter() - t0, t_first
+
+
+def bench_buffered_tracking(hw, npoints, level, period, poll_period=0.01):
+    t0 = time.perf_counter()
+    t_first = None
+    hw.set_source('Voltage')
+    hw.set_measureFunc('Current')
+    hw.set_output('On')
+    hw.set_level(level)
+    hw.start_tracking(period, npoints)
+    n_read = 0
+    running = True
+    while running:
+        running = hw.tracking_running()
+        n = hw.read_buffer_count()
+        if n > n_read:
+            hw.read_tracking(n_read+1, n)
+            n_read = n
+            if t_first is None:
+                t_first = time.perf_counter() - t0
+        if running:
+            time.sleep(poll_period)
+    hw.abort_tracking()
+    hw.set_output('Off')
+    return time.perf_counter() - t0, t_first
+
+
+def bench_mpp(hw, seconds, vmax, period=0.1):
+    """Iterations per second of the on-instrument MPP loop, from its own
+    reports, and the power it settled at
+    """
+    nreports = max(1, int(round(seconds/period)))
+    hw.start_mpp(0.5*vmax, 5e-3, 0, vmax, period, nreports)
+    n = 0
+    try:
+        for _ in range(nreports):
+            t, v, i, p, k = hw.read_mpp()
+            n += k
+    finally:
+        hw.abort_mpp()
+    print('{0:<24s} {1:8d} its {2:9.3f} s {3:10.1f} its/s  at {4:.4f} V, {5:.4g} W'.format('MPP loop', n, t, n/t, v, p))
+
+
+def bench_getters(hw, model, n=20):
+    """Time per settings read: the raw TSP the getters used to send (a write
+    then a print on the 2450, a print on the 2600) against one jv_print call,
+    for one setting and for all of them. Then the library load, fresh and
+    when the loaded version matches
+    """
+    names = [name for lq_name, name in hw.hardware_settings]
+    if model == '2450':
+        def raw_nplc():
+            hw.keithley.write("nplc = smu.measure.nplc")
+            return float(hw.keithley.query("print(nplc)"))
+    else:
+        def raw_nplc():
+            return float(hw.keithley.query("print(smua.measure.nplc)"))
+
+    for label, func in (('raw TSP getter', raw_nplc), ('library getter', hw.read_NPLC),
+                        ('library, all settings', lambda: hw.query_settings(*names))):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            func()
+        print('{0:<24s} {1:9.2f} ms/call'.format(label, 1e3*(time.perf_counter() - t0)/n))
+
+    hw.keithley.write("jvlib_version = nil")
+    for label in ('library load', 'library reuse'):
+        t0 = time.perf_counter()
+        hw.load_library()
+        print('{0:<24s} {1:9.2f} ms'.format(label, 1e3*(time.perf_counter() - t0)))
+
+
+def bench_profiler(n):
+    """Time per command added by ProfiledResource, on a simulated SMU with no latency"""
+    from SimulatedKeithley import SimulatedKeithley
+    from CommandProfiler import CommandProfiler, ProfiledResource
+    sim = SimulatedKeithley('2450')
+    for label, resource in (('unprofiled write', sim), ('profiled write', ProfiledResource(sim, CommandProfiler()))):
+        t0 = time.perf_counter()
+        for k in range(n):
+            resource.write("smu.source.level = {:f}".format(k*1e-4))
+        print('{0:<24s} {1:9.2f} us/command'.format(label, 1e6*(time.perf_counter() - t0)/n))
+
+
+def bench_buffer_formats(n):
+    """Bytes on the bus and decode time for n buffer readings sent as the
+    instrument's ASCII printbuffer output and as REAL32/REAL64 blocks
+    """
+    readings = np.random.default_rng(0).normal(0, 1e-3, n)
+    results = []
+
+    ascii_block = ', '.join('{:.6e}'.format(x) for x in readings) + '\n'
+    t0 = time.perf_counter()
+    [float(i) for i in ascii_block.split(', ')]
+    results.append(('ASCII list comprehension', len(ascii_block), time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    np.array(ascii_block.split(','), dtype=float)
+    results.append(('ASCII numpy', len(ascii_block), time.perf_counter() - t0))
+
+    for name, datatype in (('REAL32', 'f'), ('REAL64', 'd')):
+        block = b'#0' + readings.astype('<' + datatype).tobytes() + b'\n'
+        t0 = time.perf_counter()
+        pyvisa.util.from_ieee_block(block, datatype=datatype, is_big_endian=False, container=np.array)
+        results.append((name, len(block), time.perf_counter() - t0))
+
+    for label, nbytes, elapsed in results:
+        print('{0:<24s} {1:8d} rdgs {2:10d} bytes {3:9.2f} ms'.format(label, n, nbytes, 1e3*elapsed))
+
+
+def bench_writer(n, flush_interval=0.1):
+    """Per-point cost of streaming n single-point pushes through
+    StreamingWriter, compared with just keeping the points in memory
+    """
+    from StreamingWriter import StreamingWriter
+    from MeasurementBuffer import MeasurementBuffer
+
+    store = MeasurementBuffer()
+    t0 = time.perf_counter()
+    for k in range(n):
+        store.append(k, 0.5, 1e-3)
+    baseline = time.perf_counter() - t0
+
+    fname = os.path.join(tempfile.mkdtemp(), 'bench.csv')
+    store = MeasurementBuffer()
+    writer = StreamingWriter(fname, flush_interval)
+    t0 = time.perf_counter()
+    for k in range(n):
+        store.append(k, 0.5, 1e-3)
+        writer.push(k, 0.5, 1e-3)
+    streaming = time.perf_counter() - t0
+    writer.close()
+
+    print('{0:<24s} {1:8d} pts {2:9.2f} us/pt'.format('in memory only', n, 1e6*baseline/n))
+    print('{0:<24s} {1:8d} pts {2:9.2f} us/pt  ({3:.2f} us in push)'.format('streaming writer', n, 1e6*streaming/n, 1e6*writer.push_time/n))
+    os.remove(fname)
+
+
+def bench_h5(n, chunk=1000):
+    """File size and write time for n rows saved as CSV with np.savetxt and
+    streamed in chunks to HDF5 with H5StreamingWriter
+    """
+    from StreamingWriter import H5StreamingWriter
+
+    rng = np.random.default_rng(0)
+    t = np.arange(n)*1e-3
+    source = np.full(n, 0.5)
+    value = rng.normal(1e-3, 1e-6, n)
+    dirname = tempfile.mkdtemp()
+
+    fname = os.path.join(dirname, 'bench.csv')
+    t0 = time.perf_counter()
+    np.savetxt(fname, np.column_stack((t, value)), delimiter=',')
+    elapsed = time.perf_counter() - t0
+    results = [('CSV np.savetxt', os.path.getsize(fname), elapsed)]
+    os.remove(fname)
+
+    fname = os.path.join(dirname, 'bench.h5')
+    t0 = time.perf_counter()
+    writer = H5StreamingWriter(fname, flush_interval=0.1)
+    for k in range(0, n, chunk):
+        writer.push(t[k:k+chunk], source[k:k+chunk], value[k:k+chunk])
+    writer.close()
+    elapsed = time.perf_counter() - t0
+    results.append(('HDF5 streaming', os.path.getsize(fname), elapsed))
+    os.remove(fname)
+
+    for label, nbytes, elapsed in results:
+        print('{0:<24s} {1:8d} rows {2:10d} bytes {3:9.2f} ms'.format(label, n, nbytes, 1e3*elapsed))
+
+
+def bench_batch(app, n, latency, npoints, nplc=0.01):
+    """Devices/hour for n simulated 2450s sharing one GPIB bus, one device
+    each, measured one instrument at a time and all at once by
+    AcquisitionScheduler
+    """
+    from Keithley2450HW import Keithley2450HW
+    from SimulatedKeithley import SimulatedKeithley
+    from AcquisitionScheduler import AcquisitionScheduler, DeviceJob
+
+    instruments = {}
+    for k in range(n):
+        hw = Keithley2450HW(app, name='SMU {:d}'.format(k))
+        hw.settings['VISA_address'] = 'GPIB0::{:d}::INSTR'.format(k+1)
+        hw.keithley = SimulatedKeithley('2450', latency=latency)
+        hw.set_NPLC(nplc)
+        instruments[hw.name] = hw
+    params = {'npoints': npoints}
+
+    t0 = time.perf_counter()
+    for name, hw in instruments.items():
+        scheduler = AcquisitionScheduler({name: hw}, tempfile.mkdtemp(), params)
+        scheduler.add_job(DeviceJob('cell', name))
+        scheduler.run()
+    sequential = time.perf_counter() - t0
+
+    scheduler = AcquisitionScheduler(instruments, tempfile.mkdtemp(), params)
+    for name in instruments:
+        scheduler.add_job(DeviceJob('cell ' + name, name))
+    scheduler.run()
+
+    print('{0:<24s} {1:8d} devs {2:9.3f} s {3:10.1f} devices/hour'.format('one SMU at a time', n, sequential, n/sequential*3600))
+    print('{0:<24s} {1:8d} devs {2:9.3f} s {3:10.1f} devices/hour'.format('concurrent', n, scheduler.elapsed(), scheduler.devices_per_hour()))
+
+
+def bench_repeats(hw, vlist, n, average=10):
+    """Time and mean standard deviation per point over n sweeps: point by
+    point from the host, buffered with one readback per sweep, and buffered
+    with the SMU averaging each point with its repeat filter
+    """
+    from SweepStatistics import sweep_statistics
+
+    def point_by_point():
+        hw.set_output('On')
+        currents = []
+        for v in vlist:
+            hw.set_level(v)
+            currents.append(hw.read_measurement())
+        hw.set_output('Off')
+        return currents
+
+    for label, sweep, count in (('point by point', point_by_point, 1),
+                                ('buffered', lambda: buffered_sweep(hw, vlist)[1], 1),
+                                ('buffered, filter {:d}'.format(average), lambda: buffered_sweep(hw, vlist)[1], average)):
+        hw.set_filter_count(count)
+        t0 = time.perf_counter()
+        stats = sweep_statistics([sweep() for _ in range(n)])
+        elapsed = time.perf_counter() - t0
+        print('{0:<24s} {1:8d} sweeps {2:9.3f} s  std {3:9.3g} A  {4:d} outliers'.format(
+            label, n, elapsed, float(np.mean(stats['std'])), int(stats['outliers'].sum())))
+    hw.set_filter_count(1)
+
+
+def report(label, npoints, elapsed, t_first):
+    print('{0:<24s} {1:8d} pts {2:9.3f} s {3:10.1f} pts/s  first point {4:7.1f} ms'.format(
+        label, npoints, elapsed, npoints/elapsed, 1e3*(t_first or 0)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', nargs='?', choices=('2450', '2600', 'all'))
+    parser.add_argument('--simulated', action='store_true', help='use SimulatedKeithley instead of a real instrument')
+    parser.add_argument('--latency', type=float, default=5e-3, help='simulated per-command latency in seconds')
+    parser.add_argument('--nplc', type=float, default=None)
+    parser.add_argument('--npoints', type=int, default=101)
+    parser.add_argument('--track-points', type=int, default=200)
+    parser.add_argument('--track-period', type=float, default=1e-3)
+    parser.add_argument('--start', type=float, default=0)
+    parser.add_argument('--stop', type=float, default=1)
+    parser.add_argument('--formats', action='store_true', help='compare buffer transfer formats for 10k and 100k readings')
+    parser.add_argument('--writer', action='store_true', help='measure the streaming writer overhead per point')
+    parser.add_argument('--profiler', action='store_true', help='measure the command profiler overhead')
+    parser.add_argument('--h5', action='store_true', help='compare CSV and HDF5 file size and write time for 100k rows')
+    parser.add_argument('--batch', type=int, default=0, help='devices/hour for this many simulated SMUs on one bus')
+    parser.add_argument('--adaptive', action='store_true', help='compare uniform and adaptive JV grids for --npoints')
+    parser.add_argument('--mpp', type=float, default=0, help='run the on-instrument MPP loop for this many seconds')
+    parser.add_argument('--getters', action='store_true', help='time settings reads through the TSP library')
+    parser.add_argument('--repeats', type=int, default=0, help='time and spread of this many repeated sweeps')
+    args = parser.parse_args(argv)
+
+    if args.formats:
+        for n in (10000, 100000):
+            bench_buffer_formats(n)
+    if args.writer:
+        bench_writer(100000)
+    if args.h5:
+        bench_h5(100000)
+    if args.profiler:
+        bench_profiler(100000)
+    app = None
+    if args.batch:
+        app = BenchmarkApp([])
+        bench_batch(app, args.batch, args.latency, args.npoints)
+    if args.model is None:
+        return
+
+    app = app or BenchmarkApp([])
+    vlist = np.linspace(args.start, args.stop, args.npoints)
+    models = ('2450', '2600') if args.model == 'all' else (args.model,)
+
+    for model in models:
+        hw = load_hardware(app, model, args.simulated, args.latency)
+        if args.nplc is not None:
+            hw.set_NPLC(args.nplc)
+            if model == '2600':
+                hw.set_NPLC(args.nplc, 'smub')
+        print('Keithley {}{}'.format(model, ' (simulated)' if args.simulated else ''))
+
+        if args.getters:
+            bench_getters(hw, model)
+        report('point by point', args.npoints, *bench_point_by_point(hw, vlist))
+        report('buffered sweep', args.npoints, *bench_buffered(hw, vlist))
+        if model == '2600':
+            report('SweepVLinMeasureI', args.npoints, *bench_linear_sweep(hw, vlist))
+            report('dual channel sweep', 2*args.npoints, *bench_dual_sweep(hw, vlist))
+        report('tracking point by point', args.track_points, *bench_point_by_point_tracking(hw, args.track_points, args.stop))
+        report('tracking buffered', args.track_points, *bench_buffered_tracking(hw, args.track_points, args.stop, args.track_period))
+        if args.adaptive:
+            bench_adaptive(hw, args.start, args.stop, args.npoints)
+        if args.mpp:
+            bench_mpp(hw, args.mpp, args.stop)
+        if args.repeats:
+            bench_repeats(hw, vlist, args.repeats)
+
+        if not args.simulated:
+            hw.settings['connected'] = False
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup time of the GUI, split into imports, building the window and
+connecting the SMUs.
+
+    python benchmark_startup.py
+    python benchmark_startup.py --simulated --latency 5e-3
+
+Discovering the SMUs by *IDN? is timed, then connecting with a reset and with reset_on_connect off, along with
+the settings readback, one query per setting against one batched query.
+
+Run it twice: the first run also compiles JVMeasurement_ui.ui into the
+layout cache (see UiCache). The import times are the increment of each
+module over the ones above it, for a per-module breakdown use
+
+    python -X importtime main_app.py
+"""
+
+import time
+t_launch = time.perf_counter()
+
+import argparse
+import importlib
+import sys
+import os
+
+#in the order main_app pulls them in
+app_modules = ('qtpy.QtWidgets', 'numpy', 'ScopeFoundry', 'Keithley2450HW', 'Keithley2600HW',
+               'JVMeasure', 'BatchMeasure', 'main_app')
+
+#imported only once needed, listed when something loads them at startup anyway
+deferred_modules = ('pyqtgraph', 'h5py', 'pyvisa', 'qdarkstyle')
+
+
+def line(label, elapsed):
+    print('{0:<36s} {1:9.1f} ms'.format(label, 1e3*elapsed))
+
+
+def bench_imports():
+    total = 0
+    for name in app_modules:
+        t0 = time.perf_counter()
+        importlib.import_module(name)
+        elapsed = time.perf_counter() - t0
+        total += elapsed
+        line('import ' + name, elapsed)
+    line('imports total', total)
+    loaded = [name for name in deferred_modules if name in sys.modules]
+    print('loaded at startup: ' + (', '.join(loaded) or 'none of ' + ', '.join(deferred_modules)))
+
+
+def bench_ui_file():
+    from ScopeFoundry.helper_funcs import sibling_path, load_qt_ui_file
+    from UiCache import load_qt_ui_file_cached
+    ui_filename = sibling_path(os.path.abspath(__file__), 'JVMeasurement_ui.ui')
+    for label, load in (('.ui parsed by uic', load_qt_ui_file), ('.ui from compiled cache', load_qt_ui_file_cached)):
+        t0 = time.perf_counter()
+        load(ui_filename).deleteLater()
+        line(label, time.perf_counter() - t0)
+
+
+def bench_connect(app):
+    """Connect time of each SMU: the first one loads the TSP library, then
+    with a reset and with reset_on_connect off. Then the settings readback,
+    one query per setting against the batched one
+    """
+    from ScopeFoundry import HardwareComponent
+    for hw in app.hardware.values():
+        for label, reset in (('first', True), ('reset', True), ('no reset', False)):
+            hw.settings['reset_on_connect'] = reset
+            t0 = time.perf_counter()
+            hw.settings['connected'] = True
+            line('connect {} ({})'.format(hw.name, label), time.perf_counter() - t0)
+            if label != 'no reset':
+                hw.settings['connected'] = False
+        t0 = time.perf_counter()
+        HardwareComponent.read_from_hardware(hw)
+        line('readback per setting', time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        hw.read_from_hardware()
+        line('readback batched', time.perf_counter() - t0)
+        hw.settings['connected'] = False
+        hw.settings['reset_on_connect'] = True
+
+
+def bench_discovery(app):
+    #finding every SMU by *IDN?, scanning the bus and then from the pool's cache
+    from ResourcePool import resource_pool
+    resource_pool.acquire()
+    try:
+        for label in ('discover (scan)', 'discover (cached)'):
+            t0 = time.perf_counter()
+            for hw in app.hardware.values():
+                resource_pool.find(hw.idn_pattern)
+            line(label, time.perf_counter() - t0)
+    finally:
+        resource_pool.release()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--simulated', action='store_true', help='connect to SimulatedKeithley instead of real instruments')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated per-command latency in seconds')
+    parser.add_argument('--no-connect', action='store_true', help='skip connecting the SMUs')
+    args = parser.parse_args(argv)
+
+    bench_imports()
+
+    from main_app import KeithleyJVApp
+    t0 = time.perf_counter()
+    app = KeithleyJVApp([])
+    line('build window', time.perf_counter() - t0)
+    bench_ui_file()
+    line('launch to window', time.perf_counter() - t_launch)
+
+    if not args.no_connect:
+        if args.simulated:
+            from SimulatedKeithley import SimulatedResourceManager
+            from Keithley2450HW import Keithley2450HW
+            from ResourcePool import resource_pool
+            resources = dict((hw.settings['VISA_address'], '2450' if isinstance(hw, Keithley2450HW) else '2600')
+                             for hw in app.hardware.values())
+            manager = SimulatedResourceManager(resources, args.latency)
+            resource_pool.factory = lambda: manager
+        bench_discovery(app)
+        bench_connect(app)
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,16 @@ Created on Wed Feb 14 18:41:28 2018
 """
 
 from ScopeFoundry import BaseMicroscopeApp
-import qdarkstyle
 
 class KeithleyJVApp(BaseMicroscopeApp):
 
     # this is the name of the microscope that ScopeFoundry uses 
     # when storing data
     name = 'Keithley JV'
+
+    #extra SMUs for batch measurements as (model, name, VISA address),
+    #e.g. ('2450', 'Keithley 2450 B', 'GPIB0::19::INSTR')
+    extra_smus = []
     
     # You must define a setup function that adds all the 
     #capablities of the microscope and sets default settings
@@ -24,9 +27,13 @@ class KeithleyJVApp(BaseMicroscopeApp):
         #Add hardware components
         print("Adding Hardware Components")
         from Keithley2450HW import Keithley2450HW
-        # from Keithley2600HW import Keithley2600HW
+        from Keithley2600HW import Keithley2600HW
         self.add_hardware(Keithley2450HW(self))
-        # self.add_hardware(Keithley2600HW(self))
+        self.add_hardware(Keithley2600HW(self))
+        for model, name, address in self.extra_smus:
+            hw_class = Keithley2450HW if model == '2450' else Keithley2600HW
+            hw = self.add_hardware(hw_class(self, name=name))
+            hw.settings['VISA_address'] = address
 
         #Add measurement components
         print("Create Measurement objects")
@@ -34,6 +41,10 @@ class KeithleyJVApp(BaseMicroscopeApp):
         # Connect to custom gui
         from JVMeasure import JVMeasure
         self.add_measurement(JVMeasure(self))
+        from BatchMeasure import BatchMeasure
+        self.add_measurement(BatchMeasure(self))
+        from ProfileMeasure import ProfileMeasure
+        self.add_measurement(ProfileMeasure(self))
 
         
         # load side panel UI
@@ -47,6 +58,7 @@ if __name__ == '__main__':
     import sys
     
     app = KeithleyJVApp(sys.argv)
-    #Uncomment line below for dark mode
+    #Uncomment lines below for dark mode
+    # import qdarkstyle
     # app.qtapp.setStyleSheet(qdarkstyle.load_stylesheet())
     sys.exit(app.exec_())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless recipe runner.
+
+Runs a JSON recipe of JV sweeps, light soaking, tracking and repeats on one
+SMU without the GUI, through the same Keithley2450HW/Keithley2600HW
+components. Every step is timed and a summary is printed at the end.
+
+    python run_recipe.py overnight.json
+    python run_recipe.py overnight.json --simulated
+
+--simulated runs the recipe against SimulatedKeithley, to check a recipe
+and its timing before leaving it overnight. Example recipe:
+
+    {
+        "smu": "2450",
+        "address": "GPIB0::18::INSTR",
+        "settings": {"NPLC": 1, "ILimit": 0.05, "Sense": "4Wire"},
+        "save_dir": "C:/Data",
+        "sample": "cellA",
+        "format": "h5",
+        "steps": [
+            {"type": "soak", "time": 300},
+            {"type": "repeat", "count": 12, "steps": [
+                {"type": "jv", "name": "forward", "start": -0.1, "stop": 1.2, "npoints": 131},
+                {"type": "jv", "name": "reverse", "start": 1.2, "stop": -0.1, "npoints": 131},
+                {"type": "track", "mode": "current", "level": 0.9, "time": 600, "period": 0.1}
+            ]}
+        ]
+    }
+
+Step types:
+    jv      start, stop, npoints, delay=0. Buffered list sweep on the instrument
+    track   mode ('current' holds a voltage, 'voltage' holds a current), level,
+            time, period. Instrument timed buffered tracking
+    soak    time, bias=null. Holds the bias voltage, or open circuit with the
+            output off when bias is null, while the cell is illuminated
+    wait    time, with the output off
+    repeat  count, steps
+
+Every step may also have a "name". Unknown step types, keys and track modes,
+and levels, times or counts of the wrong type or out of range, are rejected
+before the first step runs.
+
+"settings" are written to the SMU's settings before the first step, e.g.
+{"Channel": "smub"} to run on the second channel of a 2600. Data steps are
+saved as run groups of <sample>.h5, or with "format": "csv" as one
+<sample>_<step>_<name>.csv file per step.
+"""
+
+from ScopeFoundry import BaseApp
+from ScopeFoundry.helper_funcs import OrderedAttrDict
+from StreamingWriter import StreamingWriter, H5StreamingWriter
+import numpy as np
+import argparse
+import json
+import time
+import os
+
+
+class RecipeError(Exception):
+    pass
+
+
+class RecipeApp(BaseApp):
+
+    name = 'Keithley JV Recipe'
+
+    def __init__(self, argv):
+        BaseApp.__init__(self, argv)
+        self.hardware = OrderedAttrDict()
+
+    def add_hardware(self, hw):
+        self.hardware[hw.name] = hw
+        return hw
+
+
+class RecipeRunner(object):
+    """
+    Runs the steps of a recipe dict on a connected SMU hardware component.
+    The recipe is expanded and checked before anything is sent, so a typo
+    in the last step does not stop an overnight run halfway.
+    """
+
+    poll_period = 0.05 #seconds between buffer polls
+    track_buffer_size = 100000 #readings per buffered tracking block
+    flush_interval = 1.0
+
+    required = {
+        'jv': ('start', 'stop', 'npoints'),
+        'track': ('level', 'time', 'period'),
+        'soak': ('time',),
+        'wait': ('time',),
+        'repeat': ('count', 'steps'),
+    }
+    optional = {
+        'jv': ('name', 'delay'),
+        'track': ('name', 'mode'),
+        'soak': ('name', 'bias'),
+        'wait': ('name',),
+        'repeat': ('name',),
+    }
+    recipe_keys = ('smu', 'address', 'settings', 'save_dir', 'sample', 'format', 'steps')
+
+    #largest source levels of the 2450 and 2600 series, volts and amps
+    max_voltage = 210.0
+    max_current = 3.03
+
+    def __init__(self, hw, recipe):
+        self.hw = hw
+        self.recipe = recipe
+        unknown = sorted(set(recipe) - set(self.recipe_keys))
+        if unknown:
+            raise RecipeError('unknown recipe keys {}'.format(', '.join(unknown)))
+        self.save_dir = recipe.get('save_dir', '.')
+        self.sample = recipe.get('sample', 'recipe')
+        self.format = recipe.get('format', 'h5')
+        if self.format not in ('h5', 'csv'):
+            raise RecipeError('format must be h5 or csv')
+        self.plan = [('{:03d} {}'.format(k+1, label), step) for k, (label, step) in enumerate(self.expand(recipe.get('steps', [])))]
+        self.timing = [] #(label, points, seconds)
+
+    def expand(self, steps, repeat=''):
+        """List of (label, step) with repeats unrolled"""
+        plan = []
+        if not isinstance(steps, list):
+            raise RecipeError('steps must be a list, not {!r}'.format(steps))
+        for step in steps:
+            self.check(step)
+            kind = step['type']
+            if kind == 'repeat':
+                for k in range(int(step['count'])):
+                    plan.extend(self.expand(step['steps'], '{}{:d}/{:d} '.format(repeat, k+1, int(step['count']))))
+            else:
+                plan.append((repeat + step.get('name', kind), step))
+        return plan
+
+    def check(self, step):
+        """Raise RecipeError unless step is complete, has no unknown keys and
+        its values have the right types and ranges. A typo must not turn into
+        a different source mode halfway through an unattended run
+        """
+        if not isinstance(step, dict):
+            raise RecipeError('steps must be objects, not {!r}'.format(step))
+        kind = step.get('type')
+        if kind not in self.required:
+            raise RecipeError('unknown step type {!r}'.format(kind))
+        missing = [key for key in self.required[kind] if key not in step]
+        if missing:
+            raise RecipeError('{} step is missing {}'.format(kind, ', '.join(missing)))
+        unknown = sorted(set(step) - set(('type',) + self.required[kind] + self.optional[kind]))
+        if unknown:
+            raise RecipeError('{} step has unknown keys {}'.format(kind, ', '.join(unknown)))
+        if not isinstance(step.get('name', ''), str):
+            raise RecipeError('{} step name must be a string'.format(kind))
+
+        def number(key, vmin=None, vmax=None, integer=False, above=None):
+            value = step[key]
+            #bool is an int to Python, but true is not a voltage
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+                raise RecipeError('{} {} must be a number, not {!r}'.format(kind, key, value))
+            if integer and value != int(value):
+                raise RecipeError('{} {} must be a whole number, not {!r}'.format(kind, key, value))
+            if (vmin is not None and value < vmin) or (vmax is not None and value > vmax) or (above is not None and value <= above):
+                raise RecipeError('{} {} = {!r} is out of range'.format(kind, key, value))
+
+        if kind == 'jv':
+            number('start', -self.max_voltage, self.max_voltage)
+            number('stop', -self.max_voltage, self.max_voltage)
+            number('npoints', 1, integer=True)
+            if 'delay' in step:
+                number('delay', 0)
+        elif kind == 'track':
+            mode = step.get('mode', 'current')
+            if mode not in ('current', 'voltage'):
+                raise RecipeError("track mode must be 'current' or 'voltage', not {!r}".format(mode))
+            #current tracking holds a voltage, voltage tracking a current
+            limit = self.max_voltage if mode == 'current' else self.max_current
+            number('level', -limit, limit)
+            number('time', above=0)
+            number('period', above=0)
+        elif kind == 'soak':
+            number('time', 0)
+            if step.get('bias') is not None:
+                number('bias', -self.max_voltage, self.max_voltage)
+        elif kind == 'wait':
+            number('time', 0)
+        else:
+            number('count', 0, integer=True)
+
+    def run(self):
+        #the channel goes first so the other settings apply to it
+        settings = dict(self.recipe.get('settings', {}))
+        if 'Channel' in settings:
+            self.hw.settings['Channel'] = settings.pop('Channel')
+        for key, value in settings.items():
+            self.hw.settings[key] = value
+
+        t_start = time.perf_counter()
+        try:
+            for label, step in self.plan:
+                t0 = time.perf_counter()
+                n = self.run_step(label, step)
+                elapsed = time.perf_counter() - t0
+                self.timing.append((label, n, elapsed))
+                print(self.format_timing(label, n, elapsed), flush=True)
+        finally:
+            self.hw.set_output('Off')
+        print('{:d} steps in {:.1f} s'.format(len(self.timing), time.perf_counter() - t_start))
+
+    def format_timing(self, label, n, elapsed):
+        rate = '{:10.1f} pts/s'.format(n/elapsed) if n and elapsed > 0 else ''
+        return '{0:<40s} {1:8d} pts {2:9.3f} s {3}'.format(label, n, elapsed, rate)
+
+    def run_step(self, label, step):
+        kind = step['type']
+        if kind == 'soak':
+            self.run_soak(step)
+            return 0
+        if kind == 'wait':
+            self.hw.set_output('Off')
+            time.sleep(step['time'])
+            return 0
+
+        writer = self.open_writer(label, step)
+        try:
+            if kind == 'jv':
+                return self.run_sweep(step, writer)
+            return self.run_tracking(step, writer)
+        finally:
+            writer.close()
+
+    def open_writer(self, label, step):
+        if self.format == 'h5':
+            writer = H5StreamingWriter(os.path.join(self.save_dir, self.sample + '.h5'), self.flush_interval)
+            writer.run_group.attrs['step'] = label
+            writer.run_group.attrs['SMU'] = self.hw.name
+            writer.run_group.attrs['recipe_step'] = json.dumps(step)
+            return writer
+        #same columns as JVMeasure's files
+        columns = (1, 2) if step['type'] == 'jv' else (0, 2)
+        if step['type'] == 'jv':
+            measurement = 'JV Measurement'
+        else:
+            measurement = 'Voltage Tracking' if step.get('mode') == 'voltage' else 'Current Tracking'
+        fname = '{}_{}_{}.csv'.format(self.sample, label.split()[0], step.get('name', step['type']))
+        return StreamingWriter(os.path.join(self.save_dir, fname), self.flush_interval, columns, measurement)
+
+    def run_sweep(self, step, writer):
+        hw = self.hw
+        vlist = np.linspace(step['start'], step['stop'], int(step['npoints']))
+        hw.start_sweep(vlist, step.get('delay', 0))
+        t0 = None
+        n_read = 0
+        running = True
+        try:
+            while running:
+                running = hw.sweep_running()
+                n = hw.read_buffer_count()
+                if n > n_read:
+                    v, i, t = hw.read_sweep(n_read+1, n)
+                    if t0 is None:
+                        t0 = t[0]
+                    writer.push(t - t0, v, i)
+                    n_read = n
+
+                if running:
+                    time.sleep(self.poll_period)
+        except KeyboardInterrupt:
+            hw.abort_sweep()
+            raise
+        hw.set_output('Off')
+        return n_read
+
+    def run_tracking(self, step, writer):
+        hw = self.hw
+        if step.get('mode', 'current') == 'current':
+            hw.set_source('Voltage')
+            hw.set_measureFunc('Current')
+        elif step['mode'] == 'voltage':
+            hw.set_source('Current')
+            hw.set_measureFunc('Voltage')
+        else:
+            raise RecipeError('unknown track mode {!r}'.format(step['mode']))
+        level = step['level']
+        hw.set_output('On')
+        hw.set_level(level)
+
+        #blocks of track_buffer_size readings until the step's time is up
+        period = step['period']
+        remaining = max(1, int(round(step['time']/period)))
+        t0 = None
+        n_total = 0
+        try:
+            while remaining > 0:
+                hw.start_tracking(period, min(remaining, self.track_buffer_size))
+                n_read = 0
+                running = True
+                while running:
+                    running = hw.tracking_running()
+                    n = hw.read_buffer_count()
+                    if n > n_read:
+                        y, t = hw.read_tracking(n_read+1, n)
+                        if t0 is None:
+                            t0 = t[0]
+                        writer.push(t - t0, level, y)
+                        n_read = n
+
+                    if running:
+                        time.sleep(self.poll_period)
+                if n_read == 0:
+                    break
+                remaining -= n_read
+                n_total += n_read
+        finally:
+            hw.abort_tracking()
+        hw.set_output('Off')
+        return n_total
+
+    def run_soak(self, step):
+        hw = self.hw
+        bias = step.get('bias')
+        if bias is None:
+            #open circuit
+            hw.set_output('Off')
+        else:
+            hw.set_source('Voltage')
+            hw.set_output('On')
+            hw.set_level(bias)
+        time.sleep(step['time'])
+
+
+def load_hardware(app, recipe, simulated=False, latency=0.0):
+    model = str(recipe.get('smu', '2450'))
+    if model == '2450':
+        from Keithley2450HW import Keithley2450HW
+        hw = app.add_hardware(Keithley2450HW(app))
+    elif model == '2600':
+        from Keithley2600HW import Keithley2600HW
+        hw = app.add_hardware(Keithley2600HW(app))
+    else:
+        raise RecipeError('smu must be 2450 or 2600')
+
+    if 'address' in recipe:
+        hw.settings['VISA_address'] = recipe['address']
+    if simulated:
+        #connect() opens the simulated instrument through the usual driver path
+        from SimulatedKeithley import SimulatedResourceManager
+        from ResourcePool import resource_pool
+        manager = SimulatedResourceManager({hw.settings['VISA_address']: model}, latency)
+        resource_pool.factory = lambda: manager
+    hw.settings['connected'] = True
+    return hw
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recipe')
+    parser.add_argument('--simulated', action='store_true', help='use SimulatedKeithley instead of a real instrument')
+    parser.add_argument('--latency', type=float, default=5e-3, help='simulated per-command latency in seconds')
+    args = parser.parse_args(argv)
+
+    with open(args.recipe) as f:
+        recipe = json.load(f)
+
+    app = RecipeApp([])
+    hw = load_hardware(app, recipe, args.simulated, args.latency)
+    runner = RecipeRunner(hw, recipe)
+    print('{}: {:d} steps on {}{}'.format(args.recipe, len(runner.plan), hw.name, ' (simulated)' if args.simulated else ''))
+    try:
+        runner.run()
+    finally:
+        hw.settings['connected'] = False
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import pytest
+
+#simulated instruments on the bus, at the drivers' default addresses
+addresses = {'2450': 'GPIB0::18::INSTR', '2600': 'GPIB0::26::INSTR'}
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Headless app for the hardware components, as in benchmark_acquisition.
+    Tests that need it are skipped where ScopeFoundry cannot be imported
+    """
+    import os
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from benchmark_acquisition import BenchmarkApp
+    except Exception as e:
+        #ScopeFoundry missing, or broken on this Python
+        pytest.skip('ScopeFoundry is not usable: {}'.format(e))
+    return BenchmarkApp([])
+
+
+@pytest.fixture
+def simulated_bus():
+    """The shared resource pool opening a SimulatedResourceManager with a 2450
+    and a 2600, a fresh one each time the pool is first acquired
+    """
+    from ResourcePool import resource_pool
+    from SimulatedKeithley import SimulatedResourceManager
+    resource_pool.factory = lambda: SimulatedResourceManager(dict((address, model) for model, address in addresses.items()))
+    yield resource_pool
+    resource_pool.factory = None
+
+
+@pytest.fixture
+def load_smu(app, simulated_bus):
+    """load_smu(model) gives a driver connected through the resource pool to a
+    simulated SMU, so connect() runs as it does on the bench. Measurements
+    are at 0.01 NPLC so sweeps take milliseconds
+    """
+    from benchmark_acquisition import load_hardware
+    loaded = []
+
+    def load(model):
+        hw = load_hardware(app, model)
+        loaded.append(hw)
+        if model == '2450':
+            hw.set_NPLC(0.01)
+        else:
+            for ch in hw.channels:
+                hw.set_NPLC(0.01, ch)
+        return hw
+    yield load
+    for hw in loaded:
+        hw.settings['connected'] = False
+
+
+@pytest.fixture(scope='session')
+def jv_app():
+    """The GUI app of main_app.py, offscreen, for tests of the measurements"""
+    import os
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from main_app import KeithleyJVApp
+        return KeithleyJVApp([])
+    except Exception as e:
+        pytest.skip('ScopeFoundry GUI is not usable: {}'.format(e))
+
+
+@pytest.fixture
+def jv(jv_app, simulated_bus, tmp_path):
+    """jv(model, **settings) gives the JV Measurement on a connected simulated
+    SMU, saving into tmp_path, with the given measurement settings
+    """
+    m = jv_app.measurements['JV Measurement']
+    jv_app.settings['save_dir'] = str(tmp_path)
+    jv_app.settings['sample'] = 'cell'
+    defaults = dict((name, m.settings[name]) for name in m.settings.as_dict())
+    connected = []
+
+    def load(model, **settings):
+        hw = [hw for hw in jv_app.hardware.values() if hw.settings['VISA_address'] == addresses[model]][0]
+        if not hw.settings['connected']:
+            hw.settings['connected'] = True
+            connected.append(hw)
+            for args in ([(ch,) for ch in hw.channels] if model == '2600' else [()]):
+                hw.set_NPLC(0.01, *args)
+        m.settings['SMU'] = hw.name
+        for name, value in settings.items():
+            m.settings[name] = value
+        return m
+    yield load
+    for name, value in defaults.items():
+        if not getattr(m.settings.as_dict()[name], 'ro', False):
+            m.settings[name] = value
+    for hw in connected:
+        hw.settings['connected'] = False
+
+
+@pytest.fixture
+def run_measurement():
+    import threading
+
+    def run(m, duration=None):
+        """What ScopeFoundry does around a run, without the thread. Tracking
+        runs until interrupted, here after duration seconds
+        """
+        m.interrupt_measurement_called = False
+        m.pre_run()
+        timer = None
+        if duration is not None:
+            #the flag interrupt() raises in a threaded run
+            timer = threading.Timer(duration, setattr, (m, 'interrupt_measurement_called', True))
+            timer.start()
+        try:
+            m.run()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            m.post_run()
+        return m
+    return run
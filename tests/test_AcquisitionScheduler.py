@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from AcquisitionScheduler import AcquisitionScheduler, DeviceJob, parse_device_list
+from ResourcePool import LockedResource
+
+params = {'npoints': 21, 'track_time': 0.2, 'track_period': 0.02, 'constant_v': 0.5}
+
+
+def test_device_list_is_parsed_into_jobs():
+    jobs = parse_device_list('cell1@Keithley 2450, cell2@Keithley 2600/smub,')
+    assert [(j.device, j.smu, j.ch) for j in jobs] == [('cell1', 'Keithley 2450', None), ('cell2', 'Keithley 2600', 'smub')]
+
+
+def test_batch_runs_on_two_smus_sharing_a_bus(load_smu, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    smus = {'2450': load_smu('2450'), '2600': load_smu('2600')}
+    scheduler = AcquisitionScheduler(smus, str(tmp_path), params)
+    with pytest.raises(KeyError):
+        scheduler.add_job(DeviceJob('cell0', '6517'))
+    scheduler.add_job(DeviceJob('cell1', '2450', sequence=('JV Measurement', 'Current Tracking')))
+    scheduler.add_job(DeviceJob('cell2', '2600', 'smua'))
+    scheduler.add_job(DeviceJob('cell3', '2600', 'smuc'))
+    scheduler.add_job(DeviceJob('cell4', '2600', 'smub'))
+    scheduler.start()
+    #both instruments are on GPIB0, so they take turns on one lock
+    assert isinstance(smus['2450'].keithley, LockedResource)
+    assert smus['2450'].keithley.lock is smus['2600'].keithley.lock
+    scheduler.join()
+
+    #a failed device does not stop the rest of its queue
+    assert sorted(device for device, fname in scheduler.done) == ['cell1', 'cell2', 'cell4']
+    assert [device for device, e in scheduler.errors] == ['cell3']
+    assert not any(isinstance(hw.keithley, LockedResource) for hw in smus.values())
+    assert 'cell3 failed' in scheduler.report()
+
+    with h5py.File(str(tmp_path / 'cell1.h5'), 'r') as f:
+        assert [f[run].attrs['Measurement'] for run in sorted(f)] == ['JV Measurement', 'Current Tracking']
+        jv, tracking = [f[run] for run in sorted(f)]
+        assert np.allclose(jv['source'][:], np.linspace(0, 1, 21))
+        assert tracking['time'].size >= 5 and np.all(tracking['source'][:] == 0.5)
+    with h5py.File(str(tmp_path / 'cell4.h5'), 'r') as f:
+        assert f['run_0000'].attrs['Channel'] == 'smub' and f['run_0000']['value'].size == 21
+    assert smus['2450'].read_output() == 'Off'
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from AdaptiveSweep import adaptive_sweep, refine_voltages
+from JVParameters import JVParameters
+from SimulatedKeithley import SimulatedKeithley
+
+diode = SimulatedKeithley()
+
+
+def measure(vlist):
+    return vlist, diode.iv_current(vlist), np.zeros(len(vlist))
+
+
+def parameters(v, i):
+    params = JVParameters()
+    params.update(v, i)
+    return params
+
+
+def test_refines_around_voc_and_mpp():
+    v = np.linspace(0, 1, 11)
+    i = diode.iv_current(v)
+    new = refine_voltages(v, i, 4)
+    assert new.size == 4 and np.all(np.diff(new) > 0)
+    voc = diode.iv_voltage(0.0)
+    assert np.any(np.abs(new - voc) < 0.1)
+    assert not np.isin(new, v).any()
+
+
+@pytest.mark.parametrize('start, stop', [(0, 1), (1, 0)])
+def test_converges_within_budget(start, stop):
+    columns, passes = adaptive_sweep(measure, start, stop, 11, 61, 1e-3)
+    v, i, t = columns
+    assert 11 < v.size <= 61 and passes > 1
+    steps = np.diff(v)
+    assert np.all(steps > 0) if stop > start else np.all(steps < 0)
+    assert np.allclose(i, diode.iv_current(v))
+
+    #Voc and Pmax as good as a uniform sweep of the same number of points, or better
+    true = parameters(*measure(np.linspace(0, 1, 2001))[:2])
+    uniform = parameters(*measure(np.linspace(0, 1, v.size))[:2])
+    adaptive = parameters(v, i)
+    assert abs(adaptive.Voc - true.Voc) <= abs(uniform.Voc - true.Voc)
+    assert abs(adaptive.Pmax - true.Pmax) <= abs(uniform.Pmax - true.Pmax) + 1e-9
+
+
+def test_stops_when_measure_returns_none():
+    calls = []
+
+    def interrupted(vlist):
+        calls.append(len(vlist))
+        return measure(vlist) if len(calls) == 1 else None
+
+    columns, passes = adaptive_sweep(interrupted, 0, 1, 11, 61, 1e-6)
+    assert passes == 1 and columns[0].size == 11
+    assert adaptive_sweep(lambda vlist: None, 0, 1, 11, 61, 1e-3) == ([], 0)
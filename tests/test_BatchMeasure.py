@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.fixture
+def batch(jv_app):
+    return jv_app.measurements['Batch Measurement']
+
+
+def test_batch_does_not_start_on_an_smu_in_use(jv, batch):
+    m = jv('2450')
+    batch.settings['devices'] = 'cell1@' + m.keithley.name
+    m.keithley.claim(m)
+    try:
+        with pytest.raises(RuntimeError, match='in use by JV Measurement'):
+            batch.run()
+    finally:
+        m.keithley.release(m)
+    assert m.keithley.owner is None
+
+
+def test_jv_does_not_start_on_an_smu_in_a_batch(jv, batch, run_measurement):
+    m = jv('2450', npoints=11)
+    m.keithley.claim(batch)
+    try:
+        with pytest.raises(RuntimeError, match='in use by Batch Measurement'):
+            run_measurement(m)
+    finally:
+        m.keithley.release(batch)
+    run_measurement(m)
+    assert m.keithley.owner is None and m.stores[None].total == 11
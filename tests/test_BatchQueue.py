@@ -0,0 +1,92 @@
+import threading
+import time
+import numpy as np
+from BatchQueue import SPSCQueue, BatchPublisher, BatchConsumer
+from MeasurementBuffer import MeasurementBuffer
+
+
+def test_spsc_drops_when_full():
+    q = SPSCQueue(3)
+    assert all(q.put(k) for k in range(3))
+    assert not q.put(3)
+    assert q.dropped == 1 and q.high_water == 3 and len(q) == 3
+    assert [q.get() for _ in range(4)] == [0, 1, 2, None]
+    #the indices keep counting past the capacity
+    for k in range(10):
+        q.put(k)
+        assert q.get() == k
+
+
+def test_spsc_threads_keep_order():
+    q = SPSCQueue(8)
+    got = []
+    done = threading.Event()
+
+    def consume():
+        while not done.is_set() or len(q):
+            item = q.get()
+            if item is None:
+                time.sleep(1e-5)
+            else:
+                got.append(item)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    put = [k for k in range(20000) if q.put(k)]
+    done.set()
+    consumer.join()
+    assert got == put
+    assert len(put) + q.dropped == 20000
+
+
+def test_publisher_batches_and_flushes():
+    q = SPSCQueue(16)
+    publisher = BatchPublisher(q, batch_size=4, max_age=60)
+    publisher.add('a', np.arange(10.), 0, np.arange(10.))
+    assert len(q) == 2
+    publisher.flush()
+    sizes = []
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        sizes.append(item[2][2].size)
+    assert sizes == [4, 4, 2]
+
+
+def test_clear_survives_a_full_queue():
+    q = SPSCQueue(2)
+    publisher = BatchPublisher(q, batch_size=4, max_age=60)
+    stores = {None: MeasurementBuffer()}
+    consumer = BatchConsumer(publisher, stores)
+    publisher.add(None, np.arange(8.), 0, np.arange(8.))
+    consumer.consume()
+    assert stores[None].total == 8
+
+    publisher.add(None, np.arange(12.), 0, np.arange(12.))
+    publisher.clear(None)
+    assert q.dropped == 1
+    #the store is cleared and the batches from before the clear are discarded
+    consumer.consume()
+    assert stores[None].total == 0
+
+    publisher.add(None, 100., 0, 1.)
+    publisher.flush()
+    consumer.consume()
+    assert np.array_equal(stores[None].view('time'), [100.])
+
+
+def test_stale_batches_are_published_by_the_producer():
+    q = SPSCQueue(4)
+    publisher = BatchPublisher(q, batch_size=256, max_age=0.01)
+    stores = {None: MeasurementBuffer()}
+    consumer = BatchConsumer(publisher, stores)
+    publisher.add(None, 0., 0, 1.)
+    publisher.add(None, 1., 0, 2.)
+    time.sleep(0.02)
+    #the consumer only takes what is queued, it never puts
+    consumer.consume()
+    assert stores[None].total == 0
+    publisher.flush_stale()
+    consumer.consume()
+    assert stores[None].total == 2
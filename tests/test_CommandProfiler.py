@@ -0,0 +1,50 @@
+import csv
+import numpy as np
+import pytest
+from CommandProfiler import CommandProfiler, ProfiledResource, export_profiles
+from SimulatedKeithley import SimulatedKeithley
+
+
+@pytest.mark.parametrize('cmd, label', [
+    ('smua.source.levelv = 0.25\n', 'smua.source.levelv = #'),
+    ('printbuffer(1, 200, defbuffer1.readings)', 'printbuffer(#,..., defbuffer1.readings)'),
+    ('jv_sweep(-1e-3, .5, 2)', 'jv_sweep(#,...)'),
+    ('format.data = format.REAL64', 'format.data = format.REAL64'),
+])
+def test_numbers_are_taken_out_of_the_labels(cmd, label):
+    assert CommandProfiler.command_label(cmd) == label
+
+
+def test_rows_add_up_calls_of_one_label():
+    profiler = CommandProfiler()
+    for seconds in [1e-3]*19 + [1.]:
+        profiler.record('query', 'print(#)', seconds)
+    profiler.record('write', 'reset()', 1e-4)
+    slowest, fastest = profiler.rows()
+    assert (slowest['label'], slowest['calls'], fastest['calls']) == ('print(#)', 20, 1)
+    assert np.isclose(slowest['total'], 1.019) and slowest['max'] == 1. and slowest['min'] == 1e-3
+    #the percentiles are the centres of their histogram bins
+    assert 1e-3/10**0.125 <= slowest['p50'] <= 1e-3*10**0.125 and slowest['p95'] == slowest['p50']
+    assert sum(slowest['histogram']) == 20 and slowest['histogram'][-1] == 0
+
+    profiler.clear()
+    assert profiler.rows() == []
+
+
+def test_commands_through_the_resource_are_exported(tmp_path):
+    profiler = CommandProfiler()
+    resource = ProfiledResource(SimulatedKeithley(), profiler)
+    resource.timeout = 1000
+    for level in (0.1, 0.2, 0.3):
+        resource.write('smu.source.level = {}'.format(level))
+    resource.query('print(smu.source.level)')
+    with profiler.phase('sweep'):
+        pass
+
+    export_profiles(str(tmp_path / 'profile.csv'), {'2450': profiler})
+    with open(str(tmp_path / 'profile.csv')) as f:
+        rows = dict(((row['kind'], row['label']), row) for row in csv.DictReader(f))
+    assert sorted(rows) == [('phase', 'sweep'), ('query', 'print(smu.source.level)'), ('write', 'smu.source.level = #')]
+    assert rows[('write', 'smu.source.level = #')]['calls'] == '3'
+    assert all(row['source'] == '2450' for row in rows.values())
+    assert resource.resource.timeout == 1000
@@ -0,0 +1,118 @@
+import numpy as np
+import time
+import pytest
+
+
+def test_point_average_follows_the_measure_function(jv, run_measurement):
+    m = run_measurement(jv('2450', Measurement='Current Tracking', track_mode='Buffered', itrack_delay=1e-3, point_average=4), 0.2)
+    m = run_measurement(jv('2450', Measurement='Voltage Tracking', track_mode='Buffered', vtrack_delay=1e-3, point_average=4), 0.2)
+    sim = m.keithley.keithley
+    #the 2450 keeps the filter per measure function, the voltage one has to be set too
+    assert sim.state['smu.measure.func'] == 'smu.FUNC_DC_VOLTAGE'
+    assert sim.state['smu.measure.filter.enable'] == 'smu.ON'
+    assert int(float(sim.state['smu.measure.filter.count'])) == 4
+    assert m.stores[None].total > 0
+
+
+@pytest.mark.parametrize('dual_channel', [False, True])
+def test_buffered_tracking_time_keeps_running_across_blocks(jv, run_measurement, dual_channel):
+    m = jv('2600', Measurement='Current Tracking', track_mode='Buffered', itrack_delay=1e-3, dual_channel=dual_channel)
+    m.track_buffer_size = 20
+    try:
+        run_measurement(m, 0.3)
+    finally:
+        m.track_buffer_size = 100000
+    for store in m.stores.values():
+        t = store.view('time')
+        assert t.size > 2*20
+        assert np.all(np.diff(t) > 0)
+
+
+def test_profile_is_saved_when_a_run_fails(jv, run_measurement, monkeypatch, tmp_path):
+    m = jv('2450', npoints=11, save_profile=True)
+
+    def timed_out():
+        m.keithley.read_buffer_count()
+        raise IOError('timed out')
+    monkeypatch.setattr(m, 'run_buffered_sweep', timed_out)
+    with pytest.raises(IOError):
+        run_measurement(m)
+    profile = (tmp_path / 'cell_profile.csv').read_text()
+    assert 'print(defbuffer1.n)' in profile
+
+
+def test_profile_is_off_by_default(jv, run_measurement, tmp_path):
+    run_measurement(jv('2450', npoints=11))
+    assert (tmp_path / 'cell.csv').exists()
+    assert not (tmp_path / 'cell_profile.csv').exists()
+
+
+@pytest.mark.parametrize('measurement', ['Current Tracking', 'MPP Tracking'])
+def test_tracking_display_is_decimated(jv, run_measurement, monkeypatch, measurement):
+    m = jv('2600', Measurement=measurement, track_mode='Buffered', itrack_delay=1e-3, mpp_report_period=1e-3)
+    monkeypatch.setattr(m, 'display_buckets', 10)
+    run_measurement(m, 0.3)
+    m.update_display()
+    store, decimator = m.display_stores[None], m.decimators[None]
+    t, y = decimator.data()
+    expected = store.view('value')
+    if measurement == 'MPP Tracking':
+        expected = -store.view('source')*expected
+    assert store.total > 2*10 and decimator.total == store.total
+    assert t.size <= 2*(10 + 1)
+    assert y.max() == expected.max() and y.min() == expected.min()
+
+
+def test_adaptive_passes_wait_for_the_sweep_not_the_poll_period(jv, run_measurement, monkeypatch):
+    m = jv('2450', sweep_mode='Adaptive', npoints=101, adaptive_coarse_points=21, jv_delay=0)
+    monkeypatch.setattr(m, 'buffer_poll_period', 0.3)
+    passes = []
+    measure_pass = m.measure_pass
+    monkeypatch.setattr(m, 'measure_pass', lambda vlist: passes.append(vlist.size) or measure_pass(vlist))
+    t0 = time.perf_counter()
+    run_measurement(m)
+    #only the first pass, before the time per point is known, waits a whole poll period
+    assert len(passes) > 2
+    assert time.perf_counter() - t0 < 0.3*(len(passes) - 1)
+    assert m.stores[None].total > 21
+
+
+def test_tracking_keeps_to_its_deadlines(jv, run_measurement, monkeypatch):
+    m = jv('2450', Measurement='Current Tracking', track_mode='Point by Point', itrack_delay=0.02)
+    read = m.keithley.read_measurement_withTime
+    calls = []
+
+    def stalls_once():
+        #the host stalls after the fifth reading, as on a busy GUI thread
+        result = read()
+        calls.append(1)
+        if len(calls) == 5:
+            time.sleep(0.07)
+        return result
+    monkeypatch.setattr(m.keithley, 'read_measurement_withTime', stalls_once)
+    run_measurement(m, 0.5)
+
+    #the deadlines missed in the stall are skipped, one late reading is taken at once
+    #and the rest stay on the grid of the first reading, so the stall, 3.5 periods,
+    #does not shift them by half a period. The median allows for jitter of the host
+    k = (m.stores[None].view('time') - m.stores[None].view('time')[0])/0.02
+    assert k.size > 10 and k[5] - k[4] > 3
+    assert np.median(np.abs(k[6:] - np.round(k[6:]))) < 0.2
+    assert m.settings['missed_deadlines'] >= 2
+    assert k[-1] > k.size
+
+
+def test_file_names_count_on_from_the_directory(jv, run_measurement, tmp_path):
+    (tmp_path / 'cell_7.csv').write_text('')
+    for name in ('cell_8.csv', 'cell_9.csv'):
+        run_measurement(jv('2450', npoints=11))
+        assert (tmp_path / name).exists()
+
+
+def test_hdf5_runs_go_into_one_file(jv, run_measurement, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    for measurement in ('JV Measurement', 'Current Tracking'):
+        run_measurement(jv('2450', Measurement=measurement, npoints=11, itrack_delay=0.01, save_mode='HDF5'), 0.1)
+    with h5py.File(str(tmp_path / 'cell.h5'), 'r') as f:
+        assert [f[name].attrs['Measurement'] for name in sorted(f)] == ['JV Measurement', 'Current Tracking']
+        assert f['run_0000']['value'].shape == (11,)
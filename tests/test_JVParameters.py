@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from JVParameters import JVParameters, hysteresis_index
+from SimulatedKeithley import SimulatedKeithley
+
+#noise free single diode curve of the simulator, Voc about 0.9 V and Isc about 20 mA
+diode = SimulatedKeithley()
+v = np.linspace(-0.1, 1.0, 111)
+i = diode.iv_current(v)
+
+
+def slope_dvdi(v0, dv=1e-4):
+    return 2*dv/(diode.iv_current(v0 + dv) - diode.iv_current(v0 - dv))
+
+
+def test_diode_parameters():
+    params = JVParameters(area=0.1, light_power=0.1)
+    params.update(v, i)
+    voc = diode.iv_voltage(0.0)
+    assert params.Voc == pytest.approx(voc, abs=1e-3)
+    assert params.Isc == pytest.approx(-diode.iv_current(0.0), rel=1e-6)
+    assert params.Jsc == pytest.approx(params.Isc/0.1)
+    p = -v*i
+    assert params.Pmax == np.max(p) and params.Vmpp == v[np.argmax(p)]
+    assert 0.7 < params.FF < 0.9
+    assert params.PCE == pytest.approx(params.Pmax/0.01)
+    #the fits average the local slope over a few readings either side
+    assert params.Rs == pytest.approx(slope_dvdi(voc), rel=0.1)
+    assert params.Rsh == pytest.approx(slope_dvdi(0.0), rel=0.1)
+
+
+def test_chunked_updates_match_one_pass():
+    whole = JVParameters()
+    whole.update(v, i)
+    for size in (1, 3, 7):
+        chunked = JVParameters()
+        for k in range(0, v.size, size):
+            chunked.update(v[k:k+size], i[k:k+size])
+        assert chunked.values() == pytest.approx(whole.values(), nan_ok=True)
+
+
+def test_fit_averages_out_noise():
+    rng = np.random.default_rng(0)
+    true = slope_dvdi(0.0)
+    errors = {4: [], 1: []}
+    for _ in range(100):
+        noisy = i + rng.normal(0, 1e-7, i.size)
+        for fit_points in errors:
+            params = JVParameters()
+            params.fit_points = fit_points
+            params.update(v, noisy)
+            errors[fit_points].append(abs(params.Rsh - true))
+    #against the slope of the single segment around V=0
+    assert np.median(errors[4]) < 0.5*np.median(errors[1])
+
+
+def test_reverse_sweep_and_hysteresis():
+    forward, reverse = JVParameters(), JVParameters()
+    forward.update(v, 0.95*i)
+    reverse.update(v[::-1], i[::-1])
+    assert reverse.Voc == pytest.approx(diode.iv_voltage(0.0), abs=1e-3)
+    assert hysteresis_index(forward, reverse) == pytest.approx(0.05, abs=0.01)
+
+
+def test_no_crossing_gives_nan():
+    params = JVParameters()
+    params.update(v[v > 0.2][:20], i[v > 0.2][:20])
+    assert np.isnan(params.Voc) and np.isnan(params.Isc) and np.isnan(params.FF)
@@ -0,0 +1,75 @@
+import time
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def smu(load_smu):
+    return load_smu('2450')
+
+
+def sent(smu, setter, *args):
+    #whether the setter wrote to the instrument or the cache skipped it
+    avoided = smu.writes_avoided
+    setter(*args)
+    return smu.writes_avoided == avoided
+
+
+def test_repeated_writes_are_skipped(smu):
+    assert sent(smu, smu.set_NPLC, 0.02)
+    assert not sent(smu, smu.set_NPLC, 0.02)
+    assert sent(smu, smu.set_NPLC, 0.01)
+
+
+def test_measure_function_change_resends_its_settings(smu):
+    smu.set_measureFunc('Current')
+    smu.set_NPLC(0.02)
+    smu.set_filter_count(4)
+    smu.set_level(0.5)
+    smu.set_measureFunc('Voltage')
+    #the voltage function has its own NPLC and filter, the source level is untouched
+    assert sent(smu, smu.set_NPLC, 0.02)
+    assert sent(smu, smu.set_filter_count, 4)
+    assert not sent(smu, smu.set_level, 0.5)
+    #back to current, which the cache no longer vouches for either
+    smu.set_measureFunc('Current')
+    assert sent(smu, smu.set_NPLC, 0.02)
+
+
+def test_source_function_change_resends_its_settings(smu):
+    smu.set_source('Voltage')
+    smu.set_level(0.5)
+    smu.set_delay(0.01)
+    smu.set_NPLC(0.02)
+    smu.set_source('Current')
+    assert sent(smu, smu.set_level, 0.5)
+    assert sent(smu, smu.set_delay, 0.01)
+    assert not sent(smu, smu.set_NPLC, 0.02)
+
+
+def test_mpp_leaves_the_instrument_timer_running(smu):
+    time.sleep(0.1)
+    t_before = float(smu.keithley.query("print(timer.gettime())"))
+    smu.start_mpp(0.5, 0.01, 0, 1, 0.02, 2)
+    t1 = smu.read_mpp()[0]
+    t2 = smu.read_mpp()[0]
+    assert 0 < t1 < t2 < 0.1
+    assert float(smu.keithley.query("print(timer.gettime())")) > t_before + t2
+
+
+def test_buffered_sweep(smu, monkeypatch):
+    #more points than one configlist write and one buffer read take
+    vlist = np.linspace(0, 1, 2*smu.sweep_chunk + 17)
+    monkeypatch.setattr(smu, 'read_chunk', 64)
+    smu.start_sweep(vlist, 0)
+    t0 = time.perf_counter()
+    while smu.sweep_running():
+        assert time.perf_counter() - t0 < 5, 'sweep did not finish'
+        time.sleep(1e-3)
+    assert smu.read_buffer_count() == vlist.size
+    v, i, t = smu.read_sweep(1, vlist.size)
+    assert np.allclose(v, vlist)
+    assert np.allclose(i, smu.keithley.iv_current(vlist), atol=1e-5)
+    assert t[0] == 0 and np.all(np.diff(t) > 0)
+    #the sweep set the level and the output behind the cache's back
+    assert sent(smu, smu.set_output, 'Off')
@@ -0,0 +1,96 @@
+import time
+import numpy as np
+import pytest
+
+vlist = np.linspace(0, 1, 25)
+
+
+@pytest.fixture
+def smu(load_smu):
+    return load_smu('2600')
+
+
+def wait(running, timeout=5.0):
+    t0 = time.perf_counter()
+    while running():
+        assert time.perf_counter() - t0 < timeout, 'sweep did not finish'
+        time.sleep(1e-3)
+
+
+@pytest.mark.parametrize('ch', ['smua', 'smub'])
+def test_bulk_sweep(smu, ch):
+    smu.start_sweep(vlist, 0, ch)
+    wait(lambda: smu.sweep_running(ch))
+    assert smu.read_buffer_count(ch) == vlist.size
+    v, i, t = smu.read_sweep(1, vlist.size, ch)
+    assert np.allclose(v, vlist)
+    assert np.allclose(i, smu.keithley.iv_current(vlist), atol=1e-5)
+    assert np.all(np.diff(t) > 0)
+
+
+def test_chunked_read_and_formats(smu, monkeypatch):
+    smu.start_sweep(vlist, 0)
+    wait(smu.sweep_running)
+    whole = smu.read_sweep(1, vlist.size)
+    monkeypatch.setattr(smu, 'read_chunk', 7)
+    for buffer_format in ('REAL64', 'REAL32', 'ASCII'):
+        monkeypatch.setattr(smu, 'buffer_format', buffer_format)
+        for a, b in zip(smu.read_sweep(1, vlist.size), whole):
+            assert np.allclose(a, b, rtol=1e-5, atol=1e-6)
+    #part of the buffer, as the acquisition loops read it while the sweep runs
+    v, i, t = smu.read_sweep(5, 12)
+    assert np.allclose(v, vlist[4:12])
+
+
+def test_dual_sweep(smu):
+    smu.start_dual_sweep(vlist, 0)
+    wait(smu.dual_sweep_running)
+    for ch in smu.channels:
+        v, i, t = smu.read_sweep(1, smu.read_buffer_count(ch), ch)
+        assert np.allclose(v, vlist)
+
+
+def test_tracking(smu):
+    smu.set_source('Voltage')
+    smu.set_output('On')
+    smu.set_level(0.5)
+    smu.start_tracking(2e-3, 20)
+    wait(smu.tracking_running)
+    assert smu.read_buffer_count() == 20
+    readings, t = smu.read_tracking(1, 20)
+    assert np.allclose(readings, smu.keithley.iv_current(0.5), atol=1e-5)
+    assert np.allclose(np.diff(t), 2e-3, atol=1e-4)
+
+
+def test_lin_sweep_measure_i(smu):
+    v, i, t = smu.linVSweepMeasureI(0, 1, 11, 1e-3)
+    assert len(v) == len(i) == len(t) == 11
+    assert np.allclose(v, np.linspace(0, 1, 11))
+    assert np.allclose(i, smu.keithley.iv_current(v), atol=1e-5)
+    #the factory script reconfigures the channel, so settings are re-sent
+    assert smu.cached_write('nplc', 0.01, 'smua.measure.nplc = 0.01')
+
+
+def test_tracking_blocks_share_one_clock(smu):
+    #every block clears the buffer, its timestamps would start again at 0
+    smu.set_source('Voltage')
+    smu.set_output('On')
+    t_last = -1
+    for block in range(3):
+        smu.start_tracking(2e-3, 10)
+        wait(smu.tracking_running)
+        readings, t = smu.read_tracking(1, 10)
+        assert t[0] > t_last
+        assert np.all(np.diff(t) > 0)
+        t_last = t[-1]
+
+
+def test_mpp_leaves_the_instrument_timer_running(smu):
+    #tracking and other scripts count on timer.measure.t(), the MPP loop keeps its own start
+    time.sleep(0.1)
+    t_before = float(smu.keithley.query("print(timer.measure.t())"))
+    smu.start_mpp(0.5, 0.01, 0, 1, 0.02, 2)
+    t1 = smu.read_mpp()[0]
+    t2 = smu.read_mpp()[0]
+    assert 0 < t1 < t2 < 0.1
+    assert float(smu.keithley.query("print(timer.measure.t())")) > t_before + t2
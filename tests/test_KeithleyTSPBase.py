@@ -0,0 +1,105 @@
+import pytest
+
+
+def timing_out_once(sim, monkeypatch, cmd):
+    #the next query of cmd times out, as on a wedged bus
+    import pyvisa
+    query = sim.query
+    failed = []
+
+    def query_once(text):
+        if cmd in text and not failed:
+            failed.append(text)
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        return query(text)
+    monkeypatch.setattr(sim, 'query', query_once)
+    return failed
+
+
+@pytest.fixture
+def no_reset(load_smu):
+    #a 2450 that connects without a reset
+    smu = load_smu('2450')
+    smu.settings['reset_on_connect'] = False
+    yield smu
+    smu.settings['reset_on_connect'] = True
+
+
+@pytest.mark.parametrize('model', ['2450', '2600'])
+def test_library_is_loaded_once_per_version(load_smu, monkeypatch, model):
+    smu = load_smu(model)
+    #the instrument keeps the library through a new session
+    writes = smu.keithley.n_writes
+    smu.reconnect()
+    assert smu.keithley.n_writes == writes
+    assert not smu.load_library()
+
+    #an edited library is sent again
+    monkeypatch.setattr(smu, 'library_version', 'edited')
+    assert smu.load_library()
+    assert smu.keithley.n_writes >= writes + len(smu.tsp_library)
+    assert smu.keithley.query("print(jvlib_version)").strip() == 'edited'
+    assert smu.query_settings('nplc', 'output') == ['0.01', 'Off']
+
+
+def test_connect_reads_the_instrument_state_back_in_one_query(no_reset, simulated_bus):
+    smu = no_reset
+    smu.set_NPLC(0.02)
+    smu.set_filter_count(3)
+    #the instrument outlives the session while the bus is held
+    simulated_bus.acquire()
+    try:
+        sim = smu.keithley.resource
+        smu.settings['connected'] = False
+        queries, writes = sim.n_queries, sim.n_writes
+        smu.settings['connected'] = True
+        #the library version and one jv_print, no reset and nothing written
+        assert sim.n_queries - queries == 2 and sim.n_writes == writes
+        assert smu.settings['NPLC'] == 0.02 and smu.settings['Filter_Count'] == 3
+    finally:
+        simulated_bus.release()
+
+
+def test_settings_read_reconnects_after_a_timeout(load_smu, monkeypatch):
+    smu = load_smu('2450')
+    failed = timing_out_once(smu.keithley.resource, monkeypatch, 'jv_print')
+    smu.settings.as_dict()['NPLC'].read_from_hardware()
+    assert failed and smu.settings['NPLC'] == 0.01
+
+
+def test_connect_retries_with_a_device_clear(no_reset, simulated_bus, monkeypatch):
+    smu = no_reset
+    monkeypatch.setattr(smu, 'retry_delay', 0)
+    simulated_bus.acquire()
+    try:
+        sim = smu.keithley.resource
+        smu.settings['connected'] = False
+        failed = timing_out_once(sim, monkeypatch, 'jvlib_version')
+        cleared = []
+        monkeypatch.setattr(sim, 'clear', lambda: cleared.append(1))
+        smu.settings['connected'] = True
+        assert failed and cleared == [1]
+        assert smu.settings['NPLC'] == 0.01
+    finally:
+        simulated_bus.release()
+
+
+@pytest.mark.parametrize('model, address', [('2450', 'GPIB0::18::INSTR'), ('2600', 'GPIB0::26::INSTR')])
+def test_auto_address_connects_to_the_matching_instrument(load_smu, monkeypatch, model, address):
+    smu = load_smu(model)
+    smu.settings['connected'] = False
+    smu.settings['VISA_address'] = 'auto'
+    try:
+        smu.settings['connected'] = True
+        assert smu.settings['VISA_address'] == address
+        assert smu.keithley.query('*IDN?').split(',')[1] == 'MODEL ' + model
+
+        smu.settings['connected'] = False
+        smu.settings['VISA_address'] = 'auto'
+        monkeypatch.setattr(smu, 'idn_pattern', r'MODEL\s*6517')
+        with pytest.raises(IOError, match='no instrument matching'):
+            smu.connect()
+        #as ScopeFoundry does after a failed connect, lets go of the pool
+        smu.disconnect()
+    finally:
+        smu.settings['VISA_address'] = address
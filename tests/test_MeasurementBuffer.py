@@ -0,0 +1,39 @@
+import numpy as np
+from MeasurementBuffer import MeasurementBuffer
+
+
+def test_grows_past_capacity():
+    store = MeasurementBuffer(capacity=4)
+    for k in range(10):
+        store.append(k, 2*k, 3*k)
+    assert len(store) == store.total == 10
+    assert np.array_equal(store.view('time'), np.arange(10))
+    assert np.array_equal(store.view('value'), 3*np.arange(10))
+
+
+def test_ring_keeps_newest_window_in_order():
+    store = MeasurementBuffer(window=5)
+    for start in range(0, 23, 3):
+        t = np.arange(start, start + 3)
+        store.extend(t, t, t)
+    #24 points appended, the last 5 survive, contiguous across the wrap
+    assert store.total == 24 and len(store) == 5
+    assert np.array_equal(store.view('time'), np.arange(19, 24))
+    assert np.array_equal(store.view('source'), np.arange(19, 24))
+
+
+def test_ring_extend_longer_than_window():
+    store = MeasurementBuffer(window=4)
+    store.extend(np.arange(3), 0, np.arange(3))
+    store.extend(np.arange(3, 13), 0, np.arange(3, 13))
+    assert np.array_equal(store.view('value'), np.arange(9, 13))
+    assert np.all(store.view('source') == 0)
+
+
+def test_view_is_zero_copy_and_clear():
+    store = MeasurementBuffer(window=3)
+    store.extend(np.arange(7), 0, np.arange(7))
+    view = store.view('value')
+    assert np.shares_memory(view, store._arrays['value'])
+    store.clear()
+    assert len(store) == 0 and store.view('value').size == 0
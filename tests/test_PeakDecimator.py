@@ -0,0 +1,60 @@
+import numpy as np
+from PeakDecimator import PeakDecimator
+
+
+def feed(decimator, x, y, chunks):
+    edges = np.cumsum(chunks)
+    for a, b in zip(np.r_[0, edges[:-1]], edges):
+        decimator.extend(x[a:b], y[a:b])
+
+
+def test_size_is_bounded_and_keeps_the_envelope():
+    rng = np.random.default_rng(0)
+    x = np.arange(100000, dtype=float)
+    y = rng.normal(size=x.size)
+    y[31337] = 50 #a one point glitch
+    decimator = PeakDecimator(max_buckets=500)
+    feed(decimator, x, y, rng.integers(1, 700, size=400))
+    decimator.extend(x[decimator.total:], y[decimator.total:])
+
+    dx, dy = decimator.data()
+    assert decimator.total == x.size
+    assert dx.size <= 2*(500 + 1)
+    assert dy.max() == 50 and dy.min() == y.min()
+    assert np.all(np.diff(dx) >= 0)
+
+
+def test_chunks_give_the_same_result_as_one_extend():
+    rng = np.random.default_rng(1)
+    x = np.cumsum(rng.uniform(0.5, 1.5, size=12345))
+    y = rng.normal(size=x.size)
+    whole = PeakDecimator(max_buckets=300)
+    whole.extend(x, y)
+    chunked = PeakDecimator(max_buckets=300)
+    feed(chunked, x, y, [1, 2, 997, 3000, 1, 8344])
+
+    assert chunked.bucket_size == whole.bucket_size
+    for a, b in zip(chunked.data(), whole.data()):
+        assert np.array_equal(a, b)
+
+
+def test_trim_drops_buckets_before_the_window():
+    decimator = PeakDecimator(max_buckets=100)
+    x = np.arange(5000, dtype=float)
+    for k in range(0, x.size, 250):
+        decimator.extend(x[k:k+250], x[k:k+250])
+        decimator.trim(k + 250 - 1000)
+    dx, dy = decimator.data()
+    #at most one bucket of points older than the window is left
+    assert dx.min() > 4000 - decimator.bucket_size
+    assert dy.max() == 4999
+
+
+def test_clear_starts_at_a_given_index():
+    decimator = PeakDecimator(max_buckets=10)
+    decimator.extend(np.arange(100), np.arange(100))
+    decimator.clear(500)
+    assert decimator.total == 500 and decimator.data()[0].size == 0
+    decimator.extend([1., 2.], [3., 4.])
+    assert decimator.total == 502
+    assert np.array_equal(decimator.data()[1], [3, 3, 4, 4])
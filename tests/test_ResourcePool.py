@@ -0,0 +1,28 @@
+from ResourcePool import ResourcePool
+from SimulatedKeithley import SimulatedResourceManager
+
+bus = {'GPIB0::18::INSTR': '2450', 'GPIB0::24::INSTR': '2450', 'GPIB0::26::INSTR': '2600'}
+
+
+def test_manager_is_shared_until_the_last_user_releases():
+    made = []
+    pool = ResourcePool(factory=lambda: made.append(SimulatedResourceManager(bus)) or made[-1])
+    first = pool.acquire()
+    assert pool.acquire() is first and len(made) == 1
+    pool.release()
+    assert pool.manager is first
+    pool.release()
+    assert pool.manager is None
+    assert pool.acquire() is not first and len(made) == 2
+
+
+def test_find_asks_each_address_once():
+    manager = SimulatedResourceManager(bus)
+    pool = ResourcePool(factory=lambda: manager)
+    pool.acquire()
+    assert pool.find(r'MODEL\s*2450') == ['GPIB0::18::INSTR', 'GPIB0::24::INSTR']
+    assert pool.find(r'MODEL\s*2450', exclude=['GPIB0::18::INSTR']) == ['GPIB0::24::INSTR']
+    assert pool.find(r'MODEL\s*26\d\d') == ['GPIB0::26::INSTR']
+    #the replies are cached while the manager is open
+    assert sum(sim.n_queries for sim in manager.instruments.values()) == 3
+    pool.release()
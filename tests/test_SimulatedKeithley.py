@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from SimulatedKeithley import SimulatedKeithley, SimulatedResourceManager
+
+
+def sim(model):
+    smu = SimulatedKeithley(model, seed=0)
+    if model == '2450':
+        smu.write("smu.measure.nplc = 0.01")
+    else:
+        smu.write("smua.measure.nplc = 0.01")
+    return smu
+
+
+def test_iv_curve():
+    smu = SimulatedKeithley()
+    i = smu.iv_current(np.array([0.0, 0.5, 1.2]))
+    #generated current is negative, around Isc at 0 V, and the cell conducts forward above Voc
+    assert i[0] == pytest.approx(-smu.Iph, rel=1e-2)
+    assert i[0] < i[1] < 0 < i[2]
+    assert smu.iv_voltage(i[1]) == pytest.approx(0.5, abs=1e-6)
+
+
+def test_2450_list_sweep():
+    smu = sim('2450')
+    levels = np.linspace(0, 1, 21)
+    smu.write("smu.source.configlist.create('JVLIST')")
+    smu.write("for _, v in ipairs({{{}}}) do smu.source.level = v smu.source.configlist.store('JVLIST') end".format(
+        ','.join('{:.9g}'.format(v) for v in levels)))
+    smu.write("defbuffer1.clear()")
+    smu.write("smu.source.sweeplist('JVLIST', 1, 0.000000, 1, smu.OFF, defbuffer1)")
+    smu.write("trigger.model.initiate()")
+    assert smu.query("print(trigger.model.state())").split()[0] == 'trigger.STATE_RUNNING'
+
+    smu.write("waitcomplete()")
+    assert smu.query("print(trigger.model.state())").split()[0] == 'trigger.STATE_IDLE'
+    assert int(float(smu.query("print(defbuffer1.n)"))) == levels.size
+    data = np.array(smu.query("printbuffer(1, 21, defbuffer1.sourcevalues, defbuffer1.readings)").split(','), dtype=float).reshape(-1, 2)
+    assert np.allclose(data[:, 0], levels)
+    assert np.allclose(data[:, 1], smu.iv_current(levels), atol=1e-5)
+
+
+def test_2450_binary_printbuffer():
+    smu = sim('2450')
+    smu.write("smu.source.level = 0.3")
+    smu.write("trigger.model.load('Empty')")
+    smu.write("trigger.timer[1].delay = 0.001")
+    smu.write("trigger.model.setblock(3, trigger.BLOCK_MEASURE_DIGITIZE, defbuffer1)")
+    smu.write("trigger.model.setblock(4, trigger.BLOCK_BRANCH_COUNTER, 10, 2)")
+    smu.write("trigger.model.initiate()")
+    smu.write("waitcomplete()")
+
+    ascii = np.array(smu.query("printbuffer(1, 10, defbuffer1.readings, defbuffer1.relativetimestamps)").split(','), dtype=float)
+    for fmt, datatype in (('REAL32', 'f'), ('REAL64', 'd')):
+        binary = smu.query_binary_values(
+            "format.byteorder = format.LITTLEENDIAN format.data = format.{} printbuffer(1, 10, defbuffer1.readings, defbuffer1.relativetimestamps) format.data = format.ASCII".format(fmt),
+            datatype=datatype, is_big_endian=False, container=np.array)
+        assert np.allclose(binary, ascii, rtol=1e-5, atol=1e-9)
+    t = ascii[1::2]
+    assert t[0] == 0 and np.allclose(np.diff(t), 1e-3, atol=1e-6)
+
+
+def test_2600_list_sweep_and_abort():
+    smu = sim('2600')
+    levels = np.linspace(0, 1, 11)
+    smu.write("jvlist_smua = {}")
+    smu.write("for _, v in ipairs({{{}}}) do table.insert(jvlist_smua, v) end".format(','.join('{:.9g}'.format(v) for v in levels)))
+    smu.write("smua.nvbuffer1.clear()")
+    smu.write("smua.source.delay = 0.001")
+    smu.write("smua.trigger.source.listv(jvlist_smua)")
+    smu.write("smua.trigger.measure.i(smua.nvbuffer1)")
+    smu.write("smua.trigger.count = 11")
+    smu.write("smua.trigger.initiate()")
+    running = "print(bit.bitand(status.operation.sweeping.condition, status.operation.sweeping.SMUA))"
+    assert int(float(smu.query(running))) != 0
+
+    smu.write("waitcomplete()")
+    assert int(float(smu.query(running))) == 0
+    data = np.array(smu.query("printbuffer(1, 11, smua.nvbuffer1.sourcevalues, smua.nvbuffer1.readings)").split(','), dtype=float).reshape(-1, 2)
+    assert np.allclose(data[:, 0], levels)
+
+    smu.write("smua.nvbuffer1.clear()")
+    smu.write("smua.trigger.initiate()")
+    smu.write("smua.abort()")
+    assert int(float(smu.query(running))) == 0
+    assert int(float(smu.query("print(smua.nvbuffer1.n)"))) < levels.size
+
+
+def test_2600_overlapped_readings_fill_over_time():
+    smu = sim('2600')
+    smu.write("smua.source.levelv = 0.5")
+    smu.write("smua.nvbuffer1.clear()")
+    smu.write("smua.measure.count = 20")
+    smu.write("smua.measure.interval = 0.005")
+    smu.write("smua.measure.overlappedi(smua.nvbuffer1)")
+    n_first = int(float(smu.query("print(smua.nvbuffer1.n)")))
+    smu.write("waitcomplete()")
+    assert n_first < 20
+    assert int(float(smu.query("print(smua.nvbuffer1.n)"))) == 20
+    readings = np.array(smu.query("printbuffer(1, 20, smua.nvbuffer1.readings)").split(','), dtype=float)
+    assert np.allclose(readings, smu.iv_current(0.5), atol=1e-5)
+
+
+def test_resource_manager_identifies_models():
+    rm = SimulatedResourceManager({'GPIB0::18::INSTR': '2450', 'GPIB0::26::INSTR': '2600'})
+    assert set(rm.list_resources()) == {'GPIB0::18::INSTR', 'GPIB0::26::INSTR'}
+    assert '2450' in rm.open_resource('GPIB0::18::INSTR').query('*IDN?')
+    assert rm.open_resource('GPIB0::26::INSTR') is rm.open_resource('GPIB0::26::INSTR')
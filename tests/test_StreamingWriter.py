@@ -0,0 +1,70 @@
+import os
+import time
+import numpy as np
+import pytest
+from StreamingWriter import StreamingWriter, H5StreamingWriter
+
+
+def test_rows_reach_the_part_file_before_close(tmp_path):
+    fname = str(tmp_path / 'cell.csv')
+    writer = StreamingWriter(fname, 0.02, columns=(0, 2), header='Current Tracking')
+    writer.push(np.arange(3.), 0.5, 1e-3*np.arange(3.))
+    writer.push(3., 0.5, 3e-3)
+    time.sleep(0.2)
+    #flushed while the run goes on, the data file only appears on close
+    assert not os.path.exists(fname)
+    assert np.loadtxt(fname + '.part', delimiter=',').shape == (4, 2)
+    writer.close()
+    assert not os.path.exists(fname + '.part')
+    with open(fname) as f:
+        assert f.readline() == '# Current Tracking\n'
+    assert np.allclose(np.loadtxt(fname, delimiter=','), np.column_stack((np.arange(4.), 1e-3*np.arange(4.))))
+    assert writer.rows == 4
+
+
+def test_recover_drops_a_partial_last_row(tmp_path):
+    part = tmp_path / 'cell.csv.part'
+    part.write_text('0,1\n1,2\n2,')
+    fname = StreamingWriter.recover(str(part))
+    assert fname == str(tmp_path / 'cell.csv')
+    assert np.allclose(np.loadtxt(fname, delimiter=','), [[0, 1], [1, 2]])
+
+    #an existing data file is not overwritten
+    part.write_text('5,6\n')
+    assert StreamingWriter.recover(str(part)) == str(tmp_path / 'cell_recovered.csv')
+
+
+def test_recover_dir_leaves_live_writers_alone(tmp_path):
+    dead = tmp_path / 'dead.csv.part'
+    dead.write_text('0,1\n')
+    old = time.time() - 120
+    os.utime(dead, (old, old))
+    (tmp_path / 'fresh.csv.part').write_text('0,1\n')
+    writer = StreamingWriter(str(tmp_path / 'open.csv'), 0.02)
+    os.utime(writer.part_fname, (old, old))
+    try:
+        recovered = StreamingWriter.recover_dir(str(tmp_path), stale_after=60)
+    finally:
+        writer.close()
+    assert recovered == [str(tmp_path / 'dead.csv')]
+    assert (tmp_path / 'fresh.csv.part').exists()
+
+
+def test_h5_runs_of_a_sample_share_one_file(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    fname = str(tmp_path / 'cell.h5')
+    for run in range(2):
+        writer = H5StreamingWriter(fname, 0.02, chunk=64)
+        writer.run_group.attrs['Measurement'] = 'JV Measurement'
+        for k in range(3):
+            writer.push(np.arange(100.) + 100*k, 0.5, run + np.zeros(100))
+        writer.close()
+
+    with h5py.File(fname, 'r') as f:
+        assert sorted(f) == ['run_0000', 'run_0001'] and f.attrs['next_run'] == 2
+        for run, name in enumerate(sorted(f)):
+            group = f[name]
+            assert group.attrs['Measurement'] == 'JV Measurement' and 'created' in group.attrs
+            assert group['time'].chunks == (64,) and group['time'].compression == 'gzip'
+            assert np.array_equal(group['time'][:], np.arange(300.))
+            assert np.all(group['source'][:] == 0.5) and np.all(group['value'][:] == run)
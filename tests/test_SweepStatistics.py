@@ -0,0 +1,54 @@
+import numpy as np
+from SweepStatistics import sweep_statistics
+
+v = np.linspace(-0.2, 1.2, 303)
+#JV curve of a cell, the noise of each point in proportion to its current as on an autoranging SMU
+diode = 1e-12*(np.exp(v/0.0257) - 1) - 20e-3
+
+
+def test_mean_and_std():
+    currents = np.array([[1., 2.], [3., 4.], [5., 9.]])
+    stats = sweep_statistics(currents, outlier_sigma=0)
+    assert np.allclose(stats['mean'], [3, 5])
+    assert np.allclose(stats['std'], np.std(currents, axis=0, ddof=1))
+    assert np.array_equal(stats['clean_mean'], stats['mean'])
+    assert not stats['outliers'].any() and np.all(stats['n_used'] == 3)
+
+
+def test_flags_a_glitch():
+    rng = np.random.default_rng(0)
+    currents = rng.normal(0, 1e-6, (10, 101))
+    currents[3, 50] += 1e-4
+    stats = sweep_statistics(currents)
+    assert stats['outliers'][3, 50]
+    assert stats['outliers'].sum() == 1
+    assert abs(stats['clean_mean'][50]) < 1e-6 < abs(stats['mean'][50])
+    assert stats['n_used'][50] == 9
+
+
+def test_pure_noise_flags_almost_nothing():
+    rng = np.random.default_rng(1)
+    for n in (5, 6, 10, 20):
+        constant = rng.normal(0, 1e-6, (200, n, v.size))
+        relative = diode*(1 + 1e-3*rng.normal(size=(200, n, v.size)))
+        for currents in (constant, relative):
+            flagged = np.mean([sweep_statistics(c)['outliers'].mean() for c in currents])
+            assert flagged < 5e-4, (n, flagged)
+
+
+def test_point_never_loses_every_reading():
+    #six sweeps split in two triples far apart: every reading is far from the median between them
+    currents = np.zeros((6, 50)) + np.arange(6)[:, None]*1e-9
+    currents[3:, 0] += 1.0
+    stats = sweep_statistics(currents)
+    assert stats['n_used'][0] == 6 and not stats['outliers'][:, 0].any()
+    assert stats['clean_mean'][0] == stats['mean'][0]
+
+
+def test_too_few_sweeps_flag_nothing():
+    rng = np.random.default_rng(2)
+    currents = rng.normal(0, 1e-6, (4, 101))
+    currents[1, 20] += 1e-3
+    assert not sweep_statistics(currents)['outliers'].any()
+    stats = sweep_statistics([0., 1., 2.])
+    assert stats['mean'].shape == (3,) and np.all(stats['n_used'] == 1)
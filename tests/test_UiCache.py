@@ -0,0 +1,26 @@
+import os
+import pytest
+
+try:
+    import UiCache
+except Exception as e:
+    pytest.skip('ScopeFoundry is not usable: {}'.format(e), allow_module_level=True)
+
+ui_fname = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'JVMeasurement_ui.ui')
+
+
+def test_cached_launch_does_not_parse_the_ui(tmp_path, monkeypatch):
+    pytest.importorskip('qtpy.uic')
+    monkeypatch.setattr(UiCache, 'cache_dir', str(tmp_path))
+    module = UiCache.compiled_ui_module(ui_fname)
+    assert module.root_class == 'QWidget'
+    assert len(os.listdir(str(tmp_path))) == 1
+
+    #from now on neither uic nor the XML parser is needed
+    import xml.etree.ElementTree as ET
+    monkeypatch.setattr(ET, 'fromstring', None)
+    monkeypatch.setattr(ET, 'parse', None)
+    monkeypatch.setattr('qtpy.uic.compileUi', None)
+    module = UiCache.compiled_ui_module(ui_fname)
+    assert module.root_class == 'QWidget'
+    assert any(name.startswith('Ui_') for name in dir(module))
@@ -0,0 +1,49 @@
+import csv
+import os
+import numpy as np
+import analyze_archive
+from JVParameters import JVParameters
+from SimulatedKeithley import SimulatedKeithley
+
+diode = SimulatedKeithley()
+v = np.linspace(0, 1, 101)
+
+
+def write(path, columns, header=None):
+    path.parent.mkdir(exist_ok=True)
+    np.savetxt(str(path), np.column_stack(columns), delimiter=',', header=header or '', comments='# ' if header else '')
+
+
+def summary(tmp_path, capsys):
+    analyze_archive.main([str(tmp_path / 'data'), str(tmp_path / 'summary.csv'), '--area', '0.1', '--jobs', '2'])
+    with open(str(tmp_path / 'summary.csv')) as f:
+        rows = dict((row['file'], row) for row in csv.DictReader(f))
+    return rows, capsys.readouterr().out
+
+
+def test_archive_summary_and_cache(tmp_path, capsys):
+    data = tmp_path / 'data'
+    write(data / 'cell.csv', (v, diode.iv_current(v)), 'JV Measurement')
+    write(data / 'cell_params.csv', ([1.], [2.]))
+    write(data / 'cell_1.csv', (np.arange(20.), diode.iv_current(np.full(20, 0.5))), 'Current Tracking')
+    write(data / 'old' / 'reverse.csv', (v[::-1], diode.iv_current(v[::-1])))
+    (data / 'broken.csv').write_text('V,I\n')
+
+    rows, out = summary(tmp_path, capsys)
+    assert sorted(rows) == ['broken.csv', 'cell.csv', 'cell_1.csv', 'old/reverse.csv']
+    params = JVParameters()
+    params.update(v, diode.iv_current(v))
+    for name in ('cell.csv', 'old/reverse.csv'):
+        assert np.isclose(float(rows[name]['Voc']), params.Voc)
+        assert np.isclose(float(rows[name]['Jsc']), params.Isc/0.1)
+    assert rows['cell_1.csv']['points'] == '20' and rows['cell_1.csv']['Voc'] == 'nan'
+    assert rows['broken.csv']['error'] and rows['broken.csv']['Voc'] == ''
+    assert '4 files, 0 cached, 4 to analyse' in out
+
+    #only the changed file is read again
+    write(data / 'cell.csv', (v, 2*diode.iv_current(v)), 'JV Measurement')
+    st = os.stat(str(data / 'cell.csv'))
+    os.utime(str(data / 'cell.csv'), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    rows, out = summary(tmp_path, capsys)
+    assert '4 files, 3 cached, 1 to analyse' in out
+    assert np.isclose(float(rows['cell.csv']['Isc']), 2*params.Isc)
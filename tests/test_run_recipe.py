@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+try:
+    from run_recipe import RecipeRunner, RecipeError
+except Exception as e:
+    pytest.skip('ScopeFoundry is not usable: {}'.format(e), allow_module_level=True)
+
+jv = {'type': 'jv', 'name': 'forward', 'start': 0, 'stop': 1, 'npoints': 11}
+track = {'type': 'track', 'mode': 'current', 'level': 0.5, 'time': 0.1, 'period': 0.01}
+
+
+def test_repeats_are_unrolled_with_labels():
+    runner = RecipeRunner(None, {'steps': [{'type': 'soak', 'time': 1},
+                                           {'type': 'repeat', 'count': 2, 'steps': [jv, track]}]})
+    assert [label for label, step in runner.plan] == ['001 soak', '002 1/2 forward', '003 1/2 track',
+                                                      '004 2/2 forward', '005 2/2 track']
+
+
+@pytest.mark.parametrize('steps, message', [
+    ([dict(jv, stop='1')], 'stop'),
+    ([dict(jv, npoints=True)], 'npoints'),
+    ([dict(jv, stpo=1)], 'unknown keys stpo'),
+    ([dict(track, mode='power')], 'mode'),
+    ([{'type': 'repeat', 'count': 2, 'steps': [{'type': 'sweep'}]}], "unknown step type 'sweep'"),
+    ([{'type': 'wait'}], 'missing time'),
+])
+def test_bad_steps_are_rejected_before_anything_runs(steps, message):
+    with pytest.raises(RecipeError, match=message):
+        RecipeRunner(None, {'steps': steps})
+
+
+def test_recipe_runs_on_the_simulated_smu(load_smu, tmp_path):
+    recipe = {'save_dir': str(tmp_path), 'sample': 'cell', 'format': 'csv',
+              'steps': [{'type': 'repeat', 'count': 2, 'steps': [jv, track]}]}
+    runner = RecipeRunner(load_smu('2450'), recipe)
+    runner.run()
+
+    assert [n for label, n, elapsed in runner.timing][0::2] == [11, 11]
+    v, i = np.loadtxt(str(tmp_path / 'cell_003_forward.csv'), delimiter=',', unpack=True)
+    assert np.allclose(v, np.linspace(0, 1, 11))
+    t, i = np.loadtxt(str(tmp_path / 'cell_004_track.csv'), delimiter=',', unpack=True)
+    assert t.size >= 5 and np.all(np.diff(t) > 0)
+    assert runner.hw.read_output() == 'Off'